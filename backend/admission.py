@@ -0,0 +1,356 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from starlette.routing import Match
+
+from instrumentation import current_stats
+from metrics import Counter, Gauge, Histogram
+
+# =============================================
+# 受け付け制御（ルートの種類ごとの同時実行数の上限）
+# =============================================
+#
+# DB が遅くなると、すべてのリクエストがコネクションプールの空きを待ち、タイムアウトまで
+# 溜まり続けて API 全体が応答しなくなる。ここではルートを種類（軽い読み取り・重い読み取り・
+# 書き込み・認証・一括処理）に分け、種類ごとに同時に処理する数を制限する。
+#
+# - 上限を超えた分は種類ごとの待ち行列（上限 max_queue 件）で待つ。
+#   待ち時間の見積もり（前に並んでいる数 ÷ 上限 × 直近の処理時間）が ADMISSION_MAX_WAIT 秒を
+#   超える場合や、待ち行列が満杯の場合は、待たせずに 503 と Retry-After を返す。
+#   実際に ADMISSION_MAX_WAIT 秒待っても順番が来なかった場合も 503 にする。
+# - 上限は処理時間から調整する（adaptive の種類のみ）。直近の処理時間（短期の平均）が
+#   普段の処理時間（長期の平均）の ADMISSION_LATENCY_TOLERANCE 倍を超えたら伸びた割合に
+#   応じて上限を下げ、上限いっぱいまで使っていて処理時間が伸びていなければ少しずつ上げる
+#   （設定値の 1/4〜4 倍の範囲）。
+# - 一括リクエストの親（子の各リクエストがそれぞれ受け付けられる）、変更通知（SSE）、
+#   ヘルスチェック・メトリクス・管理用のエンドポイントは対象外。
+# - 種類はルートで決まるが、レスポンスキャッシュから返せるかどうかで重さが大きく変わるルート
+#   （記事一覧）は軽い読み取りとして受け付け、キャッシュに無く DB を読む場合にだけ
+#   escalate() で重い読み取りの枠に移る（キャッシュから返すリクエストは DB が遅くても断らない）。
+#
+# 上限と待ち行列はワーカープロセスごと。
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# 待ち時間の上限（秒）
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "2"))
+# 直近の処理時間がこの倍率を超えて伸びたら上限を下げる
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "1.5"))
+# 短期・長期の平均の重み（指数移動平均）と、上限の変更の反映率
+ADMISSION_SHORT_ALPHA = 0.2
+ADMISSION_LONG_ALPHA = 0.01
+ADMISSION_SMOOTHING = 0.2
+# 上限を変更する最短の間隔（秒）。変更の効果が処理時間に表れる前に、続けて変更しない
+# （直近の処理時間の方が長ければそちらを使う）
+ADMISSION_ADJUST_INTERVAL = 0.1
+
+admission_limit = Gauge("admission_limit", "同時に処理するリクエスト数の上限", ["route_class"])
+admission_in_flight = Gauge("admission_in_flight", "処理中のリクエスト数", ["route_class"])
+admission_queue_depth = Gauge("admission_queue_depth", "順番を待っているリクエスト数", ["route_class"])
+admission_latency_seconds = Gauge(
+    "admission_latency_seconds", "処理時間の平均（short: 直近、long: 普段）", ["route_class", "window"]
+)
+admission_wait_seconds = Histogram(
+    "admission_wait_seconds", "受け付けまでの待ち時間（秒）", ["route_class"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0),
+)
+admission_rejected_total = Counter(
+    "admission_rejected_total", "503 で断ったリクエスト数（queue_full / deadline / timeout）",
+    ["route_class", "reason"],
+)
+
+
+class RouteClass(NamedTuple):
+    """ルートの種類ごとの設定"""
+    limit: int
+    max_queue: int
+    adaptive: bool
+
+
+def _route_class(name: str, limit: int, adaptive: bool = True) -> RouteClass:
+    limit = int(os.getenv(f"ADMISSION_{name.upper()}_LIMIT", str(limit)))
+    return RouteClass(limit, int(os.getenv(f"ADMISSION_{name.upper()}_QUEUE", str(limit * 4))), adaptive)
+
+
+# 読み取りの多くはキャッシュから返すため上限を高くし、DB を使う種類の合計はプール
+# （DB_POOL_SIZE + DB_MAX_OVERFLOW）に収まるようにする
+ROUTE_CLASSES = {
+    "light_read": _route_class("light_read", 64),
+    "heavy_read": _route_class("heavy_read", 8),
+    "write": _route_class("write", 8),
+    "auth": _route_class("auth", 16),
+    # ストリーミングで長時間かかるため、処理時間からは調整しない
+    "bulk": _route_class("bulk", 2, adaptive=False),
+}
+
+# 既定の分類（GET は light_read、それ以外は write）と異なるルート（メソッド, パスのテンプレート）
+# GET /api/posts はキャッシュに無い場合にルートの中で heavy_read に移る
+ROUTE_CLASS_OVERRIDES = {
+    ("GET", "/api/posts/search"): "heavy_read",
+    ("GET", "/api/projects/{project_id}/tasks"): "heavy_read",
+    ("POST", "/api/auth/login"): "auth",
+    ("POST", "/api/auth/register"): "auth",
+    ("PUT", "/api/auth/change-password"): "auth",
+    ("GET", "/api/posts/export"): "bulk",
+    ("POST", "/api/posts/bulk"): "bulk",
+}
+# 受け付け制御の対象外のパス
+ADMISSION_EXEMPT_PATHS = {
+    "/", "/api/health", "/api/metrics", "/api/admin/jobs", "/api/batch", "/api/events",
+}
+
+
+REJECTED_DETAIL = "混み合っています。しばらくしてから再度お試しください"
+
+
+class AdmissionRejected(Exception):
+    """待たせずに断る場合（retry_after は再試行までの目安の秒数）"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+    """同時実行数の上限と待ち行列（上限は処理時間から調整する）"""
+
+    def __init__(self, name: str, config: RouteClass, max_wait: float):
+        self.name = name
+        self.adaptive = config.adaptive
+        self.min_limit = max(1, config.limit // 4) if config.adaptive else config.limit
+        self.max_limit = config.limit * 4 if config.adaptive else config.limit
+        self.max_queue = config.max_queue
+        self.max_wait = max_wait
+        self.limit = float(config.limit)
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._next_adjust = 0.0
+        admission_limit.set(self.limit, route_class=name)
+
+    def estimated_wait(self, position: int) -> float:
+        """position 件が前に並んでいる場合の待ち時間の見積もり（秒）"""
+        return (position + 1) / max(math.floor(self.limit), 1) * (self._short or 0.0)
+
+    async def acquire(self) -> None:
+        """処理を始めてよくなるまで待つ（断る場合は AdmissionRejected）"""
+        if self.in_flight < math.floor(self.limit) and not self._waiters:
+            self._start()
+            return
+        position = len(self._waiters)
+        estimate = self.estimated_wait(position)
+        if position >= self.max_queue:
+            raise AdmissionRejected("queue_full", estimate)
+        if estimate > self.max_wait:
+            raise AdmissionRejected("deadline", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._update_queue_depth()
+        try:
+            await asyncio.wait_for(future, timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected("timeout", self.estimated_wait(len(self._waiters)))
+        except BaseException:
+            # 順番が来た直後に中断された場合は、受け取った枠を返す
+            if future.done() and not future.cancelled():
+                self.release(None)
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                self._discard(future)
+
+    def release(self, elapsed: Optional[float]) -> None:
+        """処理の終了（elapsed は処理時間。None なら上限の調整に使わない）"""
+        if elapsed is not None:
+            self._observe(elapsed)
+        self.in_flight -= 1
+        self._wake()
+        admission_in_flight.set(self.in_flight, route_class=self.name)
+
+    def _start(self) -> None:
+        self.in_flight += 1
+        admission_in_flight.set(self.in_flight, route_class=self.name)
+
+    def _wake(self) -> None:
+        """空いた枠の分だけ、待っているリクエストを先頭から始める"""
+        while self._waiters and self.in_flight < math.floor(self.limit):
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            future.set_result(None)
+            self._start()
+        self._update_queue_depth()
+
+    def _discard(self, future: asyncio.Future) -> None:
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+        self._update_queue_depth()
+
+    def _update_queue_depth(self) -> None:
+        admission_queue_depth.set(len(self._waiters), route_class=self.name)
+
+    def _observe(self, elapsed: float) -> None:
+        if self._short is None:
+            self._short = self._long = elapsed
+        else:
+            self._short += ADMISSION_SHORT_ALPHA * (elapsed - self._short)
+            self._long += ADMISSION_LONG_ALPHA * (elapsed - self._long)
+            # 負荷が下がって処理時間が戻った場合は、普段の処理時間も早めに下げる
+            if self._long > self._short * 2:
+                self._long *= 0.95
+        admission_latency_seconds.set(self._short, route_class=self.name, window="short")
+        admission_latency_seconds.set(self._long, route_class=self.name, window="long")
+        now = time.monotonic()
+        if not self.adaptive or self._short <= 0 or now < self._next_adjust:
+            return
+
+        gradient = max(0.5, min(1.0, ADMISSION_LATENCY_TOLERANCE * self._long / self._short))
+        if gradient < 1.0:
+            # 処理時間が伸びている間は、伸びた割合に応じて下げる
+            target = self.limit * gradient
+        elif self.in_flight >= self.limit - 1:
+            # 上限いっぱいまで使っていて処理時間が伸びていなければ、√上限 だけ上げる
+            target = self.limit + math.sqrt(self.limit)
+        else:
+            return
+        limit = self.limit + ADMISSION_SMOOTHING * (target - self.limit)
+        self.limit = max(self.min_limit, min(self.max_limit, limit))
+        self._next_adjust = now + max(self._short, ADMISSION_ADJUST_INTERVAL)
+        admission_limit.set(self.limit, route_class=self.name)
+
+
+limiters: Dict[str, AdaptiveLimiter] = {
+    name: AdaptiveLimiter(name, config, ADMISSION_MAX_WAIT) for name, config in ROUTE_CLASSES.items()
+}
+
+
+class AdmissionTicket:
+    """受け付けたリクエストが使っている枠（処理の途中で別の種類の枠に移れる）"""
+
+    def __init__(self, route_class: str):
+        self.route_class = route_class
+        self.limiter: Optional[AdaptiveLimiter] = None
+        self.started_at = 0.0
+
+    async def acquire(self, route_class: str) -> None:
+        """route_class の枠を取る（断る場合は AdmissionRejected）"""
+        limiter = limiters[route_class]
+        queued_at = time.perf_counter()
+        try:
+            await limiter.acquire()
+        except AdmissionRejected as e:
+            admission_rejected_total.inc(route_class=route_class, reason=e.reason)
+            raise
+        self.route_class = route_class
+        self.limiter = limiter
+        self.started_at = time.perf_counter()
+        admission_wait_seconds.observe(self.started_at - queued_at, route_class=route_class)
+
+    async def escalate(self, route_class: str) -> None:
+        """今の枠をそこまでの処理時間で返し、route_class の枠を取り直す"""
+        if route_class == self.route_class and self.limiter is not None:
+            return
+        self.release(cancelled=False)
+        await self.acquire(route_class)
+
+    def release(self, cancelled: bool) -> None:
+        """枠を返す（クライアントの切断による中断は処理時間を上限の調整に使わない）"""
+        if self.limiter is None:
+            return
+        self.limiter.release(None if cancelled else time.perf_counter() - self.started_at)
+        self.limiter = None
+
+
+async def escalate(request: Request, route_class: str) -> None:
+    """ルートの中で重い処理に進む前に呼び、route_class の枠に移る（断る場合は 503）"""
+    ticket = request.scope.get("admission")
+    if ticket is None:
+        return
+    try:
+        await ticket.escalate(route_class)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail=REJECTED_DETAIL,
+            headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+        )
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """ルート（メソッドとパスのテンプレート）の種類（対象外なら None）"""
+    if path in ADMISSION_EXEMPT_PATHS:
+        return None
+    default = "light_read" if method in ("GET", "HEAD") else "write"
+    return ROUTE_CLASS_OVERRIDES.get((method, path), default)
+
+
+class AdmissionMiddleware:
+    """ルートの種類ごとの上限を超えたリクエストを待たせる・断る ASGI ミドルウェア"""
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _match(self, scope) -> Tuple[Optional[str], Optional[str]]:
+        """(パスのテンプレート, 種類)。一致するルートがなければ (None, None)"""
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = getattr(route, "path", None)
+                return path, classify(scope["method"], path) if path else None
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if not ADMISSION_ENABLED or scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        path, route_class = self._match(scope)
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        ticket = AdmissionTicket(route_class)
+        try:
+            await ticket.acquire(route_class)
+        except AdmissionRejected as e:
+            stats = current_stats()
+            if stats is not None:
+                stats.route = path
+            await _send_rejection(send, e.retry_after)
+            return
+
+        # ルートの中で escalate() できるようにする
+        scope["admission"] = ticket
+        # 例外で終わったリクエストの処理時間も使う（クライアントの切断による中断は除く）
+        cancelled = False
+        try:
+            await self.app(scope, receive, send)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            ticket.release(cancelled)
+
+
+async def _send_rejection(send, retry_after: float) -> None:
+    body = json.dumps({"detail": REJECTED_DETAIL}, ensure_ascii=False).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -1,11 +1,21 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from database import get_db
+from cache import TTLCache
+from change_feed import record_change
+from database import get_async_db
+from metrics import Counter, Gauge, Histogram
 from models import User
 from schemas import TokenData
 
@@ -16,16 +26,78 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = "your-secret-key-change-this-in-production"  # 本番環境では環境変数から読み込む
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# 管理用エンドポイントを使えるユーザーのメールアドレス（カンマ区切り）
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
+# 認証が任意のエンドポイント用（トークンがなければ None）
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
+
+# パスワードハッシュ専用のワーカープール
+# bcrypt は1回あたり 100〜300ms の CPU を使うため、イベントループ上では実行しない。
+# bcrypt は計算中に GIL を解放するので、スレッドでも並列に処理できる。
+# 実行中と待機中の合計が上限を超えたら、待たせずに 503 を返す。
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "16"))
+
+_password_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+)
+_password_jobs_in_flight = 0
+
+password_hash_seconds = Histogram(
+    "password_hash_seconds", "bcrypt の計算時間", ["operation"]
+)
+password_hash_wait_seconds = Histogram(
+    "password_hash_wait_seconds", "ハッシュ処理がワーカーを待った時間", ["operation"]
+)
+password_hash_queue_depth = Gauge(
+    "password_hash_queue_depth", "ワーカーの空きを待っているハッシュ処理の数"
+)
+password_hash_rejected_total = Counter(
+    "password_hash_rejected_total", "待ち行列が満杯で拒否したハッシュ処理の数", ["operation"]
+)
+
+def _update_password_queue_depth() -> None:
+    password_hash_queue_depth.set(max(0, _password_jobs_in_flight - PASSWORD_HASH_WORKERS))
+
+async def _run_password_job(operation: str, func, *args):
+    """ハッシュ処理をワーカープールで実行（混雑時は 503）"""
+    global _password_jobs_in_flight
+    if _password_jobs_in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        password_hash_rejected_total.inc(operation=operation)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="混み合っています。しばらくしてから再度お試しください",
+            headers={"Retry-After": "1"},
+        )
+
+    submitted_at = time.perf_counter()
+
+    def job():
+        started_at = time.perf_counter()
+        result = func(*args)
+        return result, started_at - submitted_at, time.perf_counter() - started_at
+
+    _password_jobs_in_flight += 1
+    _update_password_queue_depth()
+    try:
+        loop = asyncio.get_running_loop()
+        result, waited, elapsed = await loop.run_in_executor(_password_executor, job)
+    finally:
+        _password_jobs_in_flight -= 1
+        _update_password_queue_depth()
+    password_hash_wait_seconds.observe(waited, operation=operation)
+    password_hash_seconds.observe(elapsed, operation=operation)
+    return result
 
 # パスワードのハッシュ化
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await _run_password_job("hash", pwd_context.hash, password)
 
 # パスワードの検証
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_job("verify", pwd_context.verify, plain_password, hashed_password)
 
 # JWTトークンの作成
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -39,24 +111,121 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 # ユーザーの認証
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await db.scalar(select(User).where(User.email == email))
     if not user:
         return False
-    if not verify_password(password, user.password_hash):
+    if not await verify_password(password, user.password_hash):
         return False
     return user
 
+# 認証済みユーザー（リクエスト間で共有するため ORM から切り離した最小限の情報）
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    id: int
+    username: str
+    email: str
+    is_active: bool
+    created_at: datetime
+
+    @classmethod
+    def from_user(cls, user: User) -> "AuthenticatedUser":
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            is_active=user.is_active,
+            created_at=user.created_at,
+        )
+
+# 検証済みトークンのキャッシュ
+# 同じトークンでの2回目以降のリクエストは、署名検証と DB 参照を省略する。
+# ユーザー情報が変更されたらそのユーザーのエントリはすべて無効になる。
+# キャッシュはプロセスごとなので、変更時に change_events にも通知を追加し、他のワーカーは
+# そのポーリングで無効化する（EVENTS_POLL_INTERVAL 秒以内。main.py の _apply_remote_change）。
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+
+_token_cache: "TTLCache[Tuple[AuthenticatedUser, int]]" = TTLCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+# ユーザーごとの世代番号（無効化のたびに進め、古い世代のエントリを使わない）
+_user_generations: Dict[int, int] = {}
+# 全ユーザーでの無効化の回数（トークンにはユーザーID がないため、DB を読む前はこちらを控える）
+_invalidations = 0
+
+def invalidate_user_tokens(user_id: int) -> None:
+    """ユーザーのキャッシュ済みトークンをすべて無効化"""
+    global _invalidations
+    _user_generations[user_id] = _user_generations.get(user_id, 0) + 1
+    _invalidations += 1
+
+def _get_cached_user(token: str) -> Optional[AuthenticatedUser]:
+    cached = _token_cache.get(token)
+    if cached is None:
+        return None
+    user, generation = cached
+    if generation != _user_generations.get(user.id, 0):
+        _token_cache.delete(token)
+        return None
+    return user
+
+# ユーザーの変更（プロフィール、パスワード、is_active など）はコミット時にキャッシュへ反映する
+@event.listens_for(Session, "before_flush")
+def _record_user_changes(session, flush_context, instances):
+    # 他のワーカー向けの通知（購読者には送らない）
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj):
+            record_change(session, "user", obj.id, "update", audience=())
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            record_change(session, "user", obj.id, "delete", audience=())
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = [obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault("changed_user_ids", set()).update(changed)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        invalidate_user_tokens(user_id)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_user_ids", None)
+
 # 現在のユーザーを取得
 async def get_current_user(
+    request: Request,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # 一括リクエストの中の各リクエストは、一括リクエストで確認済みのユーザーを使う
+    batch_user = getattr(request.state, "authenticated_user", None)
+    if batch_user is not None:
+        return batch_user
+    return await _resolve_user(token, db)
+
+# 認証が任意のエンドポイントで現在のユーザーを取得（トークンがなければ None）
+async def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db)
+) -> Optional[AuthenticatedUser]:
+    if token is None:
+        return None
+    return await _resolve_user(token, db)
+
+async def _resolve_user(token: str, db: AsyncSession) -> AuthenticatedUser:
+    """トークンを検証してユーザーを返す（検証済みトークンのキャッシュを使う）"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="認証情報を確認できませんでした",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached_user = _get_cached_user(token)
+    if cached_user is not None:
+        return cached_user
+    
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -66,13 +235,27 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == token_data.email).first()
+    # DB を読む前に無効化の回数を控え、読んでいる間に無効化があれば古い内容をキャッシュしない
+    invalidations = _invalidations
+    user = await db.scalar(select(User).where(User.email == token_data.email))
     if user is None:
         raise credentials_exception
-    return user
+    
+    # トークンの有効期限を超えてキャッシュしない
+    current_user = AuthenticatedUser.from_user(user)
+    ttl = min(TOKEN_CACHE_TTL, payload.get("exp", 0) - time.time())
+    if ttl > 0 and invalidations == _invalidations:
+        _token_cache.set(token, (current_user, _user_generations.get(user.id, 0)), ttl=ttl)
+    return current_user
 
 # アクティブなユーザーを取得
-async def get_current_active_user(current_user: User = Depends(get_current_user)):
+async def get_current_active_user(current_user: AuthenticatedUser = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="無効なユーザーです")
+    return current_user
+
+# 管理者のユーザーを取得（ADMIN_EMAILS に含まれないユーザーは 403）
+async def get_admin_user(current_user: AuthenticatedUser = Depends(get_current_active_user)):
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="管理者のみ利用できます")
     return current_user
\ No newline at end of file
@@ -0,0 +1,163 @@
+import asyncio
+import math
+import os
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, unquote
+
+from pydantic_core import to_json
+from starlette.routing import Match
+
+from auth import AuthenticatedUser
+from schemas import BatchSubRequest
+
+# =============================================
+# 読み取りリクエストの一括実行（POST /api/batch）
+# =============================================
+#
+# 画面の初期表示で必要な複数の GET（記事一覧・カテゴリ・タグなど）を1回のリクエストにまとめ、
+# TLS・CORS のプリフライト・トークンの検証の往復を減らす。
+#
+# 各リクエストは既存のルートに ASGI でそのまま渡して並行に実行する（ミドルウェアや
+# キャッシュ、メトリクスも通常のリクエストと同じに動く）。トークンの検証は一括リクエストで
+# 1回だけ行い、確認済みのユーザーを request.state で各リクエストに渡す。
+# AsyncSession は並行に使えないため、DB セッションは各リクエストがプールから取得する。
+#
+# 応答は {"responses": [{"id", "status", "headers", "body"}, ...]} で、順番はリクエストと同じ。
+# 各リクエストの JSON 本文は再シリアライズせずにそのまま埋め込む。
+
+# 1回にまとめられるリクエスト数
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+# 1回のコストの上限（各リクエストは 1 + 取得件数 limit / BATCH_COST_ROWS 切り上げ。
+# limit を省略した場合はルートの既定値で数える）
+BATCH_MAX_COST = int(os.getenv("BATCH_MAX_COST", "40"))
+BATCH_COST_ROWS = 25
+# 同時に実行するリクエスト数（1回の一括リクエストでコネクションプールを占有しないようにする）
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+BATCH_PATH = "/api/batch"
+# 一括実行できないパス（一括リクエスト自体と、ストリーミングで応答するもの）
+BATCH_EXCLUDED_PATHS = {BATCH_PATH, "/api/posts/export", "/api/events"}
+# 各リクエストの応答から返すヘッダー
+BATCH_RESPONSE_HEADERS = ("x-next-cursor", "etag")
+
+
+def _default_limit(router, method: str, path: str) -> int:
+    """パスに一致するルートの limit の既定値（limit を受け取らないルートは 0）"""
+    scope = {"type": "http", "method": method, "path": path, "root_path": ""}
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.FULL:
+            continue
+        dependant = getattr(route, "dependant", None)
+        for param in dependant.query_params if dependant is not None else ():
+            if param.name == "limit" and isinstance(param.default, int):
+                return param.default
+        return 0
+    return 0
+
+
+def request_cost(sub: BatchSubRequest, router) -> int:
+    """リクエスト1件のコスト（一覧は取得件数に応じて重くする）"""
+    path, _, query = sub.path.partition("?")
+    values = parse_qs(query).get("limit")
+    if values:
+        try:
+            limit = int(values[-1])
+        except ValueError:
+            # 不正な値はルートで 422 になる
+            limit = 0
+    else:
+        limit = _default_limit(router, sub.method, unquote(path))
+    return 1 + math.ceil(max(limit, 0) / BATCH_COST_ROWS)
+
+
+def validate_batch(requests: List[BatchSubRequest], router) -> Optional[str]:
+    """一括リクエストの制限を確認し、違反していればエラーメッセージを返す"""
+    if len(requests) > BATCH_MAX_REQUESTS:
+        return f"一度に実行できるリクエストは {BATCH_MAX_REQUESTS} 件までです"
+    for sub in requests:
+        path = unquote(sub.path.partition("?")[0])
+        if not path.startswith("/api/") or path in BATCH_EXCLUDED_PATHS:
+            return f"一括実行できないパスです: {path}"
+    cost = sum(request_cost(sub, router) for sub in requests)
+    if cost > BATCH_MAX_COST:
+        return f"一括リクエストのコスト（{cost}）が上限（{BATCH_MAX_COST}）を超えています"
+    return None
+
+
+async def _dispatch(
+    app, parent_scope, sub: BatchSubRequest, user: Optional[AuthenticatedUser]
+) -> Tuple[int, List[Tuple[bytes, bytes]], bytes]:
+    """1件を ASGI アプリに渡して実行し、(ステータス, ヘッダー, 本文) を返す"""
+    raw_path, _, query = sub.path.partition("?")
+    headers = [
+        (name, value) for name, value in parent_scope["headers"]
+        if name == b"authorization"
+    ]
+    scope = {
+        "type": "http",
+        "asgi": parent_scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent_scope.get("http_version", "1.1"),
+        "method": sub.method,
+        "scheme": parent_scope.get("scheme", "http"),
+        "server": parent_scope.get("server"),
+        "client": parent_scope.get("client"),
+        "root_path": parent_scope.get("root_path", ""),
+        "path": unquote(raw_path),
+        "raw_path": raw_path.encode(),
+        "query_string": query.encode(),
+        "headers": headers,
+        "state": dict(parent_scope.get("state", {}), authenticated_user=user),
+    }
+    response = {"status": 500, "headers": [], "body": []}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        # 例外はサーバーエラーのミドルウェアが 500 を送ってから再送出する（ログも出力済み）
+        if not response["body"]:
+            response["status"] = 500
+            response["body"] = [b'{"detail":"Internal Server Error"}']
+    return response["status"], response["headers"], b"".join(response["body"])
+
+
+def _render_item(sub: BatchSubRequest, status_code: int, headers, body: bytes) -> bytes:
+    returned = {}
+    content_type = ""
+    for name, value in headers:
+        name = name.decode("latin-1").lower()
+        if name in BATCH_RESPONSE_HEADERS:
+            returned[name] = value.decode("latin-1")
+        elif name == "content-type":
+            content_type = value.decode("latin-1")
+    if not body:
+        body = b"null"
+    elif not content_type.startswith("application/json"):
+        body = to_json(body.decode("utf-8", "replace"))
+    return b"".join([
+        b'{"id":', to_json(sub.id), b',"status":', str(status_code).encode(),
+        b',"headers":', to_json(returned), b',"body":', body, b"}",
+    ])
+
+
+async def run_batch(app, parent_scope, requests: List[BatchSubRequest], user: Optional[AuthenticatedUser]) -> bytes:
+    """リクエストを BATCH_CONCURRENCY 件ずつ並行に実行し、まとめた JSON を返す"""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(sub: BatchSubRequest) -> bytes:
+        async with semaphore:
+            status_code, headers, body = await _dispatch(app, parent_scope, sub, user)
+        return _render_item(sub, status_code, headers, body)
+
+    items = await asyncio.gather(*(run(sub) for sub in requests))
+    return b'{"responses":[' + b",".join(items) + b"]}"
@@ -0,0 +1,519 @@
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+# =============================================
+# API のベンチマーク
+# =============================================
+#
+# backend ディレクトリで実行する。対象の DB は API と同じく DATABASE_URL で指定する。
+# 依存（httpx、SQLite の場合は aiosqlite）は requirements-dev.txt で入れる。
+#
+#   # データセットを作成（既存のテーブルは作り直される）
+#   DATABASE_URL=sqlite:///./bench.db python benchmark.py seed --posts 1000000
+#   # エンドポイントごとに計測して JSON に保存
+#   DATABASE_URL=sqlite:///./bench.db python benchmark.py run --concurrency 32 --output before.json
+#   # 2回の結果を比較
+#   python benchmark.py compare before.json after.json
+#
+# run はアプリをプロセス内で起動し（httpx の ASGITransport）、エンドポイントごとに
+# 指定した並列数でリクエストを送り続けて、スループット、p50/p95/p99 レイテンシ、
+# 1リクエストあたりの SQL 数を計測する。クライアントも同じイベントループで動くため、
+# レイテンシにはクライアント側の処理も含まれる。--base-url を指定すると起動済みの
+# サーバーに HTTP で送る（この場合 SQL 数は計測できない。ID の範囲を調べるため、
+# DATABASE_URL はそのサーバーと同じ DB を指すようにする）。
+# データセットもリクエストの順序も乱数のシード値で決まるため、同じ引数なら再現できる。
+
+BENCHMARK_PASSWORD = "benchmark"
+SEED_CHUNK_SIZE = 5000
+
+# タイトル・本文に使う単語（search の計測で使う語を含む）
+WORDS = [
+    "東京", "大阪", "京都", "天気", "料理", "旅行", "写真", "音楽", "技術", "開発",
+    "設計", "運用", "性能", "改善", "記録", "python", "fastapi", "mysql", "vue",
+    "docker", "cache", "index", "query", "async", "deploy", "release", "dashboard",
+]
+SEARCH_TERMS = ["東京", "料理", "性能改善", "fastapi", "mysql index", "docker deploy"]
+
+
+# =============================================
+# データセットの作成
+# =============================================
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _insert_chunks(engine, table, rows_iter, total: int, label: str) -> None:
+    from sqlalchemy import insert
+
+    chunk: List[Dict] = []
+    done = 0
+    for row in rows_iter:
+        chunk.append(row)
+        if len(chunk) >= SEED_CHUNK_SIZE:
+            with engine.begin() as conn:
+                conn.execute(insert(table), chunk)
+            done += len(chunk)
+            chunk = []
+            print(f"\r  {label}: {done}/{total}", end="", flush=True)
+    if chunk:
+        with engine.begin() as conn:
+            conn.execute(insert(table), chunk)
+        done += len(chunk)
+    print(f"\r  {label}: {done}/{total}")
+
+
+def seed(args) -> None:
+    from sqlalchemy import select, func
+    from sqlalchemy.exc import SQLAlchemyError
+
+    from auth import pwd_context
+    from database import Base, engine
+    from models import User, Category, Tag, Post, PostTag, Project, ProjectMember, Task
+
+    engine.echo = False
+    try:
+        with engine.connect() as conn:
+            existing = conn.scalar(select(func.count()).select_from(Post))
+    except SQLAlchemyError:
+        existing = 0
+    if existing and not args.force:
+        sys.exit(f"posts に {existing} 件のデータがあります。作り直す場合は --force を指定してください")
+
+    print(f"テーブルを作成: {engine.url.render_as_string(hide_password=True)}")
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    password_hash = pwd_context.hash(BENCHMARK_PASSWORD)
+
+    _insert_chunks(engine, User, (
+        {"id": i, "username": f"bench{i}", "email": f"bench{i}@example.com",
+         "password_hash": password_hash, "is_active": True}
+        for i in range(1, args.users + 1)
+    ), args.users, "users")
+    _insert_chunks(engine, Category, (
+        {"id": i, "name": f"カテゴリ{i}", "slug": f"category-{i}"}
+        for i in range(1, args.categories + 1)
+    ), args.categories, "categories")
+    _insert_chunks(engine, Tag, (
+        {"id": i, "name": f"タグ{i}", "slug": f"tag-{i}"}
+        for i in range(1, args.tags + 1)
+    ), args.tags, "tags")
+
+    def posts():
+        for i in range(1, args.posts + 1):
+            status = rng.choices(("published", "draft", "archived"), (80, 15, 5))[0]
+            created_at = now - timedelta(seconds=rng.randrange(730 * 86400))
+            yield {
+                "id": i,
+                "user_id": rng.randint(1, args.users),
+                "category_id": rng.randint(1, args.categories) if rng.random() < 0.9 else None,
+                "title": _sentence(rng, 4),
+                "slug": f"post-{i}",
+                "content": _sentence(rng, 80),
+                "excerpt": _sentence(rng, 12),
+                "status": status,
+                "published_at": created_at if status == "published" else None,
+                "view_count": rng.randrange(10000),
+                "created_at": created_at,
+            }
+    _insert_chunks(engine, Post, posts(), args.posts, "posts")
+
+    def post_tags():
+        for i in range(1, args.posts + 1):
+            for tag_id in rng.sample(range(1, args.tags + 1), min(args.tags, rng.randint(0, 3))):
+                yield {"post_id": i, "tag_id": tag_id}
+    _insert_chunks(engine, PostTag, post_tags(), args.posts * 3 // 2, "post_tags")
+
+    owners = [(i, (i - 1) % args.users + 1) for i in range(1, args.projects + 1)]
+    _insert_chunks(engine, Project, (
+        {"id": i, "user_id": owner, "name": f"プロジェクト{i}",
+         "status": rng.choice(("planning", "active", "on_hold", "completed")),
+         "priority": rng.choice(("low", "medium", "high", "urgent"))}
+        for i, owner in owners
+    ), args.projects, "projects")
+
+    def members():
+        for project_id, owner in owners:
+            yield {"project_id": project_id, "user_id": owner, "role": "owner"}
+            others = set(rng.sample(range(1, args.users + 1), min(args.users, 3))) - {owner}
+            for user_id in sorted(others):
+                yield {"project_id": project_id, "user_id": user_id, "role": "member"}
+    _insert_chunks(engine, ProjectMember, members(), args.projects * 4, "project_members")
+
+    def tasks():
+        today = now.date()
+        for project_id, owner in owners:
+            for _ in range(args.tasks_per_project):
+                yield {
+                    "project_id": project_id,
+                    "user_id": owner,
+                    "title": _sentence(rng, 3),
+                    "status": rng.choice(("todo", "in_progress", "review", "done", "blocked")),
+                    "priority": rng.choice(("low", "medium", "high", "urgent")),
+                    "due_date": today + timedelta(days=rng.randint(-60, 60)) if rng.random() < 0.8 else None,
+                    "estimated_hours": round(rng.uniform(0.5, 40), 2),
+                    "actual_hours": round(rng.uniform(0, 40), 2) if rng.random() < 0.5 else None,
+                }
+    _insert_chunks(engine, Task, tasks(), args.projects * args.tasks_per_project, "tasks")
+
+    asyncio.run(_rebuild_aggregates())
+    print(f"完了（ログイン: bench1@example.com / {BENCHMARK_PASSWORD}）")
+
+
+async def _rebuild_aggregates() -> None:
+    from database import AsyncSessionLocal, async_engine
+    from post_counters import reconcile_counts
+    from renditions import rebuild_renditions
+    from rollups import rebuild_all
+
+    async_engine.echo = False
+    async with AsyncSessionLocal() as db:
+        count = await rebuild_all(db)
+        fixed = await reconcile_counts(db)
+        rendered = await rebuild_renditions(db)
+    print(f"  project_task_summaries: {count}")
+    print(f"  post counts: {fixed}")
+    print(f"  post renditions: {rendered}")
+
+
+# =============================================
+# 計測
+# =============================================
+
+class Dataset:
+    """リクエストの組み立てに使う、データセットの件数と ID"""
+
+    def __init__(self, max_post_id: int, categories: int, tags: int, project_ids: List[int]):
+        self.max_post_id = max(1, max_post_id)
+        self.categories = max(1, categories)
+        self.tags = max(1, tags)
+        self.project_ids = project_ids or [0]
+
+    def as_dict(self) -> Dict:
+        return {
+            "max_post_id": self.max_post_id,
+            "categories": self.categories,
+            "tags": self.tags,
+            "projects_of_user": len(self.project_ids),
+        }
+
+
+# エンドポイント名 -> (パスを作る関数, 認証が必要か)
+SCENARIOS: Dict[str, Tuple[Callable[[random.Random, Dataset], str], bool]] = {
+    "posts_list": (lambda rng, d: f"/api/posts?limit=20&offset={rng.randrange(0, 200, 20)}", False),
+    "posts_list_sparse": (
+        lambda rng, d: f"/api/posts?limit=20&offset={rng.randrange(0, 200, 20)}&fields=title,slug,author,tags",
+        False,
+    ),
+    "posts_list_normalized": (
+        lambda rng, d: f"/api/posts?limit=100&offset={rng.randrange(0, 200, 20)}&format=normalized",
+        False,
+    ),
+    "posts_list_category": (lambda rng, d: f"/api/posts?limit=20&category_id={rng.randint(1, d.categories)}", False),
+    "posts_list_tag": (lambda rng, d: f"/api/posts?limit=20&tag_id={rng.randint(1, d.tags)}", False),
+    "posts_list_tags_all": (
+        lambda rng, d: "/api/posts?limit=20&match=all&tag_ids="
+        + ",".join(str(tag_id) for tag_id in rng.sample(range(1, d.tags + 1), 2)),
+        False,
+    ),
+    "posts_list_tags_any": (
+        lambda rng, d: "/api/posts?limit=20&match=any&status=published&tag_ids="
+        + ",".join(str(tag_id) for tag_id in rng.sample(range(1, d.tags + 1), 3))
+        + f"&exclude_tag_ids={rng.randint(1, d.tags)}",
+        False,
+    ),
+    "post_detail": (lambda rng, d: f"/api/posts/{rng.randint(1, d.max_post_id)}", False),
+    "posts_search": (lambda rng, d: f"/api/posts/search?limit=20&q={rng.choice(SEARCH_TERMS)}", False),
+    "categories": (lambda rng, d: "/api/categories", False),
+    "tag_cloud": (lambda rng, d: "/api/tags/cloud", False),
+    "tags": (lambda rng, d: "/api/tags", False),
+    "auth_me": (lambda rng, d: "/api/auth/me", True),
+    "project_summary": (lambda rng, d: f"/api/projects/{rng.choice(d.project_ids)}/summary", True),
+    "project_tasks": (lambda rng, d: f"/api/projects/{rng.choice(d.project_ids)}/tasks?limit=50", True),
+}
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    """最近順位法によるパーセンタイル"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(p / 100 * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+
+class QueryCounter:
+    """プロセス内のエンジンで実行された SQL の数"""
+
+    def __init__(self):
+        self.count = 0
+
+    def attach(self, engine) -> None:
+        from sqlalchemy import event
+
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        self.count += 1
+
+
+def _load_dataset(email: str) -> Dataset:
+    """DB から ID の範囲と、ログインするユーザーが参加しているプロジェクトを取得"""
+    from sqlalchemy import func, or_, select
+
+    from database import engine
+    from models import User, Category, Tag, Post, Project, ProjectMember
+
+    engine.echo = False
+    with engine.connect() as conn:
+        user_id = conn.scalar(select(User.id).where(User.email == email))
+        project_ids = conn.scalars(
+            select(Project.id)
+            .where(or_(
+                Project.user_id == user_id,
+                Project.id.in_(select(ProjectMember.project_id).where(ProjectMember.user_id == user_id)),
+            ))
+            .order_by(Project.id)
+        ).all()
+        return Dataset(
+            conn.scalar(select(func.max(Post.id))) or 1,
+            conn.scalar(select(func.count()).select_from(Category)),
+            conn.scalar(select(func.count()).select_from(Tag)),
+            list(project_ids),
+        )
+
+
+async def _drive(client, make_path, headers, dataset: Dataset, concurrency: int, duration: float, seed: str):
+    """duration 秒間 concurrency 並列でリクエストを送り、(レイテンシ一覧, エラー数, 503 の数, 経過秒) を返す"""
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    rejected = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(index: int) -> None:
+        nonlocal errors, rejected
+        rng = random.Random(f"{seed}-{index}")
+        while time.perf_counter() < deadline:
+            path = make_path(rng, dataset)
+            started = time.perf_counter()
+            response = None
+            try:
+                response = await client.get(path, headers=headers)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+                # 受け付け制御で断られたリクエスト（エラー数にも含む）
+                if response is not None and response.status_code == 503:
+                    rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors, rejected, time.perf_counter() - started
+
+
+async def run_benchmark(args) -> Dict:
+    import httpx
+
+    queries: Optional[QueryCounter] = None
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+        app = None
+        target = args.base_url
+    else:
+        import database
+        import main
+
+        database.engine.echo = False
+        database.async_engine.echo = False
+        queries = QueryCounter()
+        queries.attach(database.async_engine.sync_engine)
+        app = main.app
+        await app.router.startup()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+        target = "in-process"
+
+    results: Dict[str, Dict] = {}
+    try:
+        login = await client.post("/api/auth/login", json={"email": args.email, "password": args.password})
+        login.raise_for_status()
+        auth_headers = {"Authorization": "Bearer " + login.json()["access_token"]}
+        dataset = _load_dataset(args.email)
+
+        for name in args.endpoints:
+            make_path, needs_auth = SCENARIOS[name]
+            headers = auth_headers if needs_auth else {}
+            if args.warmup > 0:
+                await _drive(client, make_path, headers, dataset, args.concurrency, args.warmup, f"{args.seed}-{name}-warmup")
+            query_start = queries.count if queries else 0
+            latencies, errors, rejected, elapsed = await _drive(
+                client, make_path, headers, dataset, args.concurrency, args.duration, f"{args.seed}-{name}"
+            )
+            latencies.sort()
+            requests = len(latencies)
+            results[name] = {
+                "requests": requests,
+                "errors": errors,
+                "rejected": rejected,
+                "throughput_rps": requests / elapsed if elapsed else 0.0,
+                "latency_ms": {
+                    "mean": sum(latencies) / requests * 1000 if requests else None,
+                    "p50": _ms(percentile(latencies, 50)),
+                    "p95": _ms(percentile(latencies, 95)),
+                    "p99": _ms(percentile(latencies, 99)),
+                    "max": _ms(latencies[-1] if latencies else None),
+                },
+                "queries_per_request": (queries.count - query_start) / requests if queries and requests else None,
+            }
+            _print_result(name, results[name])
+    finally:
+        await client.aclose()
+        if app is not None:
+            await app.router.shutdown()
+
+    return {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat() + "Z",
+            "git_commit": _git_commit(),
+            "target": target,
+            "database": _database_name() if app is not None else None,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "dataset": dataset.as_dict(),
+        },
+        "endpoints": results,
+    }
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return seconds * 1000 if seconds is not None else None
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _database_name() -> str:
+    from database import async_engine
+
+    return async_engine.url.get_backend_name()
+
+
+def _print_result(name: str, result: Dict) -> None:
+    latency = result["latency_ms"]
+    queries = result["queries_per_request"]
+    print(
+        f"{name:<22} {result['throughput_rps']:>9.1f} req/s"
+        f"  p50 {_fmt(latency['p50'])}  p95 {_fmt(latency['p95'])}  p99 {_fmt(latency['p99'])}"
+        f"  queries/req {'-' if queries is None else f'{queries:.2f}'}"
+        f"  errors {result['errors']}"
+        f" (503 {result.get('rejected', 0)})"
+    )
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "      -" if value is None else f"{value:>6.1f}ms"
+
+
+# =============================================
+# 結果の比較
+# =============================================
+
+def compare(args) -> None:
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before: {before['meta'].get('git_commit')}  after: {after['meta'].get('git_commit')}")
+    for name, new in after["endpoints"].items():
+        old = before["endpoints"].get(name)
+        if old is None:
+            continue
+        print(
+            f"{name:<22} rps {_change(old['throughput_rps'], new['throughput_rps'])}"
+            f"  p50 {_change(old['latency_ms']['p50'], new['latency_ms']['p50'])}"
+            f"  p95 {_change(old['latency_ms']['p95'], new['latency_ms']['p95'])}"
+            f"  p99 {_change(old['latency_ms']['p99'], new['latency_ms']['p99'])}"
+            f"  queries/req {_change(old['queries_per_request'], new['queries_per_request'])}"
+        )
+
+
+def _change(old: Optional[float], new: Optional[float]) -> str:
+    if old is None or new is None:
+        return "-"
+    if not old:
+        return f"{old:.2f} -> {new:.2f}"
+    return f"{old:.2f} -> {new:.2f} ({(new - old) / old * 100:+.1f}%)"
+
+
+# =============================================
+# コマンドライン
+# =============================================
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="API のベンチマーク")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = subparsers.add_parser("seed", help="データセットを作成（既存のテーブルは作り直す）")
+    seed_parser.add_argument("--users", type=int, default=1000)
+    seed_parser.add_argument("--categories", type=int, default=20)
+    seed_parser.add_argument("--tags", type=int, default=200)
+    seed_parser.add_argument("--posts", type=int, default=100000)
+    seed_parser.add_argument("--projects", type=int, default=200)
+    seed_parser.add_argument("--tasks-per-project", type=int, default=200)
+    seed_parser.add_argument("--seed", type=int, default=42, help="乱数のシード値")
+    seed_parser.add_argument("--force", action="store_true", help="既存のデータがあっても作り直す")
+
+    run_parser = subparsers.add_parser("run", help="エンドポイントごとに計測")
+    run_parser.add_argument("--endpoints", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument("--duration", type=float, default=10, help="エンドポイントごとの計測秒数")
+    run_parser.add_argument("--warmup", type=float, default=2, help="計測前に捨てるリクエストの秒数")
+    run_parser.add_argument("--seed", type=int, default=42, help="リクエスト順序の乱数のシード値")
+    run_parser.add_argument("--email", default="bench1@example.com")
+    run_parser.add_argument("--password", default=BENCHMARK_PASSWORD)
+    run_parser.add_argument("--base-url", help="起動済みのサーバーに送る場合の URL（例: http://localhost:8000）")
+    run_parser.add_argument("--output", help="結果を保存する JSON ファイル")
+
+    compare_parser = subparsers.add_parser("compare", help="2回の結果を比較")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed(args)
+    elif args.command == "run":
+        report = asyncio.run(run_benchmark(args))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"結果を保存しました: {args.output}")
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import Category, Post, PostTag, Tag
+from post_counters import apply_post_changes
+from schemas import BulkImportError, BulkImportResult, PostImport
+
+# =============================================
+# 記事の一括インポート・エクスポート（NDJSON）
+# =============================================
+#
+# インポートはリクエスト本文を1行ずつ読み、BULK_CHUNK_SIZE 行ごとに
+# 記事と記事タグをそれぞれ複数行 INSERT でまとめて挿入し、チャンク単位でコミットする。
+# エクスポートはサーバーサイドカーソルで読みながら1行ずつ返すため、件数に関係なくメモリは一定。
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+# レスポンスに含める行エラーの上限（件数は failed にすべて数える）
+BULK_MAX_REPORTED_ERRORS = int(os.getenv("BULK_MAX_REPORTED_ERRORS", "1000"))
+
+POST_STATUSES = {"draft", "published", "archived", "scheduled"}
+
+EXPORT_COLUMNS = (
+    Post.id, Post.user_id, Post.category_id, Post.title, Post.slug, Post.content,
+    Post.excerpt, Post.featured_image, Post.status, Post.published_at, Post.view_count,
+    Post.created_at, Post.updated_at,
+)
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """受信したバイト列を改行ごとに区切って返す"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+    if buffer:
+        yield buffer
+
+
+class PostImporter:
+    """NDJSON の行をチャンクにまとめて取り込む"""
+
+    def __init__(self, db: AsyncSession, user_id: int):
+        self.db = db
+        self.user_id = user_id
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[BulkImportError] = []
+        self._seen_slugs: Set[str] = set()
+        self._category_ids: Set[int] = set()
+        self._tag_ids: Set[int] = set()
+
+    def _error(self, line: int, error: str, slug: Optional[str] = None) -> None:
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_REPORTED_ERRORS:
+            self.errors.append(BulkImportError(line=line, slug=slug, error=error))
+
+    async def run(self, lines: AsyncIterator[bytes]) -> BulkImportResult:
+        # 参照先の存在確認用（カテゴリ・タグは件数が少ないので最初に全件読む）
+        self._category_ids = set((await self.db.scalars(select(Category.id))).all())
+        self._tag_ids = set((await self.db.scalars(select(Tag.id))).all())
+
+        chunk: List[Tuple[int, PostImport]] = []
+        line_no = 0
+        async for raw in lines:
+            line_no += 1
+            if not raw.strip():
+                continue
+            item = self._parse(line_no, raw)
+            if item is None:
+                continue
+            chunk.append((line_no, item))
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await self._flush(chunk)
+                chunk = []
+        if chunk:
+            await self._flush(chunk)
+
+        return BulkImportResult(
+            inserted=self.inserted,
+            failed=self.failed,
+            errors=self.errors,
+            errors_truncated=self.failed > len(self.errors),
+        )
+
+    def _parse(self, line_no: int, raw: bytes) -> Optional[PostImport]:
+        """1行を検証する（不正な行はエラーとして記録して None）"""
+        try:
+            item = PostImport.model_validate_json(raw)
+        except ValidationError as e:
+            self._error(line_no, e.errors()[0]["msg"] if e.errors() else str(e))
+            return None
+        if item.status not in POST_STATUSES:
+            self._error(line_no, f"不正なステータスです: {item.status}", item.slug)
+            return None
+        if item.status == "scheduled" and item.published_at is None:
+            self._error(line_no, "公開予約には published_at（UTC）を指定してください", item.slug)
+            return None
+        if item.category_id is not None and item.category_id not in self._category_ids:
+            self._error(line_no, f"カテゴリが存在しません: {item.category_id}", item.slug)
+            return None
+        unknown_tags = set(item.tag_ids or []) - self._tag_ids
+        if unknown_tags:
+            self._error(line_no, f"タグが存在しません: {sorted(unknown_tags)}", item.slug)
+            return None
+        if item.slug in self._seen_slugs:
+            self._error(line_no, "スラッグが重複しています", item.slug)
+            return None
+        self._seen_slugs.add(item.slug)
+        return item
+
+    async def _flush(self, chunk: List[Tuple[int, PostImport]]) -> None:
+        """1チャンクを1トランザクションで挿入"""
+        # 既存記事とのスラッグ重複をまとめて確認
+        existing = set((await self.db.scalars(
+            select(Post.slug).where(Post.slug.in_([item.slug for _, item in chunk]))
+        )).all())
+        rows = []
+        for line_no, item in chunk:
+            if item.slug in existing:
+                self._error(line_no, "このスラッグは既に使用されています", item.slug)
+            else:
+                rows.append((line_no, item))
+        if not rows:
+            return
+
+        # 件数はコミットが成功してから数える（失敗したチャンクを1行ずつ入れ直すときに二重に数えない）
+        try:
+            inserted = await self._insert(rows)
+            await self.db.commit()
+            self.inserted += inserted
+        except Exception:
+            await self.db.rollback()
+            # チャンク全体が失敗した場合は1行ずつ入れ直し、失敗した行だけを報告する
+            for line_no, item in rows:
+                try:
+                    inserted = await self._insert([(line_no, item)])
+                    await self.db.commit()
+                    self.inserted += inserted
+                except Exception as e:
+                    await self.db.rollback()
+                    self._error(line_no, str(getattr(e, "orig", e)), item.slug)
+
+    async def _insert(self, rows: List[Tuple[int, PostImport]]) -> int:
+        """記事・記事タグ・集計をまとめて挿入し、挿入した記事数を返す（コミットは呼び出し側）"""
+        now = datetime.utcnow()
+        # 指定された列が同じ行ごとにまとめて複数行 INSERT にする
+        groups: Dict[Tuple[str, ...], List[dict]] = {}
+        tag_ids_by_slug: Dict[str, List[int]] = {}
+        for _, item in rows:
+            values = item.model_dump(exclude={"tag_ids", "publish_at"}, exclude_none=True)
+            values["user_id"] = self.user_id
+            if item.status == "published" and "published_at" not in values:
+                values["published_at"] = now
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+            tag_ids_by_slug[item.slug] = list(dict.fromkeys(item.tag_ids or []))
+        for values in groups.values():
+            await self.db.execute(insert(Post), values)
+
+        # 挿入した記事のIDをスラッグから引いて、記事タグをまとめて挿入
+        inserted = (await self.db.execute(
+            select(Post.id, Post.slug).where(Post.slug.in_(list(tag_ids_by_slug)))
+        )).all()
+        post_tags = [
+            {"post_id": post_id, "tag_id": tag_id}
+            for post_id, slug in inserted
+            for tag_id in tag_ids_by_slug[slug]
+        ]
+        if post_tags:
+            await self.db.execute(insert(PostTag), post_tags)
+        await apply_post_changes(self.db, [
+            (None, (item.status, item.category_id, tag_ids_by_slug[item.slug])) for _, item in rows
+        ])
+        return len(inserted)
+
+
+async def export_posts_ndjson() -> AsyncIterator[bytes]:
+    """全記事を ID 順に NDJSON で返す（インポートにそのまま使える形式）"""
+    # 読み出し用のカーソルを開いたまま別の問い合わせはできないため、タグ取得は別セッションで行う
+    async with AsyncSessionLocal() as stream_db, AsyncSessionLocal() as tag_db:
+        result = await stream_db.stream(
+            select(*EXPORT_COLUMNS).order_by(Post.id).execution_options(yield_per=BULK_CHUNK_SIZE)
+        )
+        async for rows in result.partitions():
+            post_ids = [row.id for row in rows]
+            tag_ids: Dict[int, List[int]] = {}
+            for post_id, tag_id in (await tag_db.execute(
+                select(PostTag.post_id, PostTag.tag_id).where(PostTag.post_id.in_(post_ids))
+            )).all():
+                tag_ids.setdefault(post_id, []).append(tag_id)
+            await tag_db.rollback()
+
+            lines = []
+            for row in rows:
+                item = dict(row._mapping)
+                item["tag_ids"] = sorted(tag_ids.get(row.id, []))
+                lines.append(json.dumps(item, ensure_ascii=False, default=_json_default))
+            yield ("\n".join(lines) + "\n").encode()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,106 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+
+from fastapi import Request, Response, status
+
+# =============================================
+# プロセス内キャッシュ
+# =============================================
+
+V = TypeVar("V")
+
+_MISSING = object()
+
+
+class TTLCache(Generic[V]):
+    """件数上限つきの LRU キャッシュ（エントリごとに有効期限を持つ）"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        """有効なエントリを返す（期限切れは削除して default）"""
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None) -> None:
+        """エントリを保存（上限を超えたら最も古く使われたものから捨てる）"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+
+# =============================================
+# シリアライズ済みレスポンスと ETag
+# =============================================
+
+@dataclass(frozen=True)
+class CachedBody:
+    """JSON にシリアライズ済みのレスポンス本文と、その強い ETag"""
+    body: bytes
+    etag: str
+    # 本文と一緒に返すヘッダー（X-Next-Cursor など）
+    headers: Tuple[Tuple[str, str], ...] = ()
+
+    @classmethod
+    def from_body(cls, body: bytes, headers: Optional[Dict[str, str]] = None) -> "CachedBody":
+        return cls(body=body, etag=make_etag(body), headers=tuple((headers or {}).items()))
+
+
+def make_etag(body: bytes) -> str:
+    """本文のハッシュから強い ETag を作成（同じ本文ならどのプロセスでも同じ値）"""
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match がこの ETag に一致するか"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip() for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def cached_json_response(
+    request: Request, cached: CachedBody, headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """シリアライズ済みの本文を返す（ETag が一致すれば本文なしの 304）"""
+    response_headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    response_headers.update(cached.headers)
+    if headers:
+        response_headers.update(headers)
+    if etag_matches(request, cached.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=response_headers)
+    return Response(content=cached.body, media_type="application/json", headers=response_headers)
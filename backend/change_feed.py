@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import delete, event, func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal
+from metrics import Counter, Gauge
+from models import ChangeEvent, Project, ProjectMember
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# 変更通知（GET /api/events の Server-Sent Events）
+# =============================================
+#
+# 記事・カテゴリ・タグ・タスクの書き込み時に、同じトランザクションで change_events に
+# 1行追加する（アウトボックス）。各ワーカーの ChangeFeed がこの表をポーリングし、
+# 接続中の購読者に {"entity", "id", "op", "version"} だけの小さな通知を配る。
+# 複数ワーカー構成でも、どのワーカーの書き込みも全ワーカーの購読者に届く。
+# version は通知の連番（change_events.id）で、SSE のイベント ID にも使う。
+#
+# - 再接続: Last-Event-ID 以降の通知を change_events から読んで送り直す。
+#   保持期間（EVENTS_RETENTION 件）より古い場合は `event: reset` を送り、
+#   クライアントに読み直してもらう。
+# - 背圧: 購読者ごとのキューは EVENTS_QUEUE_SIZE 件まで。受信が遅くてあふれた場合は
+#   キューを捨て、送信済みの ID から change_events を読み直して追いつく
+#   （遅い接続のためにメモリを使い続けたり、他の購読者を待たせたりしない）。
+# - 待機中の接続はキューを待つだけなので、ワーカーあたり数千接続でも負荷はほぼない。
+#
+# 自動採番はコミット順とは限らないため、ID の抜けは EVENTS_GAP_TIMEOUT 秒のあいだ
+# 後から届くのを待つ（ロールバックで欠番になったものはその後あきらめる）。
+# 後から届いた通知は送信済みの ID より小さいため、`id:` を付けずに送る（クライアントの
+# Last-Event-ID を戻さない。通知の version には本来の ID が入る）。
+#
+# 他のワーカーでの書き込みの通知は、購読者への配信とは別に @change_feed.listener で
+# 登録した関数にも渡す（プロセス内のキャッシュの無効化に使う）。このワーカーで追加した
+# 通知は書き込み時に無効化済みのため渡さない。audience が空の通知は購読者には届かず、
+# 無効化のためだけに使う（ユーザー情報の変更など）。
+
+# change_events のポーリング間隔（秒。このワーカーでの書き込み直後はすぐに読む）
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "1"))
+# 通知がないときにコメント行を送る間隔（秒。プロキシにアイドル切断されないようにする）
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+# 購読者ごとに貯めておく通知の数
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "256"))
+# change_events に残す通知の数（再接続で送り直せる範囲）
+EVENTS_RETENTION = int(os.getenv("EVENTS_RETENTION", "100000"))
+# ID の抜けを待つ時間（秒）
+EVENTS_GAP_TIMEOUT = float(os.getenv("EVENTS_GAP_TIMEOUT", "10"))
+# 1回に読む通知の数
+EVENTS_BATCH_SIZE = 500
+# 古い通知を削除する間隔（ポーリング回数）
+EVENTS_PRUNE_EVERY = 60
+# 切断時にクライアントが再接続するまでの時間（ミリ秒）
+EVENTS_RETRY_MS = 3000
+
+# 送り直せない範囲の通知が必要になったときに送る（クライアントはデータを読み直す）
+RESET_EVENT = b"event: reset\ndata: {}\n\n"
+
+events_subscribers = Gauge("events_subscribers", "接続中の変更通知の購読者数")
+events_sent_total = Counter("events_sent_total", "購読者に送った変更通知の数")
+events_overflows_total = Counter(
+    "events_overflows_total", "受信が遅くキューがあふれ、DB から読み直した回数"
+)
+
+
+class ChangeNotice(NamedTuple):
+    """配信する変更通知1件"""
+    id: int
+    entity: str
+    entity_id: Optional[int]
+    op: str
+    # 受け取れるユーザーID（None は全員）
+    audience: Optional[FrozenSet[int]]
+
+    @classmethod
+    def from_row(cls, row: ChangeEvent) -> "ChangeNotice":
+        audience = None
+        if row.audience is not None:
+            audience = frozenset(int(user_id) for user_id in row.audience.split(",") if user_id)
+        return cls(row.id, row.entity, row.entity_id, row.op, audience)
+
+    def visible_to(self, user_id: Optional[int]) -> bool:
+        return self.audience is None or user_id in self.audience
+
+    def to_sse(self, with_id: bool = True) -> bytes:
+        """SSE のイベント（with_id=False は送信済みの ID より小さい通知用で、id: を付けない）"""
+        data = json.dumps(
+            {"entity": self.entity, "id": self.entity_id, "op": self.op, "version": self.id},
+            separators=(",", ":"),
+        )
+        event_id = f"id: {self.id}\n" if with_id else ""
+        return f"{event_id}event: change\ndata: {data}\n\n".encode()
+
+
+def record_change(
+    db: AsyncSession, entity: str, entity_id: Optional[int], op: str,
+    audience: Optional[Iterable[int]] = None,
+) -> None:
+    """変更通知を追加する（書き込みと同じトランザクションで呼ぶ。コミット後に change_feed.wake()）"""
+    db.add(ChangeEvent(
+        entity=entity,
+        entity_id=entity_id,
+        op=op,
+        audience=None if audience is None else ",".join(str(user_id) for user_id in sorted(set(audience))),
+    ))
+
+
+async def project_audience(db: AsyncSession, project_id: int) -> List[int]:
+    """プロジェクトのタスクの通知を受け取れるユーザー（オーナーとメンバー）"""
+    owner = select(Project.user_id).where(Project.id == project_id)
+    members = select(ProjectMember.user_id).where(ProjectMember.project_id == project_id)
+    return list((await db.scalars(owner.union(members))).all())
+
+
+class Subscriber:
+    """接続1本分の受信キュー"""
+
+    __slots__ = ("user_id", "queue", "overflowed")
+
+    def __init__(self, user_id: Optional[int], queue_size: int):
+        self.user_id = user_id
+        self.queue: "asyncio.Queue[ChangeNotice]" = asyncio.Queue(queue_size)
+        self.overflowed = False
+
+    def push(self, notice: ChangeNotice) -> None:
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(notice)
+        except asyncio.QueueFull:
+            # 貯めずに捨て、送信側で DB から読み直させる
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            # 待っている送信側を起こす
+            self.queue.put_nowait(notice)
+            events_overflows_total.inc()
+
+
+ChangeListener = Callable[[ChangeNotice], Awaitable[None]]
+
+
+class ChangeFeed:
+    """change_events をポーリングし、このワーカーの購読者に配る"""
+
+    def __init__(self, poll_interval: float, queue_size: int, retention: int, gap_timeout: float):
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.retention = retention
+        self.gap_timeout = gap_timeout
+        self.subscribers: Set[Subscriber] = set()
+        # 配信済みの最大 ID（起動後の最初のポーリングで決まる）
+        self.last_id: Optional[int] = None
+        # まだ届いていない ID -> あきらめる時刻
+        self._gaps: Dict[int, float] = {}
+        # このワーカーで追加した通知の ID（リスナーに渡さない）
+        self._local_ids: Set[int] = set()
+        self._listeners: List[ChangeListener] = []
+        self._polls = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- 購読 ----
+
+    def subscribe(self, user_id: Optional[int]) -> Subscriber:
+        subscriber = Subscriber(user_id, self.queue_size)
+        self.subscribers.add(subscriber)
+        events_subscribers.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self.subscribers:
+            self.subscribers.discard(subscriber)
+            events_subscribers.dec()
+
+    def listener(self, handler: ChangeListener) -> ChangeListener:
+        """他のワーカーでの書き込みの通知を受け取る関数を登録するデコレーター"""
+        self._listeners.append(handler)
+        return handler
+
+    def note_local(self, event_ids: Iterable[int]) -> None:
+        """このワーカーで追加した通知の ID を記録（フラッシュ時に呼ばれる）"""
+        self._local_ids.update(event_ids)
+
+    def wake(self) -> None:
+        """このワーカーで通知を追加してコミットした直後に呼び、すぐにポーリングさせる"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ---- ポーリング ----
+
+    async def poll(self) -> int:
+        """新しい通知を読んで購読者に配り、配った件数を返す"""
+        async with AsyncSessionLocal() as db:
+            if self.last_id is None:
+                # 起動前の通知は再接続時に DB から読むので、配信は最新から始める
+                self.last_id = await db.scalar(select(func.max(ChangeEvent.id))) or 0
+                return 0
+
+            condition = ChangeEvent.id > self.last_id
+            if self._gaps:
+                condition = or_(condition, ChangeEvent.id.in_(list(self._gaps)))
+            rows = (await db.scalars(
+                select(ChangeEvent).where(condition).order_by(ChangeEvent.id).limit(EVENTS_BATCH_SIZE)
+            )).all()
+
+            self._polls += 1
+            if self._polls % EVENTS_PRUNE_EVERY == 0 and self.last_id > self.retention:
+                await db.execute(delete(ChangeEvent).where(ChangeEvent.id <= self.last_id - self.retention))
+                await db.commit()
+
+        now = time.monotonic()
+        for row in rows:
+            if row.id > self.last_id:
+                # 飛ばした ID は後からコミットされるかもしれないので、しばらく待つ
+                # （採番が大きく飛んだ場合は待たない）
+                if row.id - self.last_id <= EVENTS_BATCH_SIZE:
+                    for missing in range(self.last_id + 1, row.id):
+                        self._gaps[missing] = now + self.gap_timeout
+                self.last_id = row.id
+            else:
+                self._gaps.pop(row.id, None)
+            notice = ChangeNotice.from_row(row)
+            self._publish(notice)
+            if row.id in self._local_ids:
+                self._local_ids.discard(row.id)
+            else:
+                await self._notify_listeners(notice)
+        if self._gaps:
+            self._gaps = {gap: deadline for gap, deadline in self._gaps.items() if deadline > now}
+        if self._local_ids:
+            # ロールバックで届かなかった ID は捨てる
+            self._local_ids = {
+                event_id for event_id in self._local_ids if event_id > self.last_id or event_id in self._gaps
+            }
+        return len(rows)
+
+    async def _notify_listeners(self, notice: ChangeNotice) -> None:
+        for handler in self._listeners:
+            try:
+                await handler(notice)
+            except Exception:
+                logger.exception("変更通知 %s の反映に失敗しました", notice.id)
+
+    def _publish(self, notice: ChangeNotice) -> None:
+        for subscriber in self.subscribers:
+            if notice.visible_to(subscriber.user_id):
+                subscriber.push(notice)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                # 1回で読み切れなかった場合は続けて読む
+                while await self.poll() >= EVENTS_BATCH_SIZE:
+                    pass
+            except Exception:
+                logger.exception("変更通知の読み込みに失敗しました")
+
+    def start(self) -> None:
+        """ポーリングのタスクを開始"""
+        self._wakeup = asyncio.Event()
+        # 配信を始める位置を決めるため、最初のポーリングはすぐに行う
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """ポーリングを止める"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # ---- 送信 ----
+
+    async def _replay(
+        self, after: int, upto: int, user_id: Optional[int], missing: Set[int]
+    ) -> AsyncIterator[bytes]:
+        """after より後、upto までの通知を change_events から読んで送る
+
+        保持期間より前から必要な場合は送り直せないので `event: reset` を送る。
+        範囲内でまだ届いていない ID（後からキューに届きうるもの）は missing に加える。
+        """
+        async with AsyncSessionLocal() as db:
+            oldest = await db.scalar(select(func.min(ChangeEvent.id)))
+            if after <= 0 or (oldest is not None and after < oldest - 1):
+                yield RESET_EVENT
+                return
+            while after < upto:
+                notices = [
+                    ChangeNotice.from_row(row) for row in await db.scalars(
+                        select(ChangeEvent)
+                        .where(ChangeEvent.id > after, ChangeEvent.id <= upto)
+                        .order_by(ChangeEvent.id)
+                        .limit(EVENTS_BATCH_SIZE)
+                    )
+                ]
+                # 送信中に接続を握り続けないよう、読んだらトランザクションを終える
+                await db.rollback()
+                if not notices:
+                    break
+                for notice in notices:
+                    if notice.id - after <= EVENTS_BATCH_SIZE:
+                        missing.update(range(after + 1, notice.id))
+                    if notice.visible_to(user_id):
+                        yield notice.to_sse()
+                        events_sent_total.inc()
+                    after = notice.id
+            if upto - after <= EVENTS_BATCH_SIZE:
+                missing.update(range(after + 1, upto + 1))
+
+    async def stream(
+        self, user_id: Optional[int], last_event_id: Optional[int], keepalive: float = EVENTS_KEEPALIVE
+    ) -> AsyncIterator[bytes]:
+        """1接続分の SSE を生成する（切断されるまで続く）"""
+        subscriber = self.subscribe(user_id)
+        # 送信済みの最大 ID（購読を始めた時点までは配信済みとみなす）
+        sent_id = self.last_id or 0
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+            # DB から読んで送った範囲（この範囲のキューの通知は送信済みなので捨てる。
+            # ただし読んだ時点で抜けていた ID は送っていない）
+            replayed_from = replayed_to = 0
+            missing: Set[int] = set()
+            if last_event_id is not None and last_event_id < sent_id:
+                replayed_from, replayed_to = last_event_id, sent_id
+                async for message in self._replay(replayed_from, replayed_to, user_id, missing):
+                    yield message
+
+            while True:
+                try:
+                    notice = await asyncio.wait_for(subscriber.queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+
+                if subscriber.overflowed:
+                    # キューに残っていた分は捨て、送信済みの ID から DB を読み直す
+                    while not subscriber.queue.empty():
+                        subscriber.queue.get_nowait()
+                    subscriber.overflowed = False
+                    replayed_from, replayed_to = sent_id, max(sent_id, self.last_id or 0)
+                    missing = set()
+                    async for message in self._replay(replayed_from, replayed_to, user_id, missing):
+                        yield message
+                    sent_id = replayed_to
+                    continue
+
+                if replayed_from < notice.id <= replayed_to:
+                    if notice.id not in missing:
+                        continue
+                    missing.discard(notice.id)
+                # ID は送信済みのものより小さくしない
+                yield notice.to_sse(with_id=notice.id > sent_id)
+                events_sent_total.inc()
+                sent_id = max(sent_id, notice.id)
+        finally:
+            self.unsubscribe(subscriber)
+
+
+change_feed = ChangeFeed(EVENTS_POLL_INTERVAL, EVENTS_QUEUE_SIZE, EVENTS_RETENTION, EVENTS_GAP_TIMEOUT)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_local_events(session, flush_context):
+    event_ids = [obj.id for obj in session.new if isinstance(obj, ChangeEvent)]
+    if event_ids:
+        change_feed.note_local(event_ids)
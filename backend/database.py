@@ -1,21 +1,203 @@
+import itertools
 import os
-from sqlalchemy import create_engine
+import time
+from typing import List, Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from instrumentation import TimedAsyncQueuePool
+from metrics import Counter
+
 # 環境変数からデータベースURLを取得、なければデフォルト値
 DATABASE_URL = os.getenv(
     "DATABASE_URL",
     "mysql+pymysql://root:password@db:3306/dashboard_db"
 )
 
-engine = create_engine(DATABASE_URL, echo=True)
+# 同期ドライバに対応する非同期ドライバ
+ASYNC_DRIVERS = {
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+def to_async_url(url: str) -> str:
+    """同期ドライバの URL を非同期ドライバの URL に変換"""
+    parsed = make_url(url)
+    drivername = ASYNC_DRIVERS.get(parsed.drivername, parsed.drivername)
+    return parsed.set(drivername=drivername).render_as_string(hide_password=False)
+
+# API から使う非同期エンジンの URL（未指定なら DATABASE_URL から導出）
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+# 実行する SQL をすべて標準出力に出す（開発時のみ有効にする）
+SQL_ECHO = os.getenv("SQL_ECHO", "false").lower() in ("1", "true", "yes")
+
+# コネクションプール設定（エンジンごと、ワーカープロセスごと）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# 空きコネクションを待つ最大秒数（超えると TimeoutError）
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# この秒数より古いコネクションは作り直す（MySQL の wait_timeout より短くする）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 取り出すたびに疎通を確認し、切れたコネクションを捨てる
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+def pool_options(url: str, async_driver: bool = True) -> dict:
+    """エンジンに渡すプール設定（SQLite はドライバ既定のプールを使う）"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    options = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if async_driver:
+        options["poolclass"] = TimedAsyncQueuePool
+    return options
+
+# 同期エンジン（管理用スクリプトなど、イベントループ外の処理で使用）
+engine = create_engine(DATABASE_URL, echo=SQL_ECHO, **pool_options(DATABASE_URL, async_driver=False))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# 非同期エンジン（API のエンドポイントで使用）
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=SQL_ECHO, **pool_options(ASYNC_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+# =============================================
+# 読み取り用のレプリカ
+# =============================================
+#
+# DATABASE_REPLICA_URLS（カンマ区切り）を指定すると、get_read_db を使う読み取り専用の
+# エンドポイントはレプリカに順番に振り分けられる。未指定ならプライマリを使う。
+#
+# - 接続エラー・切断が起きたレプリカは DB_REPLICA_RETRY_INTERVAL 秒間使わず、
+#   プライマリ（または他のレプリカ）に振り分ける。再開時は最初のリクエストで
+#   接続を確認してから使うため、止まったままなら失敗せずにプライマリに戻る。
+# - このプロセスで書き込みがあってから DB_REPLICA_READ_AFTER_WRITE 秒間は
+#   プライマリから読む。レプリカの遅延で古い内容がレスポンスキャッシュに
+#   入らないようにするため（他のプロセスの書き込みは対象外）。
+
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()
+]
+DB_REPLICA_RETRY_INTERVAL = float(os.getenv("DB_REPLICA_RETRY_INTERVAL", "30"))
+DB_REPLICA_READ_AFTER_WRITE = float(os.getenv("DB_REPLICA_READ_AFTER_WRITE", "5"))
+
+db_read_sessions_total = Counter(
+    "db_read_sessions_total", "読み取り用セッションの振り分け先ごとの数", ["target"]
+)
+db_replica_failures_total = Counter(
+    "db_replica_failures_total", "レプリカで接続エラーが起きて切り離した回数", ["target"]
+)
+
+
+class Replica:
+    """レプリカ1台分のエンジンと状態"""
+
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine = create_async_engine(to_async_url(url), echo=SQL_ECHO, **pool_options(url))
+        self.sessionmaker = async_sessionmaker(
+            self.engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+        # この時刻まで振り分けない
+        self.down_until = 0.0
+        # 次に使う前に接続を確認するか（起動直後と切り離しの後）
+        self.needs_check = True
+        event.listen(self.engine.sync_engine, "handle_error", self._on_error)
+
+    def _on_error(self, exception_context) -> None:
+        # 接続できない（connection が None）か切断された場合のみ切り離す
+        if exception_context.connection is None or exception_context.is_disconnect:
+            self.mark_down()
+
+    def mark_down(self) -> None:
+        now = time.monotonic()
+        if self.down_until <= now:
+            db_replica_failures_total.inc(target=self.name)
+        self.down_until = now + DB_REPLICA_RETRY_INTERVAL
+        self.needs_check = True
+
+
+class ReplicaRouter:
+    """読み取り用セッションをレプリカに順番に振り分ける"""
+
+    def __init__(self, urls: List[str]):
+        self.replicas = [Replica(f"replica-{i}", url) for i, url in enumerate(urls)]
+        self._counter = itertools.count()
+        self._last_write = float("-inf")
+
+    def note_write(self) -> None:
+        """このプロセスで書き込みがあったことを記録（しばらくプライマリから読む）"""
+        self._last_write = time.monotonic()
+
+    def choose(self) -> Optional[Replica]:
+        """使えるレプリカ（なければ None でプライマリを使う）"""
+        if not self.replicas:
+            return None
+        now = time.monotonic()
+        if now - self._last_write < DB_REPLICA_READ_AFTER_WRITE:
+            return None
+        start = next(self._counter)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            if replica.down_until <= now:
+                return replica
+        return None
+
+    async def open_session(self) -> AsyncSession:
+        """振り分け先のセッションを開く（確認が必要なレプリカは接続してから返す）"""
+        replica = self.choose()
+        while replica is not None:
+            db = replica.sessionmaker()
+            if not replica.needs_check:
+                db_read_sessions_total.inc(target=replica.name)
+                return db
+            try:
+                await db.connection()
+            except DBAPIError:
+                await db.close()
+                replica.mark_down()
+                replica = self.choose()
+                continue
+            replica.needs_check = False
+            db_read_sessions_total.inc(target=replica.name)
+            return db
+        db_read_sessions_total.inc(target="primary")
+        return AsyncSessionLocal()
+
+    @property
+    def engines(self) -> list:
+        return [replica.engine for replica in self.replicas]
+
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS)
+
+async def get_read_db():
+    """読み取り専用のエンドポイント用のセッション（レプリカがあればそちらを使う）"""
+    async with await replica_router.open_session() as db:
+        yield db
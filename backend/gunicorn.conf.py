@@ -0,0 +1,89 @@
+import os
+import tempfile
+
+# =============================================
+# 本番用のサーバー設定（gunicorn + uvicorn ワーカー）
+# =============================================
+#
+# 起動: cd backend && gunicorn -c gunicorn.conf.py
+#
+# 再起動とデプロイ（マスターのプロセスにシグナルを送る）:
+# - HUP: 新しいワーカーを起動してから古いワーカーを順に終了する（設定の再読み込み）。
+#   アプリは preload 済みのため、コードの変更は反映されない。
+# - USR2 → WINCH → QUIT: コードを入れ替える場合。USR2 で新しいマスターが新しいコードを
+#   読み込んでワーカーを起動し、起動を確認してから古いマスターに WINCH（ワーカーを終了）、
+#   QUIT（マスターを終了）を送る。ソケットは引き継がれるため接続は途切れない。
+# - TERM: 各ワーカーは新しい接続の受け付けを止め、処理中のリクエストを
+#   GUNICORN_GRACEFUL_TIMEOUT 秒まで待ってから終了する。
+#   /api/events（SSE）の接続は終わらないため、その時点で切断される
+#   （クライアントは Last-Event-ID で再接続し、続きから受け取る）。
+#
+# ワーカーごとにコネクションプール（DB_POOL_SIZE + DB_MAX_OVERFLOW 本）を持つため、
+# ワーカー数 × その本数が MySQL の max_connections（既定 151）を超えないようにする。
+#
+# ワーカーごとに持つ状態:
+# - メトリクス: 各ワーカーが METRICS_DIR に書き出し、/api/metrics はどのワーカーでも
+#   全ワーカーの値を worker ラベル付きで返す（metrics.py を参照）。
+# - レスポンスキャッシュ（RESPONSE_CACHE_REDIS_URL を指定しない場合）、カテゴリ・タグ一覧の
+#   キャッシュ、タグのインデックス、検証済みトークンのキャッシュ: 書き込んだワーカーは
+#   すぐに、他のワーカーは change_events のポーリングで（EVENTS_POLL_INTERVAL 秒以内に）
+#   無効化する（main.py の _apply_remote_change を参照）。
+
+
+def _cpu_count() -> int:
+    """このプロセスが使える CPU の数"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# ワーカーが値を書き出すディレクトリ（アプリの読み込み前に決める）
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="dashboard-metrics-"))
+
+wsgi_app = "server:load_app()"
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+# ワーカーはイベントループで並行に処理するため、CPU 1つに1プロセス
+workers = int(os.getenv("WEB_CONCURRENCY", str(_cpu_count())))
+# アプリをマスターで読み込んでから fork する（ワーカーの起動では import などを行わない）
+preload_app = True
+# 応答のないワーカーを再起動するまでの秒数と、終了時に処理中のリクエストを待つ秒数
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# 指定した数のリクエストを処理したワーカーを入れ替える（0 で無効。ずらして一斉に再起動しない）
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+# アプリのロガー（起動時間レポートなど）も gunicorn と同じ出力に出す
+logconfig_dict = {
+    "root": {"level": loglevel.upper(), "handlers": ["console"]},
+    "loggers": {
+        "gunicorn.error": {"level": loglevel.upper(), "handlers": ["error_console"], "propagate": False},
+        "gunicorn.access": {"level": "INFO", "handlers": ["console"], "propagate": False},
+    },
+}
+
+
+def when_ready(server):
+    from database import DB_MAX_OVERFLOW, DB_POOL_SIZE
+
+    connections = server.num_workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    server.log.info(
+        "ワーカー %s 個で起動します（DB の接続は最大 %s 本 / エンジン）", server.num_workers, connections
+    )
+
+
+def post_fork(server, worker):
+    import server as entry_point
+
+    entry_point.reset_after_fork()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    # 終了したワーカーの値を集約の対象から外す
+    metrics.remove_snapshot(worker.pid)
@@ -0,0 +1,231 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import fastapi.routing
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# リクエストごとの計測
+# =============================================
+#
+# ASGI ミドルウェアがリクエストごとに RequestStats を作り、コンテキスト変数に置く。
+# その間に実行された SQL の数と時間（エンジンのイベント）、コネクションプールの
+# 待ち時間（プールのサブクラス）、レスポンスのシリアライズ時間を加算し、
+# レスポンスの送信後にルートごとのメトリクスとして記録する（/api/metrics で出力）。
+#
+# ルートのラベルはパスのテンプレート（/api/posts/{post_id} など）を使い、
+# どのルートにも一致しなかったリクエストは "unmatched" にまとめる。
+
+# この時間（ミリ秒）以上かかった SQL をログに出力する（0 なら出力しない）
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+# スロークエリのログに出力する SQL の最大文字数
+SLOW_QUERY_MAX_LENGTH = 2000
+
+UNMATCHED_ROUTE = "unmatched"
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+http_requests_total = Counter(
+    "http_requests_total", "リクエスト数", ["method", "route", "status"]
+)
+http_request_duration_seconds = Histogram(
+    "http_request_duration_seconds", "リクエストの処理時間（秒）", ["method", "route"]
+)
+http_request_db_queries = Histogram(
+    "http_request_db_queries", "1リクエストで実行した SQL の数", ["method", "route"],
+    buckets=QUERY_COUNT_BUCKETS,
+)
+http_request_db_seconds = Histogram(
+    "http_request_db_seconds", "1リクエストの SQL の実行時間の合計（秒）", ["method", "route"]
+)
+http_request_pool_wait_seconds = Histogram(
+    "http_request_pool_wait_seconds", "1リクエストのコネクション取得の待ち時間の合計（秒）", ["method", "route"]
+)
+http_request_serialization_seconds = Histogram(
+    "http_request_serialization_seconds", "1リクエストのレスポンスのシリアライズ時間（秒）", ["method", "route"]
+)
+db_query_duration_seconds = Histogram(
+    "db_query_duration_seconds", "SQL 1件の実行時間（秒）"
+)
+db_slow_queries_total = Counter(
+    "db_slow_queries_total", "SLOW_QUERY_MS 以上かかった SQL の数", ["route"]
+)
+
+
+class RequestStats:
+    """1リクエストの間に集計する値"""
+
+    __slots__ = ("route", "queries", "db_seconds", "pool_wait_seconds", "serialization_seconds")
+
+    def __init__(self):
+        self.route = UNMATCHED_ROUTE
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    """処理中のリクエストの RequestStats（リクエスト外の処理では None）"""
+    return _current_stats.get()
+
+
+class InstrumentationMiddleware:
+    """リクエストごとの処理時間と SQL の統計をメトリクスに記録する ASGI ミドルウェア"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_stats.set(stats)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_stats.reset(token)
+            labels = {"method": scope["method"], "route": stats.route}
+            http_requests_total.inc(status=str(status_code), **labels)
+            http_request_duration_seconds.observe(elapsed, **labels)
+            http_request_db_queries.observe(stats.queries, **labels)
+            http_request_db_seconds.observe(stats.db_seconds, **labels)
+            http_request_pool_wait_seconds.observe(stats.pool_wait_seconds, **labels)
+            http_request_serialization_seconds.observe(stats.serialization_seconds, **labels)
+
+
+class InstrumentedRoute(APIRoute):
+    """処理中のリクエストにルートのパステンプレートを記録する APIRoute"""
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def instrumented_handler(request):
+            stats = current_stats()
+            if stats is not None:
+                stats.route = route
+            return await handler(request)
+
+        return instrumented_handler
+
+
+# =============================================
+# シリアライズ時間
+# =============================================
+
+@contextmanager
+def measure_serialization():
+    """ブロック内の時間をシリアライズ時間として加算（自前でシリアライズする箇所で使う）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = current_stats()
+        if stats is not None:
+            stats.serialization_seconds += time.perf_counter() - started
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSON への変換時間を計測する JSONResponse（アプリの default_response_class に使う）"""
+
+    def render(self, content) -> bytes:
+        with measure_serialization():
+            return super().render(content)
+
+
+def instrument_serialize_response() -> None:
+    """response_model による検証・変換（fastapi.routing.serialize_response）の時間を計測する
+
+    FastAPI はこの関数を呼び出し時にモジュールから参照するため、差し替えで計測できる。
+    """
+    original = fastapi.routing.serialize_response
+    if getattr(original, "_instrumented", False):
+        return
+
+    async def serialize_response(*args, **kwargs):
+        with measure_serialization():
+            return await original(*args, **kwargs)
+
+    serialize_response._instrumented = True
+    fastapi.routing.serialize_response = serialize_response
+
+
+# =============================================
+# SQL とコネクションプール
+# =============================================
+
+def instrument_engine(engine) -> None:
+    """エンジンで実行される SQL の数と時間を記録する（非同期エンジンは sync_engine を渡す）"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    elapsed = time.perf_counter() - started
+    db_query_duration_seconds.observe(elapsed)
+
+    stats = current_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        route = stats.route if stats is not None else "-"
+        db_slow_queries_total.inc(route=route)
+        logger.warning(
+            "slow query: %.1fms route=%s sql=%s",
+            elapsed * 1000, route, " ".join(statement.split())[:SLOW_QUERY_MAX_LENGTH],
+        )
+
+
+def _handle_error(exception_context):
+    # 失敗した SQL は after_cursor_execute が呼ばれないため、開始時刻だけ捨てる
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    """コネクションの取得にかかった時間（空き待ちと新規接続を含む）を記録するプール"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = current_stats()
+            if stats is not None:
+                stats.pool_wait_seconds += time.perf_counter() - started
@@ -0,0 +1,429 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from metrics import Counter, Gauge, Histogram
+from models import Job
+from schemas import JobFailure, JobKindStats, JobQueueStats
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# バックグラウンドジョブ
+# =============================================
+#
+# リクエストの中で行う必要のない処理（公開予約の記事の公開、保存済みレスポンスの作り直しなど）を
+# jobs 表に登録し、各ワーカープロセス内のジョブ実行タスクが後から実行する。
+# 表に残るため、プロセスが再起動しても失われない。
+#
+# - 取得: 実行予定時刻を過ぎた queued の行を (status, run_at) のインデックス順に
+#   SELECT ... FOR UPDATE SKIP LOCKED で取り、running にしてから実行する
+#   （複数のワーカーが同じジョブを取らない）。
+# - 同時実行数: プロセスあたり JOB_CONCURRENCY 件。種類ごとの上限も指定できる。
+# - 再試行: 失敗したら指数バックオフ（JOB_BACKOFF_BASE 秒から倍々、上限 JOB_BACKOFF_MAX 秒、
+#   ゆらぎ付き）で queued に戻し、max_attempts 回失敗したら failed にする。
+# - 実行中のプロセスが落ちた場合は、JOB_LEASE_SECONDS 秒後に queued に戻して再実行する。
+#   そのため、ハンドラーは同じジョブが2回実行されても問題ないように書く。
+# - 定期ジョブ（interval を指定）は種類ごとに1行だけ作り、終わるたびに次の実行予定時刻で
+#   queued に戻す。ハンドラーが日時を返すと、それが早ければその時刻に実行する。
+#
+# 日時はすべて UTC（datetime.utcnow()）で保存・比較する。
+
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "3600"))
+# 完了したジョブを残す日数
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+# 終了時に実行中のジョブを待つ時間（秒。過ぎたら中断し、リース切れ後に再実行される）
+JOB_SHUTDOWN_TIMEOUT = float(os.getenv("JOB_SHUTDOWN_TIMEOUT", "10"))
+JOB_DEFAULT_MAX_ATTEMPTS = 5
+# リース切れの回収と古いジョブの削除を行う間隔（ポーリング回数）
+JOB_MAINTENANCE_EVERY = 60
+# 記録するエラーメッセージの最大文字数
+JOB_ERROR_MAX_LENGTH = 2000
+# 管理用の一覧に出す失敗ジョブの数
+JOB_RECENT_FAILURES = 20
+
+jobs_processed_total = Counter(
+    "jobs_processed_total", "実行したジョブの数（done / retry / failed）", ["kind", "result"]
+)
+job_wait_seconds = Histogram(
+    "job_wait_seconds", "実行予定時刻から実行開始までの待ち時間（秒）", ["kind"],
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+job_duration_seconds = Histogram(
+    "job_duration_seconds", "ジョブの実行時間（秒）", ["kind"]
+)
+jobs_running = Gauge("jobs_running", "このワーカーで実行中のジョブの数", ["kind"])
+
+# ハンドラーは payload を受け取る。定期ジョブは次に実行したい日時を返せる
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Optional[datetime]]]
+
+
+class JobKind(NamedTuple):
+    """登録済みのジョブの種類"""
+    handler: JobHandler
+    # この種類を同時に実行する数の上限（None は JOB_CONCURRENCY まで）
+    concurrency: Optional[int]
+    max_attempts: int
+    # 定期ジョブの実行間隔（秒）
+    interval: Optional[float]
+
+
+class ClaimedJob(NamedTuple):
+    """取得して実行中にしたジョブ"""
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+    max_attempts: int
+    run_at: datetime
+    token: str
+
+
+def backoff_seconds(attempts: int) -> float:
+    """attempts 回目の失敗の後、再実行までに待つ秒数"""
+    delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class JobQueue:
+    """jobs 表のジョブを取得し、プロセス内で並行に実行する"""
+
+    def __init__(self, concurrency: int, poll_interval: float, lease_seconds: float):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.kinds: Dict[str, JobKind] = {}
+        self._active: Set[asyncio.Task] = set()
+        self._running: Dict[str, int] = {}
+        self._polls = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- 登録 ----
+
+    def handler(
+        self,
+        kind: str,
+        concurrency: Optional[int] = None,
+        max_attempts: int = JOB_DEFAULT_MAX_ATTEMPTS,
+        interval: Optional[float] = None,
+    ) -> Callable[[JobHandler], JobHandler]:
+        """ジョブの種類とハンドラーを登録するデコレーター"""
+        def register(func: JobHandler) -> JobHandler:
+            self.kinds[kind] = JobKind(func, concurrency, max_attempts, interval)
+            return func
+        return register
+
+    def enqueue(
+        self,
+        db: AsyncSession,
+        kind: str,
+        payload: Optional[Dict[str, Any]] = None,
+        run_at: Optional[datetime] = None,
+    ) -> None:
+        """ジョブを追加する（呼び出し側の書き込みと同じトランザクション。コミット後に wake()）"""
+        registered = self.kinds.get(kind)
+        db.add(Job(
+            kind=kind,
+            payload=None if payload is None else json.dumps(payload),
+            status="queued",
+            attempts=0,
+            max_attempts=registered.max_attempts if registered else JOB_DEFAULT_MAX_ATTEMPTS,
+            run_at=run_at or datetime.utcnow(),
+        ))
+
+    async def run_periodic_by(self, db: AsyncSession, kind: str, run_at: datetime) -> None:
+        """定期ジョブの次の実行を run_at まで早める（すでに早ければ何もしない）"""
+        await db.execute(
+            update(Job)
+            .where(Job.dedupe_key == kind, Job.status == "queued", Job.run_at > run_at)
+            .values(run_at=run_at)
+            .execution_options(synchronize_session=False)
+        )
+
+    def wake(self) -> None:
+        """このワーカーでジョブを追加してコミットした直後に呼び、すぐに取得させる"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    # ---- 取得と実行 ----
+
+    async def _ensure_periodic(self) -> None:
+        """定期ジョブの行がなければ作る（別のワーカーが同時に作った場合は一意制約で1行になる）"""
+        keys = [kind for kind, registered in self.kinds.items() if registered.interval is not None]
+        if not keys:
+            return
+        async with AsyncSessionLocal() as db:
+            existing = set((await db.scalars(select(Job.dedupe_key).where(Job.dedupe_key.in_(keys)))).all())
+            missing = [kind for kind in keys if kind not in existing]
+            if not missing:
+                return
+            now = datetime.utcnow()
+            for kind in missing:
+                db.add(Job(
+                    kind=kind, dedupe_key=kind, status="queued", attempts=0,
+                    max_attempts=self.kinds[kind].max_attempts, run_at=now,
+                ))
+            try:
+                await db.commit()
+            except IntegrityError:
+                await db.rollback()
+
+    async def _claim(self, kinds: List[str], limit: int) -> List[ClaimedJob]:
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        async with AsyncSessionLocal() as db:
+            ids = (await db.scalars(
+                select(Job.id)
+                .where(Job.status == "queued", Job.run_at <= now, Job.kind.in_(kinds))
+                .order_by(Job.run_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not ids:
+                return []
+            await db.execute(
+                update(Job)
+                .where(Job.id.in_(ids), Job.status == "queued")
+                .values(
+                    status="running",
+                    attempts=Job.attempts + 1,
+                    locked_by=token,
+                    locked_until=now + timedelta(seconds=self.lease_seconds),
+                    started_at=now,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+            rows = (await db.execute(
+                select(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts, Job.run_at)
+                .where(Job.id.in_(ids), Job.locked_by == token)
+                .order_by(Job.run_at)
+            )).all()
+        return [
+            ClaimedJob(row.id, row.kind, json.loads(row.payload) if row.payload else {},
+                       row.attempts, row.max_attempts, row.run_at, token)
+            for row in rows
+        ]
+
+    async def _dispatch(self) -> None:
+        """空きの数だけジョブを取得して実行を始める"""
+        free = self.concurrency - len(self._active)
+        if free <= 0:
+            return
+        # 上限のない種類はまとめて、上限のある種類は空きの数だけ個別に取得する
+        unlimited = [kind for kind, registered in self.kinds.items() if registered.concurrency is None]
+        batches = [(unlimited, free)] if unlimited else []
+        for kind, registered in self.kinds.items():
+            if registered.concurrency is not None:
+                batches.append(([kind], min(free, registered.concurrency - self._running.get(kind, 0))))
+        for kinds, limit in batches:
+            limit = min(limit, self.concurrency - len(self._active))
+            if limit <= 0:
+                continue
+            for job in await self._claim(kinds, limit):
+                self._running[job.kind] = self._running.get(job.kind, 0) + 1
+                task = asyncio.create_task(self._execute(job))
+                self._active.add(task)
+                task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._active.discard(task)
+        # 空いた分をすぐに取得する
+        self.wake()
+
+    async def _execute(self, job: ClaimedJob) -> None:
+        registered = self.kinds.get(job.kind)
+        job_wait_seconds.observe(max((datetime.utcnow() - job.run_at).total_seconds(), 0.0), kind=job.kind)
+        jobs_running.inc(kind=job.kind)
+        started_at = time.perf_counter()
+        try:
+            if registered is None:
+                raise LookupError(f"未登録のジョブです: {job.kind}")
+            next_run = await registered.handler(job.payload)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception("ジョブ %s（%s）に失敗しました", job.id, job.kind)
+            await self._finish_failed(job, registered, e)
+        else:
+            await self._finish_done(job, registered, next_run)
+        finally:
+            job_duration_seconds.observe(time.perf_counter() - started_at, kind=job.kind)
+            jobs_running.dec(kind=job.kind)
+            self._running[job.kind] -= 1
+
+    def _rearm_values(self, registered: JobKind, next_run: Optional[datetime]) -> Dict[str, Any]:
+        """定期ジョブを次の実行予定時刻で queued に戻す値"""
+        now = datetime.utcnow()
+        run_at = now + timedelta(seconds=registered.interval)
+        if next_run is not None and next_run < run_at:
+            run_at = max(next_run, now)
+        return {"status": "queued", "attempts": 0, "run_at": run_at, "locked_by": None, "locked_until": None}
+
+    async def _finish(self, job: ClaimedJob, values: Dict[str, Any]) -> None:
+        # リースが切れて別のワーカーが取り直していた場合は何もしない
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(Job)
+                .where(Job.id == job.id, Job.locked_by == job.token)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            logger.warning("ジョブ %s（%s）のリースが切れていたため結果を記録しませんでした", job.id, job.kind)
+
+    async def _finish_done(self, job: ClaimedJob, registered: JobKind, next_run: Optional[datetime]) -> None:
+        if registered.interval is not None:
+            values = self._rearm_values(registered, next_run)
+            values["last_error"] = None
+        else:
+            values = {"status": "done", "finished_at": datetime.utcnow(), "locked_until": None}
+        await self._finish(job, values)
+        jobs_processed_total.inc(kind=job.kind, result="done")
+
+    async def _finish_failed(self, job: ClaimedJob, registered: Optional[JobKind], error: Exception) -> None:
+        message = f"{type(error).__name__}: {error}"[:JOB_ERROR_MAX_LENGTH]
+        if job.attempts < job.max_attempts:
+            values = {
+                "status": "queued",
+                "run_at": datetime.utcnow() + timedelta(seconds=backoff_seconds(job.attempts)),
+                "locked_by": None,
+                "locked_until": None,
+            }
+            result = "retry"
+        elif registered is not None and registered.interval is not None:
+            # 定期ジョブは止めずに次の回へ
+            values = self._rearm_values(registered, None)
+            result = "failed"
+        else:
+            values = {"status": "failed", "finished_at": datetime.utcnow(), "locked_until": None}
+            result = "failed"
+        values["last_error"] = message
+        await self._finish(job, values)
+        jobs_processed_total.inc(kind=job.kind, result=result)
+
+    async def _maintain(self) -> None:
+        """リースの切れた実行中のジョブを戻し、古い完了済みのジョブを削除する"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            expired = (Job.status == "running", Job.locked_until < now)
+            await db.execute(
+                update(Job)
+                .where(*expired, Job.attempts >= Job.max_attempts, Job.dedupe_key.is_(None))
+                .values(status="failed", finished_at=now, last_error="実行中にリースが切れました")
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                update(Job)
+                .where(*expired)
+                .values(status="queued", run_at=now, locked_by=None, locked_until=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(
+                delete(Job)
+                .where(Job.status == "done", Job.run_at < now - timedelta(days=JOB_RETENTION_DAYS))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _run(self) -> None:
+        try:
+            await self._ensure_periodic()
+        except Exception:
+            logger.exception("定期ジョブの登録に失敗しました")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                if self._polls % JOB_MAINTENANCE_EVERY == 0:
+                    await self._maintain()
+                self._polls += 1
+                await self._dispatch()
+            except Exception:
+                logger.exception("ジョブの取得に失敗しました")
+
+    def start(self) -> None:
+        """ジョブの取得と実行を開始"""
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """取得を止め、実行中のジョブを JOB_SHUTDOWN_TIMEOUT 秒まで待つ"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._active:
+            _, pending = await asyncio.wait(set(self._active), timeout=JOB_SHUTDOWN_TIMEOUT)
+            for task in pending:
+                task.cancel()
+
+    # ---- 管理用 ----
+
+    async def stats(self, db: AsyncSession) -> JobQueueStats:
+        """種類ごとの待ち件数・遅れと、このワーカーでの実行時間"""
+        now = datetime.utcnow()
+        due = case((Job.run_at <= now, True), else_=False)
+        rows = (await db.execute(
+            select(Job.kind, Job.status, due.label("due"), func.count(), func.min(Job.run_at))
+            .where(Job.status.in_(("queued", "running", "failed")))
+            .group_by(Job.kind, Job.status, due)
+        )).all()
+        kinds: Dict[str, Dict[str, Any]] = {
+            kind: {"kind": kind} for kind in sorted(self.kinds)
+        }
+        for kind, status, is_due, count, oldest in rows:
+            item = kinds.setdefault(kind, {"kind": kind})
+            if status == "queued" and is_due:
+                item["queued"] = count
+                item["oldest_due_seconds"] = max((now - oldest).total_seconds(), 0.0)
+            elif status == "queued":
+                item["scheduled"] = count
+                item["next_run_at"] = oldest
+            else:
+                item[status] = item.get(status, 0) + count
+        for kind, item in kinds.items():
+            processed = job_duration_seconds.count(kind=kind)
+            item["running_here"] = self._running.get(kind, 0)
+            item["processed_here"] = processed
+            if processed:
+                item["avg_wait_seconds"] = job_wait_seconds.sum(kind=kind) / job_wait_seconds.count(kind=kind)
+                item["avg_duration_seconds"] = job_duration_seconds.sum(kind=kind) / processed
+
+        failures = (await db.scalars(
+            select(Job)
+            .where(Job.status == "failed")
+            .order_by(Job.finished_at.desc())
+            .limit(JOB_RECENT_FAILURES)
+        )).all()
+        return JobQueueStats(
+            kinds=[JobKindStats(**item) for item in kinds.values()],
+            recent_failures=[JobFailure.model_validate(job) for job in failures],
+        )
+
+
+job_queue = JobQueue(JOB_CONCURRENCY, JOB_POLL_INTERVAL, JOB_LEASE_SECONDS)
@@ -1,27 +1,96 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from datetime import timedelta, datetime
-from typing import List, Optional
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import TypeAdapter
+from sqlalchemy import and_, or_, func, select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import timedelta, datetime, timezone
+import os
+from typing import List, Literal, Optional
 
-from database import get_db
-from models import User, Post, Category, Tag, PostTag
+from database import AsyncSessionLocal, async_engine, get_async_db, get_read_db, replica_router
+from models import (
+    User, Post, Category, Tag, PostTag,
+    Project, ProjectMember, Task, ProjectTaskSummary, ProjectTaskDueCount
+)
 from schemas import (
     LoginRequest, UserCreate, UserResponse, Token, PasswordChange,
-    CategoryCreate, CategoryResponse,
-    TagCreate, TagResponse,
-    PostCreate, PostUpdate, PostResponse, PostListResponse
+    CategoryCreate, CategoryResponse, CategoryWithCountResponse,
+    TagCreate, TagResponse, TagWithCountResponse, TagCloudItem,
+    PostCreate, PostUpdate, PostResponse, PostListResponse,
+    BulkImportResult, PostTagBatchRequest, PostTagBatchResult,
+    BatchRequest, BatchResponse, JobQueueStats,
+    ProjectCreate, ProjectUpdate, ProjectResponse,
+    ProjectMemberCreate, ProjectMemberResponse,
+    TaskCreate, TaskUpdate, TaskResponse, ProjectSummaryResponse
 )
 from auth import (
+    AuthenticatedUser,
     authenticate_user,
     create_access_token,
     hash_password,
     verify_password,
     get_current_active_user,
+    get_optional_user,
+    get_admin_user,
+    invalidate_user_tokens,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
+from admission import AdmissionMiddleware, escalate
+from batch import run_batch, validate_batch
+import metrics
+from bulk import PostImporter, iter_lines, export_posts_ndjson
+from cache import CachedBody, cached_json_response
+from change_feed import change_feed, project_audience, record_change
+from jobs import job_queue
+from pagination import NEXT_CURSOR_HEADER, encode_cursor, decode_cursor
+from response_cache import (
+    response_cache,
+    list_key,
+    detail_key,
+    list_cache_tag,
+    all_lists_cache_tag,
+    user_cache_tag,
+    category_cache_tag,
+    tag_cache_tag,
+    post_cache_tag,
+    entity_tags,
+)
+from projections import PostProjection
+from renditions import (
+    discard_renditions, load_rendition, negotiate_encoding, rendition_refresher, save_rendition,
+)
+from normalized import normalized_select, fetch_normalized
+from tag_sync import sync_post_tags, get_tag_ids_by_post, batch_update_tags
+from post_counters import apply_post_changes, cloud_weights
+from rollups import (
+    TASK_STATUSES, TASK_PRIORITIES,
+    task_state, apply_task_change, create_project_summary, get_project_summary
+)
+from search import search_post_ids, search_index, index_post, unindex_post
+from tag_index import tag_index
+from instrumentation import (
+    InstrumentationMiddleware,
+    InstrumentedRoute,
+    TimedJSONResponse,
+    instrument_engine,
+    instrument_serialize_response,
+    measure_serialization,
+)
+from taxonomy_cache import category_cache, tag_cache
+from view_counter import view_counter
+
+app = FastAPI(title="Dashboard API", version="1.0.0", default_response_class=TimedJSONResponse)
 
-app = FastAPI(title="Dashboard API", version="1.0.0")
+# ルートごとの処理時間・SQL の数などを記録（/api/metrics で出力）
+app.router.route_class = InstrumentedRoute
+for engine in [async_engine] + replica_router.engines:
+    instrument_engine(engine.sync_engine)
+instrument_serialize_response()
+
+# ルートの種類ごとの同時実行数の上限（CORS の内側に置き、503 にも CORS のヘッダーを付ける）
+app.add_middleware(AdmissionMiddleware, router=app.router)
 
 # CORS設定
 app.add_middleware(
@@ -30,7 +99,80 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
+app.add_middleware(InstrumentationMiddleware)
+
+@app.on_event("startup")
+async def start_view_counter():
+    view_counter.start()
+
+@app.on_event("shutdown")
+async def stop_view_counter():
+    # 貯まっている閲覧数を書き込んでから終了
+    await view_counter.stop()
+
+@app.on_event("startup")
+async def start_change_feed():
+    change_feed.start()
+
+@app.on_event("shutdown")
+async def stop_change_feed():
+    await change_feed.stop()
+
+@app.on_event("startup")
+async def start_metrics_snapshots():
+    metrics.snapshot_writer.start()
+
+@app.on_event("shutdown")
+async def stop_metrics_snapshots():
+    await metrics.snapshot_writer.stop()
+
+@app.on_event("startup")
+async def start_job_queue():
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def stop_job_queue():
+    # 実行中のジョブを待ってから終了（終わらなければリース切れ後に再実行される）
+    await job_queue.stop()
+
+# =============================================
+# 他のワーカーでの書き込みの反映
+# =============================================
+#
+# レスポンスキャッシュ（Redis を使わない場合）、カテゴリ・タグ一覧のキャッシュ、
+# タグのインデックス、検証済みトークンのキャッシュはワーカーごとに持つ。書き込んだワーカーは
+# その場で無効化し、他のワーカーは change_events のポーリングで受け取った通知から無効化する
+# （EVENTS_POLL_INTERVAL 秒以内）。
+
+@change_feed.listener
+async def _apply_remote_change(notice) -> None:
+    """他のワーカーでの書き込みを、このワーカーのキャッシュとインデックスに反映する"""
+    if notice.entity == "user":
+        invalidate_user_tokens(notice.entity_id)
+        tags = [user_cache_tag(notice.entity_id)]
+    elif notice.entity == "post" and notice.op == "reset":
+        tag_index.reset()
+        _invalidate_taxonomy_counts(True)
+        if not response_cache.shared:
+            await response_cache.clear()
+        return
+    elif notice.entity == "post":
+        # 変更前の状態（どの一覧に含まれていたか）は分からないため、一覧はまとめて破棄する
+        tag_index.expire()
+        _invalidate_taxonomy_counts(True)
+        tags = [post_cache_tag(notice.entity_id), all_lists_cache_tag()]
+    elif notice.entity == "category":
+        category_cache.invalidate()
+        tags = [category_cache_tag(notice.entity_id)]
+    elif notice.entity == "tag":
+        tag_cache.invalidate()
+        tags = [tag_cache_tag(notice.entity_id)]
+    else:
+        return
+    if not response_cache.shared:
+        await response_cache.invalidate(tags)
 
 # =============================================
 # 既存のエンドポイント（省略）
@@ -45,10 +187,64 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# メトリクス（Prometheus 形式）
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+# バックグラウンドジョブの待ち件数・遅れ・失敗（管理者のみ）
+@app.get("/api/admin/jobs", response_model=JobQueueStats)
+async def get_job_stats(
+    current_user: AuthenticatedUser = Depends(get_admin_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    return await job_queue.stats(db)
+
+# 読み取りリクエストの一括実行
+@app.post("/api/batch", response_model=BatchResponse)
+async def batch_requests(
+    batch: BatchRequest,
+    request: Request,
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+):
+    """複数の GET を1回のリクエストで並行に実行し、それぞれのステータスと本文をまとめて返す
+
+    トークンは最初に1回だけ検証し、各リクエストでは検証済みのユーザーを使う。
+    """
+    error = validate_batch(batch.requests, request.app.router)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+    body = await run_batch(request.app, request.scope, batch.requests, current_user)
+    return Response(body, media_type="application/json")
+
+# 変更通知（Server-Sent Events）
+@app.get("/api/events")
+async def stream_events(
+    request: Request,
+    last_event_id: Optional[int] = Query(None, ge=0, description="この通知 ID より後から受け取る（Last-Event-ID ヘッダーが優先）"),
+    current_user: Optional[AuthenticatedUser] = Depends(get_optional_user)
+):
+    """記事・カテゴリ・タグ・タスクの変更通知を SSE で配信する
+
+    タスクの通知はプロジェクトのメンバーとしてログインしている場合のみ届く。
+    再接続時は Last-Event-ID 以降の通知を送り直す。
+    """
+    header = request.headers.get("last-event-id")
+    if header is not None:
+        try:
+            last_event_id = int(header)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Last-Event-ID が不正です")
+    return StreamingResponse(
+        change_feed.stream(current_user.id if current_user else None, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ログインエンドポイント
 @app.post("/api/auth/login", response_model=Token)
-async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, login_data.email, login_data.password)
+async def login(login_data: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    user = await authenticate_user(db, login_data.email, login_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -65,9 +261,9 @@ async def login(login_data: LoginRequest, db: Session = Depends(get_db)):
 
 # ユーザー登録エンドポイント
 @app.post("/api/auth/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     # メールアドレスの重複チェック
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = await db.scalar(select(User).where(User.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -75,7 +271,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         )
     
     # ユーザー名の重複チェック
-    existing_username = db.query(User).filter(User.username == user_data.username).first()
+    existing_username = await db.scalar(select(User).where(User.username == user_data.username))
     if existing_username:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -86,18 +282,18 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     new_user = User(
         username=user_data.username,
         email=user_data.email,
-        password_hash=hash_password(user_data.password)
+        password_hash=await hash_password(user_data.password)
     )
     
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     
     return new_user
 
 # 現在のユーザー情報取得エンドポイント
 @app.get("/api/auth/me", response_model=UserResponse)
-async def read_users_me(current_user: User = Depends(get_current_active_user)):
+async def read_users_me(current_user: AuthenticatedUser = Depends(get_current_active_user)):
     return current_user
 
 # ログアウトエンドポイント（トークンを無効化する場合はクライアント側で削除）
@@ -109,52 +305,61 @@ async def logout():
 @app.put("/api/auth/me", response_model=UserResponse)
 async def update_user_profile(
     user_data: dict,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    user = await db.get(User, current_user.id)
+    
     # ユーザー名の更新（提供されている場合）
     if "username" in user_data:
         # 重複チェック
-        existing_user = db.query(User).filter(
+        existing_user = await db.scalar(select(User).where(
             User.username == user_data["username"],
             User.id != current_user.id
-        ).first()
+        ))
         if existing_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="このユーザー名は既に使用されています"
             )
-        current_user.username = user_data["username"]
+        user.username = user_data["username"]
     
     # メールアドレスの更新（提供されている場合）
     if "email" in user_data:
         # 重複チェック
-        existing_email = db.query(User).filter(
+        existing_email = await db.scalar(select(User).where(
             User.email == user_data["email"],
             User.id != current_user.id
-        ).first()
+        ))
         if existing_email:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="このメールアドレスは既に使用されています"
             )
-        current_user.email = user_data["email"]
+        user.email = user_data["email"]
     
-    db.commit()
-    db.refresh(current_user)
+    # 著者情報を埋め込んだ記事詳細のレスポンスは削除し、ジョブで作り直す
+    await discard_renditions(db, user_id=current_user.id)
+    job_queue.enqueue(db, "render_posts", {"user_id": current_user.id})
+    await db.commit()
+    job_queue.wake()
+    await db.refresh(user)
+    # 記事に埋め込まれた著者情報のキャッシュを破棄
+    await response_cache.invalidate([user_cache_tag(user.id)])
     
-    return current_user
+    return user
 # パスワード変更エンドポイント
-from schemas import PasswordChange
 
 @app.put("/api/auth/change-password")
 async def change_password(
     password_data: PasswordChange,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    user = await db.get(User, current_user.id)
+    
     # 現在のパスワードを確認
-    if not verify_password(password_data.current_password, current_user.password_hash):
+    if not await verify_password(password_data.current_password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="現在のパスワードが正しくありません"
@@ -168,8 +373,8 @@ async def change_password(
         )
     
     # パスワードを更新
-    current_user.password_hash = hash_password(password_data.new_password)
-    db.commit()
+    user.password_hash = await hash_password(password_data.new_password)
+    await db.commit()
     
     return {"message": "パスワードを変更しました"}
 
@@ -177,23 +382,22 @@ async def change_password(
 # カテゴリAPI
 # =============================================
 
-@app.get("/api/categories", response_model=List[CategoryResponse])
-async def get_categories(db: Session = Depends(get_db)):
-    """カテゴリ一覧を取得"""
-    categories = db.query(Category).all()
-    return categories
+@app.get("/api/categories", response_model=List[CategoryWithCountResponse])
+async def get_categories(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """カテゴリ一覧を記事数付きで取得（シリアライズ済みのキャッシュから返し、ETag が一致すれば 304）"""
+    return cached_json_response(request, await category_cache.get(db))
 
 @app.post("/api/categories", response_model=CategoryResponse, status_code=status.HTTP_201_CREATED)
 async def create_category(
     category: CategoryCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """カテゴリを作成"""
     # 重複チェック
-    existing = db.query(Category).filter(
+    existing = await db.scalar(select(Category).where(
         (Category.name == category.name) | (Category.slug == category.slug)
-    ).first()
+    ))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -202,8 +406,13 @@ async def create_category(
     
     new_category = Category(**category.dict())
     db.add(new_category)
-    db.commit()
-    db.refresh(new_category)
+    await db.flush()
+    record_change(db, "category", new_category.id, "create")
+    await db.commit()
+    change_feed.wake()
+    await db.refresh(new_category)
+    category_cache.invalidate()
+    await response_cache.invalidate([category_cache_tag(new_category.id)])
     return new_category
 
 
@@ -211,23 +420,44 @@ async def create_category(
 # タグAPI
 # =============================================
 
-@app.get("/api/tags", response_model=List[TagResponse])
-async def get_tags(db: Session = Depends(get_db)):
-    """タグ一覧を取得"""
-    tags = db.query(Tag).all()
-    return tags
+@app.get("/api/tags", response_model=List[TagWithCountResponse])
+async def get_tags(request: Request, db: AsyncSession = Depends(get_read_db)):
+    """タグ一覧を記事数付きで取得（シリアライズ済みのキャッシュから返し、ETag が一致すれば 304）"""
+    return cached_json_response(request, await tag_cache.get(db))
+
+# タグクラウドの大きさの段階数
+TAG_CLOUD_WEIGHTS = 5
+
+@app.get("/api/tags/cloud", response_model=List[TagCloudItem])
+async def get_tag_cloud(
+    limit: int = Query(50, ge=1, le=200, description="公開記事の多い順に取得するタグの数"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """タグクラウドを取得（タグの記事数の列だけを読み、名前順で返す）"""
+    rows = (await db.execute(
+        select(Tag.id, Tag.name, Tag.slug, Tag.published_count)
+        .where(Tag.published_count > 0)
+        .order_by(Tag.published_count.desc(), Tag.id)
+        .limit(limit)
+    )).all()
+    weights = cloud_weights([row.published_count for row in rows], TAG_CLOUD_WEIGHTS)
+    items = [
+        TagCloudItem(id=row.id, name=row.name, slug=row.slug, count=row.published_count, weight=weight)
+        for row, weight in zip(rows, weights)
+    ]
+    return sorted(items, key=lambda item: item.name)
 
 @app.post("/api/tags", response_model=TagResponse, status_code=status.HTTP_201_CREATED)
 async def create_tag(
     tag: TagCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """タグを作成"""
     # 重複チェック
-    existing = db.query(Tag).filter(
+    existing = await db.scalar(select(Tag).where(
         (Tag.name == tag.name) | (Tag.slug == tag.slug)
-    ).first()
+    ))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -236,8 +466,13 @@ async def create_tag(
     
     new_tag = Tag(**tag.dict())
     db.add(new_tag)
-    db.commit()
-    db.refresh(new_tag)
+    await db.flush()
+    record_change(db, "tag", new_tag.id, "create")
+    await db.commit()
+    change_feed.wake()
+    await db.refresh(new_tag)
+    tag_cache.invalidate()
+    await response_cache.invalidate([tag_cache_tag(new_tag.id)])
     return new_tag
 
 
@@ -245,62 +480,457 @@ async def create_tag(
 # 記事API
 # =============================================
 
+async def _get_post_with_relations(db: AsyncSession, post_id: int) -> Optional[Post]:
+    """レスポンスに必要なリレーションを含めて記事を1件取得"""
+    return await db.scalar(
+        select(Post)
+        .options(*Post.eager_options())
+        .where(Post.id == post_id)
+        .execution_options(populate_existing=True)
+    )
+
+async def _get_post_tag_ids(db: AsyncSession, post_id: int) -> List[int]:
+    """記事に付いているタグIDを取得"""
+    return list((await db.scalars(select(PostTag.tag_id).where(PostTag.post_id == post_id))).all())
+
+async def _invalidate_post_caches(post_id: int, *states) -> None:
+    """記事の変更前後の状態 (status, category_id, tag_ids) に応じてレスポンスキャッシュを破棄"""
+    await response_cache.invalidate_posts([post_id], states)
+
+def _invalidate_taxonomy_counts(changed: bool) -> None:
+    """カテゴリ・タグの記事数が変わった場合は一覧のキャッシュを破棄"""
+    if changed:
+        category_cache.invalidate()
+        tag_cache.invalidate()
+
+# 公開予約の記事を公開する定期ジョブの間隔（秒）と1回に公開する件数
+# 予約のたびに次の実行を予約日時まで早めるため、間隔は実行中に予約された場合の最大の遅れになる
+SCHEDULED_PUBLISH_INTERVAL = float(os.getenv("SCHEDULED_PUBLISH_INTERVAL", "60"))
+SCHEDULED_PUBLISH_BATCH = int(os.getenv("SCHEDULED_PUBLISH_BATCH", "100"))
+
+def _schedule_publication(data: dict, current_status: Optional[str] = None) -> Optional[datetime]:
+    """publish_at を取り出して公開日時に設定し、未来の日時なら予約した日時を返す（status は scheduled）"""
+    publish_at = data.pop('publish_at', None)
+    if publish_at is None:
+        if data.get('status') == 'scheduled' and current_status != 'scheduled':
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="公開予約には publish_at を指定してください"
+            )
+        return None
+    # 日時は UTC で保存する
+    if publish_at.tzinfo is not None:
+        publish_at = publish_at.astimezone(timezone.utc).replace(tzinfo=None)
+    data['published_at'] = publish_at
+    if publish_at <= datetime.utcnow():
+        data['status'] = 'published'
+        return None
+    data['status'] = 'scheduled'
+    return publish_at
+
+async def _commit_post_update(db: AsyncSession, post: Post, old_state, new_state) -> Post:
+    """変更した記事を集計・変更通知・保存済みレスポンスと合わせてコミットし、キャッシュと索引に反映"""
+    counts_changed = await apply_post_changes(db, [(old_state, new_state)])
+    record_change(db, "post", post.id, "update")
+    # 詳細のレスポンスを同じトランザクションで作り直す
+    await db.flush()
+    updated = await _get_post_with_relations(db, post.id)
+    await save_rendition(db, updated)
+    await db.commit()
+    change_feed.wake()
+    
+    await _invalidate_post_caches(
+        post.id, old_state, (updated.status, updated.category_id, [t.id for t in updated.tags])
+    )
+    _invalidate_taxonomy_counts(counts_changed)
+    index_post(updated)
+    tag_index.update(post.id, old_state, new_state)
+    return updated
+
+@job_queue.handler("publish_scheduled_posts", interval=SCHEDULED_PUBLISH_INTERVAL)
+async def publish_scheduled_posts(payload: dict) -> Optional[datetime]:
+    """公開日時を過ぎた公開予約の記事を公開し、次に公開する日時を返す"""
+    now = datetime.utcnow()
+    # (status, published_at) のインデックスで、期限を過ぎた記事だけを公開日時の順に読む
+    async with AsyncSessionLocal() as db:
+        post_ids = (await db.scalars(
+            select(Post.id)
+            .where(Post.status == 'scheduled', Post.published_at <= now)
+            .order_by(Post.published_at)
+            .limit(SCHEDULED_PUBLISH_BATCH)
+        )).all()
+        for post_id in post_ids:
+            # 同時に編集・公開された記事は飛ばす
+            post = await db.scalar(
+                select(Post).where(Post.id == post_id, Post.status == 'scheduled').with_for_update()
+            )
+            if post is None:
+                await db.rollback()
+                continue
+            old_state = (post.status, post.category_id, await _get_post_tag_ids(db, post_id))
+            post.status = 'published'
+            await _commit_post_update(db, post, old_state, ('published',) + old_state[1:])
+        if len(post_ids) == SCHEDULED_PUBLISH_BATCH:
+            return now
+        return await db.scalar(select(func.min(Post.published_at)).where(Post.status == 'scheduled'))
+
+
+def _apply_post_filters(query, status: Optional[str], category_id: Optional[int], tag_id: Optional[int]):
+    """一覧・検索で共通の絞り込み条件を適用"""
+    # ステータスでフィルタ
+    if status:
+        query = query.where(Post.status == status)
+    
+    # カテゴリでフィルタ
+    if category_id:
+        query = query.where(Post.category_id == category_id)
+    
+    # タグでフィルタ
+    if tag_id:
+        query = query.join(PostTag, PostTag.post_id == Post.id).where(PostTag.tag_id == tag_id)
+    return query
+
+_post_list_adapter = TypeAdapter(List[PostListResponse])
+
+FORMAT_DESCRIPTION = "normalized を指定すると著者・カテゴリ・タグを ID で参照し、included にまとめて返す"
+FIELDS_DESCRIPTION = "返す項目（カンマ区切り。例: id,title,author.username,tags.slug）。省略時はすべて"
+
+def _parse_post_fields(fields: Optional[str]) -> Optional[PostProjection]:
+    """fields= を解釈（未指定なら None で通常のレスポンス）"""
+    if not fields or not fields.strip():
+        return None
+    try:
+        return PostProjection.parse(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _parse_id_list(value: Optional[str], name: str) -> List[int]:
+    """カンマ区切りの ID を解釈（重複は除いて昇順）"""
+    if not value:
+        return []
+    try:
+        return sorted({int(part) for part in value.split(",") if part.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} が不正です")
+
 @app.get("/api/posts", response_model=List[PostListResponse])
 async def get_posts(
-    status: Optional[str] = Query(None, description="記事のステータス（draft, published, archived）"),
+    request: Request,
+    status: Optional[str] = Query(None, description="記事のステータス（draft, published, archived, scheduled）"),
     category_id: Optional[int] = Query(None, description="カテゴリID"),
     tag_id: Optional[int] = Query(None, description="タグID"),
+    tag_ids: Optional[str] = Query(None, description="タグID（カンマ区切り）"),
+    match: Literal["all", "any"] = Query("all", description="tag_ids のすべて（all）かいずれか（any）を含む記事"),
+    exclude_tag_ids: Optional[str] = Query(None, description="除外するタグID（カンマ区切り）"),
     limit: int = Query(10, ge=1, le=100),
     offset: int = Query(0, ge=0),
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = Query(None, description="前のページの X-Next-Cursor（指定時は offset を無視）"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    format: Optional[Literal["nested", "normalized"]] = Query(None, description=FORMAT_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """記事一覧を取得"""
-    query = db.query(Post)
+    """記事一覧を取得
+
+    offset による従来のページングに加えて、(created_at, id) をキーにした
+    カーソルページングに対応する。次ページのカーソルは X-Next-Cursor ヘッダーで返す。
+    シリアライズ済みのレスポンスをキャッシュし、ETag が一致すれば 304 を返す。
+    fields= を指定すると、その項目の列だけを読んで返す。
+    format=normalized を指定すると {"data": [...], "included": {...}} の形で返す。
+    tag_ids= / exclude_tag_ids= での絞り込みは、タグのビットマップインデックスで
+    1ページ分の記事IDを求めてから、主キーで読む。
+    """
+    projection = _parse_post_fields(fields)
+    normalized = format == "normalized"
+    if projection is not None and normalized:
+        raise HTTPException(status_code=400, detail="fields と format=normalized は同時に指定できません")
+    required_tag_ids = _parse_id_list(tag_ids, "tag_ids")
+    excluded_tag_ids = _parse_id_list(exclude_tag_ids, "exclude_tag_ids")
+    use_tag_index = bool(required_tag_ids or excluded_tag_ids)
+    if use_tag_index and tag_id:
+        raise HTTPException(status_code=400, detail="tag_id と tag_ids / exclude_tag_ids は同時に指定できません")
+    key = list_key(
+        status=status, category_id=category_id, tag_id=tag_id,
+        tag_ids=",".join(map(str, required_tag_ids)) or None,
+        match=match if len(required_tag_ids) > 1 else None,
+        exclude_tag_ids=",".join(map(str, excluded_tag_ids)) or None,
+        limit=limit, offset=0 if cursor else offset, cursor=cursor,
+        fields=projection.key if projection else None,
+        format="normalized" if normalized else None,
+    )
+    cached = await response_cache.get("posts_list", key)
+    if cached is not None:
+        return cached_json_response(request, cached)
+    # キャッシュに無く DB を読む場合だけ、重い読み取りとして受け付け直す
+    await escalate(request, "heavy_read")
     
-    # ステータスでフィルタ
-    if status:
-        query = query.filter(Post.status == status)
+    # DB を読む前に世代を控えておき、読んでいる間の更新で古い内容が残らないようにする
+    # （複数タグでの絞り込みは、どの記事の変更でも結果が変わりうるためタグを問わない一覧として扱う）
+    cache_tags = [list_cache_tag(status, category_id, tag_id), all_lists_cache_tag()]
+    generations = await response_cache.snapshot(cache_tags)
     
-    # カテゴリでフィルタ
-    if category_id:
-        query = query.filter(Post.category_id == category_id)
+    if projection is not None:
+        query = projection.select()
+    elif normalized:
+        query = normalized_select()
+    else:
+        query = select(Post).options(*Post.eager_options())
+    query = _apply_post_filters(query, status, category_id, tag_id)
     
-    # タグでフィルタ
-    if tag_id:
-        query = query.join(PostTag).filter(PostTag.tag_id == tag_id)
+    # カーソル位置より後ろ（古い側）だけを対象にする
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            # 引数 status がモジュールを隠しているため数値で指定
+            raise HTTPException(status_code=400, detail="カーソルが不正です")
     
-    # 最新順でソート
-    query = query.order_by(Post.created_at.desc())
+    if use_tag_index:
+        # 絞り込みと1ページ分の選択はインデックスで行い、DB は主キーで読むだけにする
+        await tag_index.ensure_fresh(db)
+        matched = tag_index.filter(
+            required_tag_ids, match == "all", excluded_tag_ids, status, category_id
+        )
+        page_ids = tag_index.page(matched, limit, 0 if cursor else offset, after)
+        query = query.where(Post.id.in_(page_ids))
+    else:
+        if after:
+            query = query.where(or_(
+                Post.created_at < after[0],
+                and_(Post.created_at == after[0], Post.id < after[1])
+            ))
+        # ページネーション
+        if not cursor:
+            query = query.offset(offset)
+        query = query.limit(limit)
+    
+    # 最新順でソート（同時刻の記事は ID で順序を固定）
+    query = query.order_by(Post.created_at.desc(), Post.id.desc())
+    if projection is not None:
+        posts = await projection.fetch(db, query)
+        with measure_serialization():
+            body = projection.render(posts)
+        cache_tags += projection.cache_tags(posts)
+    elif normalized:
+        page = await fetch_normalized(db, query)
+        posts = page.posts
+        with measure_serialization():
+            body = page.render()
+        cache_tags += page.cache_tags()
+    else:
+        posts = (await db.scalars(query)).all()
+        with measure_serialization():
+            body = _post_list_adapter.dump_json(_post_list_adapter.validate_python(posts, from_attributes=True))
+        cache_tags += entity_tags(
+            [p.user_id for p in posts], [p.category_id for p in posts], [t.id for p in posts for t in p.tags]
+        )
     
-    # ページネーション
-    posts = query.offset(offset).limit(limit).all()
-    return posts
+    # 続きがありうる場合は次ページのカーソルを返す
+    headers = {}
+    if len(posts) == limit:
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(posts[-1].created_at, posts[-1].id)
+    
+    cached = CachedBody.from_body(body, headers)
+    await response_cache.set(key, cached, cache_tags, generations)
+    return cached_json_response(request, cached)
 
-@app.get("/api/posts/{post_id}", response_model=PostResponse)
-async def get_post(post_id: int, db: Session = Depends(get_db)):
-    """記事詳細を取得"""
-    post = db.query(Post).filter(Post.id == post_id).first()
-    if not post:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="記事が見つかりません"
+@app.get("/api/posts/search", response_model=List[PostListResponse])
+async def search_posts(
+    q: str = Query(..., min_length=1, description="検索語（タイトル・概要・本文が対象）"),
+    status: Optional[str] = Query(None, description="記事のステータス（draft, published, archived, scheduled）"),
+    category_id: Optional[int] = Query(None, description="カテゴリID"),
+    tag_id: Optional[int] = Query(None, description="タグID"),
+    limit: int = Query(10, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """記事を全文検索（関連度の高い順）"""
+    post_ids = await search_post_ids(
+        db, q, lambda query: _apply_post_filters(query, status, category_id, tag_id), limit, offset
+    )
+    if not post_ids:
+        return []
+    
+    posts = (await db.scalars(
+        select(Post).options(*Post.eager_options()).where(Post.id.in_(post_ids))
+    )).all()
+    order = {post_id: i for i, post_id in enumerate(post_ids)}
+    return sorted(posts, key=lambda post: order[post.id])
+
+@app.get("/api/posts/export")
+async def export_posts(current_user: AuthenticatedUser = Depends(get_current_active_user)):
+    """全記事を NDJSON でストリーミング出力（1行1記事、tag_ids 付き）"""
+    return StreamingResponse(export_posts_ndjson(), media_type="application/x-ndjson")
+
+@app.post("/api/posts/bulk", response_model=BulkImportResult)
+async def bulk_import_posts(
+    request: Request,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """NDJSON（1行1記事）の記事を一括で取り込む
+
+    行ごとに検証し、一定件数ごとにまとめて挿入・コミットする。
+    取り込めなかった行は行番号とエラー内容を返す。
+    """
+    importer = PostImporter(db, current_user.id)
+    try:
+        return await importer.run(iter_lines(request.stream()))
+    finally:
+        # 途中で失敗・切断した場合も、それまでにコミットしたチャンクの分は反映する
+        if importer.inserted:
+            await _invalidate_after_bulk_import(db)
+
+async def _invalidate_after_bulk_import(db: AsyncSession) -> None:
+    """取り込んだ記事はどの一覧にも入りうるため、キャッシュと検索インデックスは作り直す"""
+    await response_cache.clear()
+    search_index.reset()
+    tag_index.reset()
+    _invalidate_taxonomy_counts(True)
+    # 記事ごとには通知せず、一覧を読み直してもらう（失敗したチャンクのトランザクションは捨てる）
+    await db.rollback()
+    record_change(db, "post", None, "reset")
+    await db.commit()
+    change_feed.wake()
+
+# 記事タグの一括変更エンドポイント
+@app.post("/api/posts/tags:batch", response_model=PostTagBatchResult)
+async def batch_update_post_tags(
+    batch: PostTagBatchRequest,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """複数の記事にまとめてタグを追加・削除（自分の記事のみ対象）"""
+    tag_ids = set(batch.add_tag_ids) | set(batch.remove_tag_ids)
+    if tag_ids:
+        found = set((await db.scalars(select(Tag.id).where(Tag.id.in_(tag_ids)))).all())
+        if found != tag_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"存在しないタグが含まれています: {sorted(tag_ids - found)}"
+            )
+    
+    post_ids = list(dict.fromkeys(batch.post_ids))
+    rows = {}
+    for start in range(0, len(post_ids), 1000):
+        result = await db.execute(
+            select(Post.id, Post.user_id, Post.status, Post.category_id)
+            .where(Post.id.in_(post_ids[start:start + 1000]))
         )
+        rows.update({row.id: row for row in result})
+    not_found = [post_id for post_id in post_ids if post_id not in rows]
+    forbidden = [post_id for post_id in post_ids if post_id in rows and rows[post_id].user_id != current_user.id]
+    updated = [post_id for post_id in post_ids if post_id in rows and rows[post_id].user_id == current_user.id]
+    
+    current = await get_tag_ids_by_post(db, updated)
+    added, removed = await batch_update_tags(
+        db, current, set(batch.add_tag_ids), set(batch.remove_tag_ids)
+    )
+    
+    changes = []
+    if added or removed:
+        add, remove = set(batch.add_tag_ids) - set(batch.remove_tag_ids), set(batch.remove_tag_ids)
+        for post_id in updated:
+            row = rows[post_id]
+            changes.append((
+                (row.status, row.category_id, current[post_id]),
+                (row.status, row.category_id, (current[post_id] | add) - remove),
+            ))
+    counts_changed = await apply_post_changes(db, changes)
+    if changes:
+        for post_id in updated:
+            record_change(db, "post", post_id, "update")
+        # タグが変わった記事の詳細のレスポンスは削除し、ジョブで作り直す
+        await discard_renditions(db, post_ids=updated)
+        job_queue.enqueue(db, "render_posts", {"post_ids": updated})
+    await db.commit()
+    
+    if changes:
+        change_feed.wake()
+        job_queue.wake()
+        await response_cache.invalidate_posts(updated, [state for change in changes for state in change])
+        _invalidate_taxonomy_counts(counts_changed)
+        for post_id, (old_state, new_state) in zip(updated, changes):
+            tag_index.update(post_id, old_state, new_state)
+    
+    return PostTagBatchResult(
+        updated=updated, not_found=not_found, forbidden=forbidden, added=added, removed=removed
+    )
+
+@app.get("/api/posts/{post_id}", response_model=PostResponse)
+async def get_post(
+    post_id: int,
+    request: Request,
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """記事詳細を取得
+
+    記事の書き込み時に保存したレスポンス（JSON と gzip・brotli の圧縮済み）から、
+    Accept-Encoding に合う1つに閲覧数を付け足して返す（再圧縮はしない）。まだ保存されていない
+    記事はシリアライズして返し、応答後に保存する（renditions.py を参照）。
+    返したレスポンスはキャッシュし、キャッシュ中の閲覧数は作成時点の値（最大 RESPONSE_CACHE_TTL 秒前）になる。
+    fields= を指定すると、その項目の列だけを読んで返す。
+    """
+    projection = _parse_post_fields(fields)
+    encoding = None if projection else negotiate_encoding(request.headers.get("accept-encoding"))
+    key = detail_key(post_id, projection.key if projection else None, encoding)
+    refresh = False
+    cached = await response_cache.get("post_detail", key)
+    if cached is None:
+        cache_tags = [post_cache_tag(post_id)]
+        generations = await response_cache.snapshot(cache_tags)
+        stored = await load_rendition(db, post_id, encoding) if projection is None else None
+        if stored is not None:
+            # 閲覧数はまだ DB に反映されていない分とこの閲覧を加えて返す
+            cached = stored.to_cached_body(stored.view_count + view_counter.pending(post_id) + 1)
+            cache_tags += entity_tags([stored.user_id], [stored.category_id], [])
+        else:
+            if projection is None:
+                post = await _get_post_with_relations(db, post_id)
+            else:
+                projected = await projection.fetch(db, projection.select().where(Post.id == post_id))
+                post = projected[0] if projected else None
+            if not post:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="記事が見つかりません"
+                )
+            
+            # 閲覧数はまだ DB に反映されていない分とこの閲覧を加えて返す
+            if projection is None:
+                # 保存済みのレスポンスがない記事（一括インポートしたものなど）は応答後に保存する
+                refresh = True
+                with measure_serialization():
+                    response = PostResponse.model_validate(post)
+                    response.view_count = post.view_count + view_counter.pending(post_id) + 1
+                    cached = CachedBody.from_body(response.model_dump_json().encode())
+                cache_tags += entity_tags([post.user_id], [post.category_id], [t.id for t in post.tags])
+            else:
+                if "view_count" in post.data:
+                    post.data["view_count"] += view_counter.pending(post_id) + 1
+                with measure_serialization():
+                    cached = CachedBody.from_body(projection.render_one(post))
+                cache_tags += projection.cache_tags([post])
+        await response_cache.set(key, cached, cache_tags, generations)
     
-    # 閲覧数を増加
-    post.view_count += 1
-    db.commit()
+    # 閲覧数はメモリに記録し、まとめて DB に反映する（このリクエストでは書き込まない）
+    view_counter.hit(post_id)
     
-    return post
+    response = cached_json_response(request, cached, None if projection else {"Vary": "Accept-Encoding"})
+    if refresh and rendition_refresher.reserve(post_id):
+        response.background = BackgroundTask(rendition_refresher.refresh, post_id)
+    return response
 
 @app.post("/api/posts", response_model=PostResponse, status_code=status.HTTP_201_CREATED)
 async def create_post(
     post: PostCreate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """記事を作成"""
     # スラッグの重複チェック
-    existing = db.query(Post).filter(Post.slug == post.slug).first()
+    existing = await db.scalar(select(Post).where(Post.slug == post.slug))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -310,36 +940,47 @@ async def create_post(
     # 記事データを準備
     post_data = post.dict()
     tag_ids = post_data.pop('tag_ids', [])
+    scheduled_at = _schedule_publication(post_data)
     
     # 公開ステータスの場合は公開日時を設定
-    if post.status == 'published':
+    if post_data['status'] == 'published' and 'published_at' not in post_data:
         post_data['published_at'] = datetime.utcnow()
     
-    # 記事を作成
+    # 記事を作成（ID の採番のため flush し、タグと合わせて1回でコミット）
     new_post = Post(**post_data, user_id=current_user.id)
     db.add(new_post)
-    db.commit()
-    db.refresh(new_post)
+    await db.flush()
     
     # タグを関連付け
-    if tag_ids:
-        for tag_id in tag_ids:
-            post_tag = PostTag(post_id=new_post.id, tag_id=tag_id)
-            db.add(post_tag)
-        db.commit()
-        db.refresh(new_post)
+    tag_ids = tag_ids or []
+    await sync_post_tags(db, new_post.id, [], tag_ids)
+    new_state = (new_post.status, new_post.category_id, tag_ids)
+    counts_changed = await apply_post_changes(db, [(None, new_state)])
+    record_change(db, "post", new_post.id, "create")
+    # 詳細のレスポンスを同じトランザクションで保存
+    created = await _get_post_with_relations(db, new_post.id)
+    await save_rendition(db, created)
+    if scheduled_at is not None:
+        await job_queue.run_periodic_by(db, "publish_scheduled_posts", scheduled_at)
+    await db.commit()
+    change_feed.wake()
     
-    return new_post
+    await _invalidate_post_caches(new_post.id, new_state)
+    _invalidate_taxonomy_counts(counts_changed)
+    index_post(created)
+    tag_index.update(created.id, None, new_state, created.created_at)
+    return created
 
 @app.put("/api/posts/{post_id}", response_model=PostResponse)
 async def update_post(
     post_id: int,
     post_update: PostUpdate,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """記事を更新"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+    # 変更前の状態（集計に使う）を読む間に他の更新が割り込まないよう、行をロックして読む
+    post = await db.get(Post, post_id, with_for_update=True)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -353,51 +994,52 @@ async def update_post(
             detail="この記事を編集する権限がありません"
         )
     
+    old_state = (post.status, post.category_id, await _get_post_tag_ids(db, post_id))
+    
     # 更新データを準備
     update_data = post_update.dict(exclude_unset=True)
     tag_ids = update_data.pop('tag_ids', None)
     
     # スラッグの重複チェック
     if 'slug' in update_data:
-        existing = db.query(Post).filter(
+        existing = await db.scalar(select(Post).where(
             Post.slug == update_data['slug'],
             Post.id != post_id
-        ).first()
+        ))
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="このスラッグは既に使用されています"
             )
     
+    scheduled_at = _schedule_publication(update_data, post.status)
+    
     # ステータスが公開に変更された場合
-    if update_data.get('status') == 'published' and post.status != 'published':
+    if update_data.get('status') == 'published' and post.status != 'published' and 'published_at' not in update_data:
         update_data['published_at'] = datetime.utcnow()
     
     # 記事を更新
     for key, value in update_data.items():
         setattr(post, key, value)
     
-    # タグを更新
+    # タグを更新（差分のみ反映）
     if tag_ids is not None:
-        # 既存のタグを削除
-        db.query(PostTag).filter(PostTag.post_id == post_id).delete()
-        # 新しいタグを追加
-        for tag_id in tag_ids:
-            post_tag = PostTag(post_id=post_id, tag_id=tag_id)
-            db.add(post_tag)
+        await sync_post_tags(db, post_id, old_state[2], tag_ids)
     
-    db.commit()
-    db.refresh(post)
-    return post
+    new_state = (post.status, post.category_id, old_state[2] if tag_ids is None else tag_ids)
+    if scheduled_at is not None:
+        await job_queue.run_periodic_by(db, "publish_scheduled_posts", scheduled_at)
+    return await _commit_post_update(db, post, old_state, new_state)
 
 @app.delete("/api/posts/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_post(
     post_id: int,
-    current_user: User = Depends(get_current_active_user),
-    db: Session = Depends(get_db)
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """記事を削除"""
-    post = db.query(Post).filter(Post.id == post_id).first()
+    # 変更前の状態（集計に使う）を読む間に他の更新が割り込まないよう、行をロックして読む
+    post = await db.get(Post, post_id, with_for_update=True)
     if not post:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -411,6 +1053,347 @@ async def delete_post(
             detail="この記事を削除する権限がありません"
         )
     
-    db.delete(post)
-    db.commit()
+    old_state = (post.status, post.category_id, await _get_post_tag_ids(db, post_id))
+    
+    await db.delete(post)
+    counts_changed = await apply_post_changes(db, [(old_state, None)])
+    record_change(db, "post", post_id, "delete")
+    await db.commit()
+    change_feed.wake()
+    await _invalidate_post_caches(post_id, old_state)
+    _invalidate_taxonomy_counts(counts_changed)
+    unindex_post(post_id)
+    tag_index.update(post_id, old_state, None)
+    return None
+
+# =============================================
+# プロジェクト・タスク
+# =============================================
+
+# プロジェクトの設定とメンバーを変更できるロール
+PROJECT_MANAGER_ROLES = ('owner', 'admin')
+# タスクを作成・編集できるロール
+PROJECT_EDITOR_ROLES = ('owner', 'admin', 'member')
+
+async def _get_project_for_user(
+    db: AsyncSession, project_id: int, user_id: int, roles: Optional[tuple] = None
+) -> Project:
+    """プロジェクトを取得し、ユーザーがメンバー（roles 指定時はそのロール）か確認"""
+    project = await db.get(Project, project_id)
+    if not project:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="プロジェクトが見つかりません"
+        )
+    
+    if project.user_id == user_id:
+        role = 'owner'
+    else:
+        role = await db.scalar(select(ProjectMember.role).where(
+            ProjectMember.project_id == project_id,
+            ProjectMember.user_id == user_id
+        ))
+    if role is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="このプロジェクトへのアクセス権がありません"
+        )
+    if roles is not None and role not in roles:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="この操作を行う権限がありません"
+        )
+    return project
+
+async def _get_task_for_user(
+    db: AsyncSession, task_id: int, user_id: int, roles: Optional[tuple] = None,
+    for_update: bool = False
+) -> Task:
+    # 更新・削除では、変更前の状態（集計に使う）を読む間に他の更新が割り込まないよう、行をロックして読む
+    task = await db.get(Task, task_id, with_for_update=for_update)
+    if not task:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="タスクが見つかりません"
+        )
+    await _get_project_for_user(db, task.project_id, user_id, roles)
+    return task
+
+async def _check_assignee(db: AsyncSession, project: Project, user_id: Optional[int]) -> None:
+    """担当者はプロジェクトのメンバーに限る"""
+    if user_id is None or user_id == project.user_id:
+        return
+    member = await db.scalar(select(ProjectMember.id).where(
+        ProjectMember.project_id == project.id,
+        ProjectMember.user_id == user_id
+    ))
+    if not member:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="担当者はプロジェクトのメンバーである必要があります"
+        )
+
+@app.get("/api/projects", response_model=List[ProjectResponse])
+async def get_projects(
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """自分が所有・参加しているプロジェクトの一覧を取得"""
+    member_of = select(ProjectMember.project_id).where(ProjectMember.user_id == current_user.id)
+    result = await db.scalars(
+        select(Project)
+        .where(or_(Project.user_id == current_user.id, Project.id.in_(member_of)))
+        .order_by(Project.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+    return result.all()
+
+@app.post("/api/projects", response_model=ProjectResponse, status_code=status.HTTP_201_CREATED)
+async def create_project(
+    project: ProjectCreate,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクトを作成（作成者がオーナーになる）"""
+    new_project = Project(**project.dict(), user_id=current_user.id)
+    db.add(new_project)
+    await db.flush()
+    
+    db.add(ProjectMember(project_id=new_project.id, user_id=current_user.id, role='owner'))
+    await create_project_summary(db, new_project.id)
+    await db.commit()
+    await db.refresh(new_project)
+    return new_project
+
+@app.get("/api/projects/{project_id}", response_model=ProjectResponse)
+async def get_project(
+    project_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクト詳細を取得"""
+    return await _get_project_for_user(db, project_id, current_user.id)
+
+@app.put("/api/projects/{project_id}", response_model=ProjectResponse)
+async def update_project(
+    project_id: int,
+    project_update: ProjectUpdate,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクトを更新（オーナー・管理者のみ）"""
+    project = await _get_project_for_user(db, project_id, current_user.id, PROJECT_MANAGER_ROLES)
+    for key, value in project_update.dict(exclude_unset=True).items():
+        setattr(project, key, value)
+    await db.commit()
+    await db.refresh(project)
+    return project
+
+@app.delete("/api/projects/{project_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_project(
+    project_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクトを削除（オーナーのみ）"""
+    await _get_project_for_user(db, project_id, current_user.id, ('owner',))
+    
+    # 外部キーの CASCADE がない DB（SQLite など）でも残らないよう、関連する行を明示的に削除
+    for model in (Task, ProjectMember, ProjectTaskSummary, ProjectTaskDueCount):
+        await db.execute(delete(model).where(model.project_id == project_id))
+    await db.execute(delete(Project).where(Project.id == project_id))
+    await db.commit()
+    return None
+
+@app.get("/api/projects/{project_id}/members", response_model=List[ProjectMemberResponse])
+async def get_project_members(
+    project_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクトのメンバー一覧を取得"""
+    await _get_project_for_user(db, project_id, current_user.id)
+    result = await db.scalars(
+        select(ProjectMember)
+        .where(ProjectMember.project_id == project_id)
+        .order_by(ProjectMember.id)
+    )
+    return result.all()
+
+@app.post("/api/projects/{project_id}/members", response_model=ProjectMemberResponse)
+async def add_project_member(
+    project_id: int,
+    member: ProjectMemberCreate,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """メンバーを追加（既にメンバーならロールを変更）"""
+    project = await _get_project_for_user(db, project_id, current_user.id, PROJECT_MANAGER_ROLES)
+    if member.user_id == project.user_id or member.role == 'owner':
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="オーナーは変更できません"
+        )
+    if not await db.get(User, member.user_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="ユーザーが見つかりません"
+        )
+    
+    existing = await db.scalar(select(ProjectMember).where(
+        ProjectMember.project_id == project_id,
+        ProjectMember.user_id == member.user_id
+    ))
+    if existing:
+        existing.role = member.role
+    else:
+        existing = ProjectMember(project_id=project_id, user_id=member.user_id, role=member.role)
+        db.add(existing)
+    await db.commit()
+    await db.refresh(existing)
+    return existing
+
+@app.delete("/api/projects/{project_id}/members/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def remove_project_member(
+    project_id: int,
+    user_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """メンバーを削除"""
+    project = await _get_project_for_user(db, project_id, current_user.id, PROJECT_MANAGER_ROLES)
+    if user_id == project.user_id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="オーナーは削除できません"
+        )
+    await db.execute(delete(ProjectMember).where(
+        ProjectMember.project_id == project_id,
+        ProjectMember.user_id == user_id
+    ))
+    await db.commit()
+    return None
+
+@app.get("/api/projects/{project_id}/summary", response_model=ProjectSummaryResponse)
+async def get_project_summary_endpoint(
+    project_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """ダッシュボード用のタスク集計を取得
+
+    タスクの書き込み時に更新している集計表から返すため、タスク数によらず一定のコストで済む。
+    """
+    await _get_project_for_user(db, project_id, current_user.id)
+    summary, overdue_count = await get_project_summary(db, project_id, datetime.utcnow().date())
+    return ProjectSummaryResponse(
+        project_id=project_id,
+        task_count=summary.task_count,
+        open_count=summary.task_count - summary.done_count,
+        overdue_count=overdue_count,
+        by_status={value: getattr(summary, f"{value}_count") for value in TASK_STATUSES},
+        by_priority={value: getattr(summary, f"{value}_count") for value in TASK_PRIORITIES},
+        estimated_hours=summary.estimated_hours,
+        actual_hours=summary.actual_hours,
+        updated_at=summary.updated_at,
+    )
+
+@app.get("/api/projects/{project_id}/tasks", response_model=List[TaskResponse])
+async def get_tasks(
+    project_id: int,
+    status: Optional[str] = Query(None, description="タスクのステータス"),
+    priority: Optional[str] = Query(None, description="優先度"),
+    assigned_to: Optional[int] = Query(None, description="担当者のユーザーID"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """プロジェクトのタスク一覧を取得"""
+    await _get_project_for_user(db, project_id, current_user.id)
+    query = select(Task).where(Task.project_id == project_id)
+    if status:
+        query = query.where(Task.status == status)
+    if priority:
+        query = query.where(Task.priority == priority)
+    if assigned_to is not None:
+        query = query.where(Task.assigned_to == assigned_to)
+    result = await db.scalars(query.order_by(Task.id.desc()).offset(offset).limit(limit))
+    return result.all()
+
+@app.post("/api/projects/{project_id}/tasks", response_model=TaskResponse, status_code=status.HTTP_201_CREATED)
+async def create_task(
+    project_id: int,
+    task: TaskCreate,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """タスクを作成（集計も同じトランザクションで更新）"""
+    project = await _get_project_for_user(db, project_id, current_user.id, PROJECT_EDITOR_ROLES)
+    await _check_assignee(db, project, task.assigned_to)
+    
+    new_task = Task(**task.dict(), project_id=project_id, user_id=current_user.id)
+    db.add(new_task)
+    await db.flush()
+    await apply_task_change(db, None, task_state(new_task))
+    record_change(db, "task", new_task.id, "create", await project_audience(db, project_id))
+    await db.commit()
+    change_feed.wake()
+    await db.refresh(new_task)
+    return new_task
+
+@app.get("/api/tasks/{task_id}", response_model=TaskResponse)
+async def get_task(
+    task_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """タスク詳細を取得"""
+    return await _get_task_for_user(db, task_id, current_user.id)
+
+@app.put("/api/tasks/{task_id}", response_model=TaskResponse)
+async def update_task(
+    task_id: int,
+    task_update: TaskUpdate,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """タスクを更新（集計も同じトランザクションで更新）"""
+    task = await _get_task_for_user(db, task_id, current_user.id, PROJECT_EDITOR_ROLES, for_update=True)
+    update_data = task_update.dict(exclude_unset=True)
+    if update_data.get('assigned_to') is not None:
+        await _check_assignee(db, await db.get(Project, task.project_id), update_data['assigned_to'])
+    
+    old_state = task_state(task)
+    for key, value in update_data.items():
+        setattr(task, key, value)
+    await db.flush()
+    await apply_task_change(db, old_state, task_state(task))
+    record_change(db, "task", task_id, "update", await project_audience(db, task.project_id))
+    await db.commit()
+    change_feed.wake()
+    await db.refresh(task)
+    return task
+
+@app.delete("/api/tasks/{task_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_task(
+    task_id: int,
+    current_user: AuthenticatedUser = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """タスクを削除（作成者またはプロジェクトのオーナー・管理者のみ）"""
+    task = await _get_task_for_user(db, task_id, current_user.id, for_update=True)
+    if task.user_id != current_user.id:
+        await _get_project_for_user(db, task.project_id, current_user.id, PROJECT_MANAGER_ROLES)
+    
+    old_state = task_state(task)
+    await db.delete(task)
+    await db.flush()
+    await apply_task_change(db, old_state, None)
+    record_change(db, "task", task_id, "delete", await project_audience(db, task.project_id))
+    await db.commit()
+    change_feed.wake()
     return None
\ No newline at end of file
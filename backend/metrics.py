@@ -0,0 +1,287 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# プロセス内メトリクス
+# =============================================
+#
+# Prometheus のテキスト形式で出力できる最小限の Counter / Gauge / Histogram。
+# 値はワーカープロセスごとに保持される。
+#
+# 複数ワーカー構成（METRICS_DIR を指定。gunicorn.conf.py で設定する）では、各ワーカーが
+# METRICS_SNAPSHOT_INTERVAL 秒ごとに自分の値を METRICS_DIR/<pid>.json に書き出し、
+# どのワーカーがスクレイプを受けても全ワーカーの値を worker="<pid>" のラベル付きで返す
+# （他のワーカーの値は最大 METRICS_SNAPSHOT_INTERVAL 秒前のもの）。
+# 合計は Prometheus 側で sum without (worker) などで求める。
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv("METRICS_SNAPSHOT_INTERVAL", "5"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+# 生成されたメトリクスはすべてここに登録される
+REGISTRY: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "", worker: str = "") -> str:
+    pairs = [f'worker="{worker}"'] if worker else []
+    pairs += [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+
+    def render(self) -> List[str]:
+        return self.header() + self.samples()
+
+    def samples(self, worker: str = "") -> List[str]:
+        """サンプルの行（worker を指定するとラベルに加える）"""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """単調増加するカウンター"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self, worker: str = "") -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key, worker=worker)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Gauge(_Metric):
+    """増減する現在値"""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self, worker: str = "") -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key, worker=worker)} {_format_value(value)}"
+            for key, value in items
+        ]
+
+
+class Histogram(_Metric):
+    """値の分布（累積バケット、合計、件数）"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def sum(self, **labels: str) -> float:
+        return self._sums.get(self._key(labels), 0.0)
+
+    def samples(self, worker: str = "") -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le, worker)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, key, worker=worker)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """登録済みのすべてのメトリクスを Prometheus のテキスト形式で出力"""
+    lines: List[str] = []
+    if not METRICS_DIR:
+        for metric in REGISTRY:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    # このワーカーは現在の値、他のワーカーは書き出された値を使う
+    worker = str(os.getpid())
+    others = _read_snapshots(exclude=worker)
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.samples(worker))
+        for snapshot in others:
+            lines.extend(snapshot.get(metric.name, ()))
+    return "\n".join(lines) + "\n"
+
+
+# =============================================
+# ワーカー間の集約（METRICS_DIR）
+# =============================================
+
+def snapshot_path(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+
+def write_snapshot() -> None:
+    """このワーカーの値を書き出す（読み手が書きかけを読まないよう、別名で書いてから置き換える）"""
+    worker = str(os.getpid())
+    data = {metric.name: metric.samples(worker) for metric in REGISTRY}
+    path = snapshot_path(os.getpid())
+    with open(path + ".tmp", "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def remove_snapshot(pid: int) -> None:
+    """終了したワーカーの値を消す"""
+    try:
+        os.remove(snapshot_path(pid))
+    except FileNotFoundError:
+        pass
+
+
+def _read_snapshots(exclude: str) -> List[Dict[str, List[str]]]:
+    snapshots = []
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not name.endswith(".json") or name == exclude + ".json":
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # 読む間に消えた（ワーカーが終了した）もの
+            continue
+    return snapshots
+
+
+class SnapshotWriter:
+    """このワーカーの値を定期的に METRICS_DIR に書き出す"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                write_snapshot()
+            except OSError:
+                logger.exception("メトリクスの書き出しに失敗しました")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """METRICS_DIR が指定されていれば書き出しを開始"""
+        if METRICS_DIR:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """書き出しを止め、このワーカーの値を消す"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        remove_snapshot(os.getpid())
+
+
+snapshot_writer = SnapshotWriter(METRICS_SNAPSHOT_INTERVAL)
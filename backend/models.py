@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, Text, Date, Enum, DECIMAL, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, TIMESTAMP, DateTime, Text, Date, Enum, DECIMAL, ForeignKey, Index, LargeBinary, UniqueConstraint
+from sqlalchemy.dialects import sqlite
 from sqlalchemy.sql import func
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, joinedload, selectinload, raiseload
 from database import Base
 
+# SQLite（ローカル検証用）では CURRENT_TIMESTAMP と同じ秒単位の書式で保存・比較する
+SortableTimestamp = TIMESTAMP().with_variant(sqlite.DATETIME(truncate_microseconds=True), "sqlite")
+
 class User(Base):
     __tablename__ = "users"
 
@@ -31,6 +35,9 @@ class Category(Base):
     name = Column(String(100), unique=True, nullable=False)
     slug = Column(String(100), unique=True, nullable=False, index=True)
     description = Column(Text)
+    # 記事数（記事の書き込みと同じトランザクションで更新。post_counters.py を参照）
+    post_count = Column(Integer, nullable=False, default=0)
+    published_count = Column(Integer, nullable=False, default=0)
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
@@ -40,10 +47,17 @@ class Category(Base):
 
 class Tag(Base):
     __tablename__ = "tags"
+    __table_args__ = (
+        # タグクラウド用（公開記事の多い順）
+        Index("idx_published_count", "published_count"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(50), unique=True, nullable=False)
     slug = Column(String(50), unique=True, nullable=False, index=True)
+    # 記事数（記事の書き込みと同じトランザクションで更新。post_counters.py を参照）
+    post_count = Column(Integer, nullable=False, default=0)
+    published_count = Column(Integer, nullable=False, default=0)
     created_at = Column(TIMESTAMP, server_default=func.now())
     
     # リレーション
@@ -52,6 +66,19 @@ class Tag(Base):
 
 class Post(Base):
     __tablename__ = "posts"
+    __table_args__ = (
+        # 一覧のキーセットページング用（init.sql と同じ定義）
+        Index("idx_created_at_id", "created_at", "id"),
+        Index("idx_status_created_at_id", "status", "created_at", "id"),
+        Index("idx_category_created_at_id", "category_id", "created_at", "id"),
+        # 公開予約の記事を公開日時の順に取得する
+        Index("idx_status_published_at", "status", "published_at"),
+        # 全文検索用（MySQL のみ。それ以外は search.py の転置インデックスを使う）
+        Index(
+            "ft_title_excerpt_content", "title", "excerpt", "content",
+            mysql_prefix="FULLTEXT", mysql_with_parser="ngram",
+        ).ddl_if(dialect="mysql"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -61,10 +88,11 @@ class Post(Base):
     content = Column(Text, nullable=False)
     excerpt = Column(Text)
     featured_image = Column(String(255))
-    status = Column(Enum('draft', 'published', 'archived'), default='draft')
+    # scheduled は公開予約（published_at に公開日時。jobs.py の定期ジョブが公開する）
+    status = Column(Enum('draft', 'published', 'archived', 'scheduled'), default='draft')
     published_at = Column(TIMESTAMP)
     view_count = Column(Integer, default=0)
-    created_at = Column(TIMESTAMP, server_default=func.now())
+    created_at = Column(SortableTimestamp, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
     
     # リレーション
@@ -72,6 +100,36 @@ class Post(Base):
     category = relationship("Category", back_populates="posts")
     tags = relationship("Tag", secondary="post_tags", back_populates="posts")
 
+    @classmethod
+    def eager_options(cls):
+        """レスポンスのシリアライズに必要なリレーションを一括で読み込むローダーオプション
+
+        author と category は JOIN、tags は IN 句による追加クエリ1回で読み込むため、
+        件数に関係なくクエリ数は一定になる。それ以外のリレーションへの遅延読み込みは
+        例外にして、意図しない N+1 を防ぐ。
+        """
+        return (
+            joinedload(cls.author),
+            joinedload(cls.category),
+            selectinload(cls.tags),
+            raiseload("*"),
+        )
+
+
+class PostRendition(Base):
+    """記事詳細のレスポンス（記事の書き込み時にシリアライズ・圧縮して保存。renditions.py を参照）"""
+    __tablename__ = "post_renditions"
+    
+    post_id = Column(Integer, ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    # 本文（JSON）の SHA-256（ETag に使う）
+    content_hash = Column(String(64), nullable=False)
+    # 閲覧数と閉じかっこを除いた JSON 本文と、それを終端せずに圧縮した本文（MySQL では MEDIUMBLOB）
+    body = Column(LargeBinary(16777215), nullable=False)
+    gzip_body = Column(LargeBinary(16777215), nullable=False)
+    # brotli パッケージがない環境で作成した場合は NULL
+    br_body = Column(LargeBinary(16777215))
+    rendered_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
 
 class PostTag(Base):
     __tablename__ = "post_tags"
@@ -81,7 +139,7 @@ class PostTag(Base):
 
 
 # =============================================
-# プロジェクト関連のモデル（今後実装）
+# プロジェクト関連のモデル
 # =============================================
 
 class Project(Base):
@@ -105,6 +163,19 @@ class Project(Base):
     tasks = relationship("Task", back_populates="project")
 
 
+class ProjectMember(Base):
+    __tablename__ = "project_members"
+    __table_args__ = (
+        UniqueConstraint("project_id", "user_id", name="unique_project_user"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    role = Column(Enum('owner', 'admin', 'member', 'viewer'), default='member')
+    joined_at = Column(TIMESTAMP, server_default=func.now())
+
+
 class Task(Base):
     __tablename__ = "tasks"
     
@@ -124,4 +195,86 @@ class Task(Base):
     
     # リレーション
     project = relationship("Project", back_populates="tasks")
-    creator = relationship("User", foreign_keys=[user_id], back_populates="tasks")
\ No newline at end of file
+    creator = relationship("User", foreign_keys=[user_id], back_populates="tasks")
+
+
+# =============================================
+# プロジェクト集計（rollups.py でタスクの書き込みごとに更新）
+# =============================================
+
+class ProjectTaskSummary(Base):
+    """プロジェクトごとのタスク件数（ステータス別・優先度別）と工数の合計"""
+    __tablename__ = "project_task_summaries"
+    
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    task_count = Column(Integer, nullable=False, default=0)
+    todo_count = Column(Integer, nullable=False, default=0)
+    in_progress_count = Column(Integer, nullable=False, default=0)
+    review_count = Column(Integer, nullable=False, default=0)
+    done_count = Column(Integer, nullable=False, default=0)
+    blocked_count = Column(Integer, nullable=False, default=0)
+    low_count = Column(Integer, nullable=False, default=0)
+    medium_count = Column(Integer, nullable=False, default=0)
+    high_count = Column(Integer, nullable=False, default=0)
+    urgent_count = Column(Integer, nullable=False, default=0)
+    estimated_hours = Column(DECIMAL(12, 2), nullable=False, default=0)
+    actual_hours = Column(DECIMAL(12, 2), nullable=False, default=0)
+    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+
+class ProjectTaskDueCount(Base):
+    """プロジェクト・期限日ごとの未完了タスク数（期限切れ件数の集計用）"""
+    __tablename__ = "project_task_due_counts"
+    
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), primary_key=True)
+    due_date = Column(Date, primary_key=True)
+    open_count = Column(Integer, nullable=False, default=0)
+
+
+# =============================================
+# 変更通知
+# =============================================
+
+class ChangeEvent(Base):
+    """変更通知のアウトボックス（書き込みと同じトランザクションで追加し、change_feed.py が配信する）"""
+    __tablename__ = "change_events"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    entity = Column(String(20), nullable=False)
+    # 一括インポートのように対象を特定しない通知では NULL
+    entity_id = Column(Integer)
+    op = Column(String(10), nullable=False)
+    # 受け取れるユーザーID（カンマ区切り。NULL は全員）
+    audience = Column(Text)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+
+
+# =============================================
+# バックグラウンドジョブ
+# =============================================
+
+class Job(Base):
+    """バックグラウンドジョブ（jobs.py が取得・実行する。日時はすべて UTC）"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # 実行予定時刻を過ぎた queued のジョブを古い順に取得する
+        Index("idx_status_run_at", "status", "run_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String(50), nullable=False)
+    # ハンドラーに渡す値（JSON）
+    payload = Column(Text)
+    status = Column(Enum('queued', 'running', 'done', 'failed'), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=5)
+    run_at = Column(DateTime, nullable=False)
+    # 定期ジョブは種類名を入れ、1行だけにする
+    dedupe_key = Column(String(100), unique=True)
+    # 実行中のワーカーの取得ごとの識別子と、リースの期限
+    locked_by = Column(String(64))
+    locked_until = Column(DateTime)
+    last_error = Column(Text)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    created_at = Column(TIMESTAMP, server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,112 @@
+from typing import Dict, List, NamedTuple, Sequence
+
+from pydantic import TypeAdapter
+from sqlalchemy import Row, Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Category, Post, PostTag, Tag, User
+from response_cache import entity_tags
+from schemas import CategoryResponse, PostListNormalizedResponse, TagResponse, UserResponse
+
+# =============================================
+# 記事一覧の正規化レスポンス（format=normalized）
+# =============================================
+#
+# 通常の一覧は記事ごとに著者・カテゴリ・タグを丸ごと埋め込むため、100件のページでは
+# 同じ著者やタグが何十回も繰り返される。format=normalized では記事には
+# author_id / category_id / tag_ids だけを持たせ、参照されたエンティティは
+# included に ID をキーにして1回ずつ入れる。
+#
+# {"data": [{"id": 1, ..., "author_id": 3, "category_id": 2, "tag_ids": [5, 8]}],
+#  "included": {"users": {"3": {...}}, "categories": {"2": {...}}, "tags": {"5": {...}, "8": {...}}}}
+#
+# 記事は一覧に必要な列だけを読み、タグID・著者・カテゴリ・タグはそれぞれ1回のクエリで
+# まとめて取得する（ページの件数に関係なくクエリ数は一定）。
+
+POST_COLUMNS = (
+    Post.id,
+    Post.title,
+    Post.slug,
+    Post.excerpt,
+    Post.featured_image,
+    Post.status,
+    Post.published_at,
+    Post.view_count,
+    Post.created_at,
+    Post.category_id,
+)
+
+_response_adapter = TypeAdapter(PostListNormalizedResponse)
+
+
+class NormalizedPage(NamedTuple):
+    """正規化した一覧1ページ分"""
+    posts: Sequence[Row]
+    tag_ids: Dict[int, List[int]]
+    users: List[User]
+    categories: List[Category]
+    tags: List[Tag]
+
+    def render(self) -> bytes:
+        """{"data": [...], "included": {...}} の JSON にする"""
+        response = PostListNormalizedResponse(
+            data=[
+                dict(post._mapping, tag_ids=self.tag_ids.get(post.id, []))
+                for post in self.posts
+            ],
+            included={
+                "users": {user.id: UserResponse.model_validate(user) for user in self.users},
+                "categories": {
+                    category.id: CategoryResponse.model_validate(category) for category in self.categories
+                },
+                "tags": {tag.id: TagResponse.model_validate(tag) for tag in self.tags},
+            },
+        )
+        return _response_adapter.dump_json(response)
+
+    def cache_tags(self) -> List[str]:
+        """included に入れた著者・カテゴリ・タグのキャッシュタグ"""
+        return entity_tags(
+            [user.id for user in self.users],
+            [category.id for category in self.categories],
+            [tag.id for tag in self.tags],
+        )
+
+
+def normalized_select() -> Select:
+    """一覧に必要な記事の列だけを取り出す SELECT（絞り込みや並び順は呼び出し側で加える）"""
+    return select(*POST_COLUMNS, Post.user_id.label("author_id")).select_from(Post)
+
+
+async def fetch_normalized(db: AsyncSession, query: Select) -> NormalizedPage:
+    """normalized_select() を元にした SELECT を実行し、参照先をエンティティの種類ごとに1回で読み込む"""
+    posts = (await db.execute(query)).all()
+    post_ids = [post.id for post in posts]
+
+    tag_ids: Dict[int, List[int]] = {}
+    if post_ids:
+        rows = await db.execute(
+            select(PostTag.post_id, PostTag.tag_id)
+            .where(PostTag.post_id.in_(post_ids))
+            .order_by(PostTag.post_id, PostTag.tag_id)
+        )
+        for post_id, tag_id in rows:
+            tag_ids.setdefault(post_id, []).append(tag_id)
+
+    user_ids = {post.author_id for post in posts}
+    category_ids = {post.category_id for post in posts} - {None}
+    all_tag_ids = {tag_id for ids in tag_ids.values() for tag_id in ids}
+    return NormalizedPage(
+        posts,
+        tag_ids,
+        await _load_by_ids(db, User, user_ids),
+        await _load_by_ids(db, Category, category_ids),
+        await _load_by_ids(db, Tag, all_tag_ids),
+    )
+
+
+async def _load_by_ids(db: AsyncSession, model, ids) -> list:
+    """ID の集合に対応する行を1回のクエリで取得（空なら問い合わせない）"""
+    if not ids:
+        return []
+    return list((await db.scalars(select(model).where(model.id.in_(sorted(ids))).order_by(model.id))).all())
@@ -0,0 +1,29 @@
+import base64
+import json
+from datetime import datetime
+from typing import Tuple
+
+# =============================================
+# カーソル（キーセット）ページネーション
+# =============================================
+#
+# カーソルは (created_at, id) を JSON にして URL セーフな Base64 で包んだ不透明な文字列。
+# クライアントは中身を解釈せず、レスポンスの X-Next-Cursor をそのまま次のリクエストに渡す。
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, post_id: int) -> str:
+    """並び順のキーからカーソル文字列を作成"""
+    raw = json.dumps([created_at.isoformat(), post_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """カーソル文字列を (created_at, id) に戻す。不正な値は ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, post_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(created_at), int(post_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError("invalid cursor") from e
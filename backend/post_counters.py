@@ -0,0 +1,163 @@
+import argparse
+import asyncio
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Category, Post, PostTag, Tag
+from response_cache import PostState
+
+# =============================================
+# カテゴリ・タグごとの記事数
+# =============================================
+#
+# 「N 件の記事」やタグクラウドの表示のたびに posts / post_tags を数えないよう、
+# categories と tags に post_count（全記事数）と published_count（公開記事数）を持たせ、
+# 記事の作成・更新・削除と同じトランザクションで加減算する。
+#
+# 記事の変更は、レスポンスキャッシュの破棄と同じ (status, category_id, tag_ids) の
+# 変更前後の状態で渡す（作成時は変更前、削除時は変更後が None）。
+#
+# 数がずれた場合は `python post_counters.py` で記事表から数え直す。
+
+PUBLISHED_STATUS = "published"
+
+# 数え直しで1トランザクションに扱うカテゴリ・タグの数
+RECONCILE_BATCH_SIZE = 500
+
+# ID -> (post_count の増減, published_count の増減)
+CounterDeltas = Dict[int, Tuple[int, int]]
+
+
+def _add(deltas: CounterDeltas, entity_id: int, sign: int, published: bool) -> None:
+    posts, published_posts = deltas.get(entity_id, (0, 0))
+    deltas[entity_id] = (posts + sign, published_posts + (sign if published else 0))
+
+
+async def apply_post_changes(
+    db: AsyncSession, changes: Iterable[Tuple[Optional[PostState], Optional[PostState]]]
+) -> bool:
+    """記事の変更前後の状態から記事数を差分更新し、変化があれば True を返す
+
+    記事の書き込みと同じトランザクションで呼ぶ。コミットは呼び出し側で行う。
+    """
+    category_deltas: CounterDeltas = {}
+    tag_deltas: CounterDeltas = {}
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            status, category_id, tag_ids = state
+            published = status == PUBLISHED_STATUS
+            if category_id is not None:
+                _add(category_deltas, category_id, sign, published)
+            for tag_id in set(tag_ids):
+                _add(tag_deltas, tag_id, sign, published)
+
+    changed = False
+    for model, deltas in ((Category, category_deltas), (Tag, tag_deltas)):
+        changed = await _update_counts(db, model, deltas) or changed
+    return changed
+
+
+async def _update_counts(db: AsyncSession, model, deltas: CounterDeltas) -> bool:
+    """ID ごとの増減を CASE 式にまとめ、1文で加算する"""
+    deltas = {entity_id: delta for entity_id, delta in deltas.items() if delta != (0, 0)}
+    if not deltas:
+        return False
+    ids = sorted(deltas)
+    await db.execute(
+        update(model)
+        .where(model.id.in_(ids))
+        .values(
+            post_count=model.post_count + case(
+                {entity_id: deltas[entity_id][0] for entity_id in ids}, value=model.id, else_=0
+            ),
+            published_count=model.published_count + case(
+                {entity_id: deltas[entity_id][1] for entity_id in ids}, value=model.id, else_=0
+            ),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def cloud_weights(counts: List[int], levels: int) -> List[int]:
+    """記事数をタグクラウドの大きさ（1〜levels）に変換する（対数で均等に分ける）"""
+    if not counts:
+        return []
+    low, high = math.log(min(counts)), math.log(max(counts))
+    if high == low:
+        return [1 for _ in counts]
+    return [1 + int((math.log(count) - low) / (high - low) * (levels - 1) + 0.5) for count in counts]
+
+
+# =============================================
+# 記事数の数え直し
+# =============================================
+
+async def reconcile_counts(db: AsyncSession) -> int:
+    """カテゴリ・タグの記事数を記事表から数え直し、修正した行数を返す
+
+    RECONCILE_BATCH_SIZE 件ずつ、先に対象の行をロックしてから数えるため、
+    同時に実行中の記事の書き込みとは加算が重複したり失われたりしない。
+    """
+    published = func.sum(case((Post.status == PUBLISHED_STATUS, 1), else_=0))
+    sources = (
+        (Category, Post.category_id, select(Post.category_id, func.count(Post.id), published)),
+        (Tag, PostTag.tag_id, select(PostTag.tag_id, func.count(Post.id), published)
+            .join(Post, Post.id == PostTag.post_id)),
+    )
+    fixed = 0
+    for model, key, count_query in sources:
+        ids = (await db.scalars(select(model.id).order_by(model.id))).all()
+        # 数える前にロックを取れるよう、ID の読み取りのトランザクションは終えておく
+        await db.commit()
+        for start in range(0, len(ids), RECONCILE_BATCH_SIZE):
+            batch = ids[start:start + RECONCILE_BATCH_SIZE]
+            stored = {
+                row.id: (row.post_count, row.published_count)
+                for row in await db.execute(
+                    select(model.id, model.post_count, model.published_count)
+                    .where(model.id.in_(batch))
+                    .with_for_update()
+                )
+            }
+            actual = {
+                entity_id: (posts, int(published_posts or 0))
+                for entity_id, posts, published_posts in await db.execute(
+                    count_query.where(key.in_(batch)).group_by(key)
+                )
+            }
+            rows: List[dict] = []
+            for entity_id, counts in stored.items():
+                posts, published_posts = actual.get(entity_id, (0, 0))
+                if counts != (posts, published_posts):
+                    rows.append({"id": entity_id, "post_count": posts, "published_count": published_posts})
+            if rows:
+                await db.execute(update(model), rows)
+            await db.commit()
+            fixed += len(rows)
+    return fixed
+
+
+async def _reconcile() -> int:
+    from database import AsyncSessionLocal, async_engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            return await reconcile_counts(db)
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    argparse.ArgumentParser(description="カテゴリ・タグの記事数を記事表から数え直す").parse_args()
+    fixed = asyncio.run(_reconcile())
+    print(f"{fixed} 件のカテゴリ・タグの記事数を修正しました")
+
+
+if __name__ == "__main__":
+    main()
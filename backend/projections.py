@@ -0,0 +1,198 @@
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from pydantic_core import to_json
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Category, Post, PostTag, Tag, User
+from response_cache import entity_tags
+
+# =============================================
+# 記事の部分取得（fields=）
+# =============================================
+#
+# fields=id,title,author.username,tags.slug のように返す項目を指定すると、
+# 必要な列だけを SELECT し（ORM のエンティティは作らない）、行から直接 JSON にする。
+# 一覧では返さない content などの大きな列を DB から読まずに済む。
+#
+# - 記事の項目は POST_FIELDS のいずれか。id は常に返す。
+# - author / category / tags だけを指定すると、それぞれ RELATION_DEFAULTS の項目を返す。
+#   author.email のようにドットで個別の項目も指定できる。
+# - 出力の項目順は指定順ではなく、下の定義順に揃える（キャッシュキーを正規化するため）。
+
+POST_FIELDS = {
+    "id": Post.id,
+    "user_id": Post.user_id,
+    "category_id": Post.category_id,
+    "title": Post.title,
+    "slug": Post.slug,
+    "content": Post.content,
+    "excerpt": Post.excerpt,
+    "featured_image": Post.featured_image,
+    "status": Post.status,
+    "published_at": Post.published_at,
+    "view_count": Post.view_count,
+    "created_at": Post.created_at,
+    "updated_at": Post.updated_at,
+}
+
+AUTHOR_FIELDS = {
+    "id": User.id,
+    "username": User.username,
+    "email": User.email,
+    "is_active": User.is_active,
+    "created_at": User.created_at,
+}
+CATEGORY_FIELDS = {
+    "id": Category.id,
+    "name": Category.name,
+    "slug": Category.slug,
+    "description": Category.description,
+    "created_at": Category.created_at,
+    "updated_at": Category.updated_at,
+}
+TAG_FIELDS = {
+    "id": Tag.id,
+    "name": Tag.name,
+    "slug": Tag.slug,
+    "created_at": Tag.created_at,
+}
+
+RELATION_FIELDS = {"author": AUTHOR_FIELDS, "category": CATEGORY_FIELDS, "tags": TAG_FIELDS}
+RELATION_DEFAULTS = {
+    "author": ("id", "username"),
+    "category": ("id", "name", "slug"),
+    "tags": ("id", "name", "slug"),
+}
+
+
+class ProjectedPost(NamedTuple):
+    """部分取得した記事1件（data が出力する内容）"""
+    id: int
+    created_at: datetime
+    user_id: int
+    category_id: Optional[int]
+    tag_ids: List[int]
+    data: Dict[str, Any]
+
+
+class PostProjection:
+    """fields= で指定された記事の項目"""
+
+    def __init__(self, fields: List[str], relations: Dict[str, List[str]]):
+        self.fields = fields
+        self.relations = relations
+
+    @classmethod
+    def parse(cls, value: str) -> "PostProjection":
+        """fields= の値を解釈（不明な項目は ValueError）"""
+        requested = {"id"}
+        relations: Dict[str, set] = {}
+        for name in (part.strip() for part in value.split(",")):
+            if not name:
+                continue
+            relation, _, sub = name.partition(".")
+            if relation in RELATION_FIELDS:
+                if sub and sub not in RELATION_FIELDS[relation]:
+                    raise ValueError(f"不明な項目です: {name}")
+                relations.setdefault(relation, set()).update([sub] if sub else RELATION_DEFAULTS[relation])
+            elif name in POST_FIELDS:
+                requested.add(name)
+            else:
+                raise ValueError(f"不明な項目です: {name}")
+        return cls(
+            [name for name in POST_FIELDS if name in requested],
+            {
+                relation: [name for name in RELATION_FIELDS[relation] if name in relations[relation]]
+                for relation in RELATION_FIELDS
+                if relation in relations
+            },
+        )
+
+    @property
+    def key(self) -> str:
+        """正規化した項目の一覧（キャッシュキーに使う）"""
+        names = list(self.fields)
+        for relation, fields in self.relations.items():
+            names += [f"{relation}.{name}" for name in fields]
+        return ",".join(names)
+
+    def select(self) -> Select:
+        """必要な列だけを取り出す SELECT（絞り込みや並び順は呼び出し側で加える）"""
+        columns = [
+            Post.id.label("_id"),
+            Post.created_at.label("_created_at"),
+            Post.user_id.label("_user_id"),
+            Post.category_id.label("_category_id"),
+        ]
+        columns += [POST_FIELDS[name].label(name) for name in self.fields]
+        for relation in ("author", "category"):
+            columns += [
+                RELATION_FIELDS[relation][name].label(f"{relation}__{name}")
+                for name in self.relations.get(relation, [])
+            ]
+        query = select(*columns).select_from(Post)
+        if "author" in self.relations:
+            query = query.join(User, User.id == Post.user_id)
+        if "category" in self.relations:
+            query = query.outerjoin(Category, Category.id == Post.category_id)
+        return query
+
+    async def fetch(self, db: AsyncSession, query: Select) -> List[ProjectedPost]:
+        """select() を元にした SELECT を実行し、出力する形に組み立てる"""
+        rows = (await db.execute(query)).all()
+        tags = await self._fetch_tags(db, [row._id for row in rows]) if "tags" in self.relations else {}
+
+        posts = []
+        for row in rows:
+            mapping = row._mapping
+            data = {name: mapping[name] for name in self.fields}
+            if "author" in self.relations:
+                data["author"] = {name: mapping[f"author__{name}"] for name in self.relations["author"]}
+            if "category" in self.relations:
+                data["category"] = None if row._category_id is None else {
+                    name: mapping[f"category__{name}"] for name in self.relations["category"]
+                }
+            post_tags = tags.get(row._id, [])
+            if "tags" in self.relations:
+                data["tags"] = [item for _, item in post_tags]
+            posts.append(ProjectedPost(
+                row._id, row._created_at, row._user_id, row._category_id,
+                [tag_id for tag_id, _ in post_tags], data,
+            ))
+        return posts
+
+    async def _fetch_tags(self, db: AsyncSession, post_ids: List[int]) -> Dict[int, List]:
+        """記事ごとの (タグID, 出力するタグ) を1回のクエリで取得"""
+        if not post_ids:
+            return {}
+        fields = self.relations["tags"]
+        result = await db.execute(
+            select(PostTag.post_id, Tag.id.label("_id"), *[TAG_FIELDS[name].label(name) for name in fields])
+            .join(Tag, Tag.id == PostTag.tag_id)
+            .where(PostTag.post_id.in_(post_ids))
+            .order_by(PostTag.post_id, Tag.id)
+        )
+        tags: Dict[int, List] = {}
+        for row in result:
+            mapping = row._mapping
+            tags.setdefault(row.post_id, []).append((row._id, {name: mapping[name] for name in fields}))
+        return tags
+
+    def cache_tags(self, posts: List[ProjectedPost]) -> List[str]:
+        """レスポンスに埋め込んだ著者・カテゴリ・タグのキャッシュタグ"""
+        return entity_tags(
+            [post.user_id for post in posts] if "author" in self.relations else [],
+            [post.category_id for post in posts] if "category" in self.relations else [],
+            [tag_id for post in posts for tag_id in post.tag_ids],
+        )
+
+    @staticmethod
+    def render(posts: List[ProjectedPost]) -> bytes:
+        """行から直接 JSON にする（日時などの書式は pydantic の出力と同じ）"""
+        return to_json([post.data for post in posts])
+
+    @staticmethod
+    def render_one(post: ProjectedPost) -> bytes:
+        return to_json(post.data)
@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import struct
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import CachedBody, TTLCache
+from database import AsyncSessionLocal
+from jobs import job_queue
+from metrics import Histogram
+from models import Post, PostRendition
+from schemas import PostResponse
+
+try:
+    import brotli
+except ImportError:
+    # brotli パッケージは任意依存。無い場合は gzip だけを保存・配信する
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# 記事詳細の保存済みレスポンス（post_renditions）
+# =============================================
+#
+# 記事の作成・更新と同じトランザクションで、詳細のレスポンス（JSON）をシリアライズし、
+# gzip・brotli で圧縮したものと本文のハッシュを post_renditions に保存する。
+# GET /api/posts/{post_id} は Accept-Encoding に合う1列だけを読み、そのまま返す
+# （リクエストごとの JSON のシリアライズと圧縮がない）。
+#
+# 鮮度:
+# - 閲覧数（view_count）は保存する本文に含めない。閲覧のたびに値が変わるため、保存すると
+#   閲覧ごとに作り直し（圧縮と書き込み）が必要になる。保存するのは閲覧数を除いた JSON の
+#   閉じかっこの手前までと、それを圧縮して末尾をバイト境界で止めたもので、返すときに
+#   `,"view_count":N}` を無圧縮のブロックとして付け足す（gzip は deflate の stored ブロックと
+#   CRC32・長さ、brotli は無圧縮のメタブロック。再圧縮はしない）。閲覧数は DB の値と
+#   未反映の分にこの閲覧を加えた値で、シリアライズして返す場合と同じ。
+# - 閲覧数以外の項目は、記事の作成・更新と同じトランザクションで作り直すため常に最新。
+#   著者のプロフィール変更やタグの一括変更では、対象の行を削除して作り直しのジョブを登録する
+#   （ジョブの実行前の閲覧はシリアライズして返し、応答後に作り直す。同じ記事はワーカーごとに
+#   POST_RENDITION_REFRESH_INTERVAL 秒に1回まで）。
+# 既存の記事や一括インポートした記事は `python renditions.py` でまとめて作成できる。
+#
+# 圧縮（特に brotli の最高品質）は長い記事では数十ミリ秒かかるため、イベントループを
+# 止めないようにスレッドで行う（zlib・brotli は圧縮中に GIL を解放する）。
+
+POST_RENDITION_GZIP_LEVEL = int(os.getenv("POST_RENDITION_GZIP_LEVEL", "9"))
+POST_RENDITION_BROTLI_QUALITY = int(os.getenv("POST_RENDITION_BROTLI_QUALITY", "11"))
+POST_RENDITION_REFRESH_INTERVAL = float(os.getenv("POST_RENDITION_REFRESH_INTERVAL", "60"))
+POST_RENDITION_WORKERS = int(os.getenv("POST_RENDITION_WORKERS", "2"))
+# 一括作成で1トランザクションに扱う記事の数
+POST_RENDITION_BATCH_SIZE = 200
+
+IDENTITY = "identity"
+# 優先順（brotli が使えない場合は候補にしない）
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+
+_compress_executor = ThreadPoolExecutor(
+    max_workers=POST_RENDITION_WORKERS, thread_name_prefix="post-rendition"
+)
+
+post_rendition_compress_seconds = Histogram(
+    "post_rendition_compress_seconds", "記事詳細のレスポンスの圧縮時間（秒）"
+)
+
+_ENCODING_COLUMNS = {
+    IDENTITY: PostRendition.body,
+    "gzip": PostRendition.gzip_body,
+    "br": PostRendition.br_body,
+}
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> str:
+    """Accept-Encoding から返す圧縮形式を選ぶ（q=0 は除外。なければ identity）"""
+    if not accept_encoding:
+        return IDENTITY
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    best, best_quality = IDENTITY, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compress(body: bytes) -> Tuple[bytes, Optional[bytes], float]:
+    """終端せずにバイト境界で止めた圧縮データを作る（gzip は末尾に本文の CRC32 と長さを付ける）"""
+    started_at = time.perf_counter()
+    compressor = zlib.compressobj(POST_RENDITION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    gzip_body = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    gzip_body += struct.pack("<II", zlib.crc32(body), len(body) & 0xFFFFFFFF)
+    br_body = None
+    if brotli is not None:
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=POST_RENDITION_BROTLI_QUALITY)
+        br_body = compressor.process(body) + compressor.flush()
+    return gzip_body, br_body, time.perf_counter() - started_at
+
+
+def _finish_gzip(stored: bytes, tail: bytes) -> bytes:
+    """保存した gzip に tail を最後の stored ブロックとして付け、CRC32 と長さで終える"""
+    crc, size = struct.unpack("<II", stored[-8:])
+    return b"".join((
+        stored[:-8],
+        b"\x01", struct.pack("<HH", len(tail), len(tail) ^ 0xFFFF), tail,
+        struct.pack("<II", zlib.crc32(tail, crc), (size + len(tail)) & 0xFFFFFFFF),
+    ))
+
+
+def _finish_brotli(stored: bytes, tail: bytes) -> bytes:
+    """保存した brotli に tail を無圧縮のメタブロックとして付け、空の最終メタブロックで終える"""
+    # ISLAST=0, MNIBBLES=4, MLEN-1（16 ビット）, ISUNCOMPRESSED=1 の 20 ビットを 3 バイトに詰める
+    header = ((len(tail) - 1) << 3) | (1 << 19)
+    # ISLAST=1, ISLASTEMPTY=1
+    return b"".join((stored, header.to_bytes(3, "little"), tail, b"\x03"))
+
+
+_FINISHERS = {
+    IDENTITY: lambda stored, tail: stored + tail,
+    "gzip": _finish_gzip,
+    "br": _finish_brotli,
+}
+
+
+async def render_post(post: Post) -> Dict:
+    """リレーションを読み込んだ記事から、保存するレスポンス（post_renditions の1行）を作成"""
+    json_body = PostResponse.model_validate(post).model_dump_json(exclude={"view_count"}).encode()
+    # 閉じかっこは閲覧数と一緒に返すときに付ける
+    body = json_body[:-1]
+    loop = asyncio.get_running_loop()
+    gzip_body, br_body, elapsed = await loop.run_in_executor(_compress_executor, _compress, body)
+    post_rendition_compress_seconds.observe(elapsed)
+    return {
+        "post_id": post.id,
+        "content_hash": hashlib.sha256(body).hexdigest(),
+        "body": body,
+        "gzip_body": gzip_body,
+        "br_body": br_body,
+    }
+
+
+async def save_rendition(db: AsyncSession, post: Post) -> None:
+    """記事の書き込みと同じトランザクションでレスポンスを保存（コミットは呼び出し側で行う）"""
+    await db.execute(_upsert_rendition(db, await render_post(post)))
+
+
+def _upsert_rendition(db: AsyncSession, row: Dict):
+    """保存済みレスポンスの INSERT（行があれば置き換え）"""
+    columns = [name for name in row if name != "post_id"]
+    if db.bind.dialect.name == "mysql":
+        stmt = mysql.insert(PostRendition).values(row)
+        values = {name: stmt.inserted[name] for name in columns}
+        return stmt.on_duplicate_key_update(rendered_at=func.now(), **values)
+    stmt = sqlite.insert(PostRendition).values(row)
+    values = {name: stmt.excluded[name] for name in columns}
+    return stmt.on_conflict_do_update(
+        index_elements=[PostRendition.post_id], set_=dict(values, rendered_at=func.now())
+    )
+
+
+async def discard_renditions(
+    db: AsyncSession, post_ids: Optional[Iterable[int]] = None, user_id: Optional[int] = None
+) -> None:
+    """記事（または著者の全記事）の保存済みレスポンスを削除（次の閲覧後に作り直す）"""
+    stmt = delete(PostRendition)
+    if post_ids is not None:
+        stmt = stmt.where(PostRendition.post_id.in_(list(post_ids)))
+    if user_id is not None:
+        stmt = stmt.where(PostRendition.post_id.in_(select(Post.id).where(Post.user_id == user_id)))
+    await db.execute(stmt.execution_options(synchronize_session=False))
+
+
+class StoredRendition(NamedTuple):
+    """読み取り時に取得する1形式分の保存済みレスポンス（閲覧数を除く）"""
+    post_id: int
+    body: bytes
+    encoding: str
+    content_hash: str
+    # 記事の DB の閲覧数（未反映分を除く）と、キャッシュタグ用の著者・カテゴリ
+    view_count: int
+    user_id: int
+    category_id: Optional[int]
+
+    def to_cached_body(self, view_count: int) -> CachedBody:
+        """閲覧数を付けて返す本文を作る"""
+        tail = b',"view_count":%d}' % view_count
+        # 強い ETag は閲覧数と形式ごとに別の値にする
+        suffix = "" if self.encoding == IDENTITY else "-" + self.encoding
+        headers = {} if self.encoding == IDENTITY else {"Content-Encoding": self.encoding}
+        return CachedBody(
+            body=_FINISHERS[self.encoding](self.body, tail),
+            etag='"' + self.content_hash[:32] + "-" + str(view_count) + suffix + '"',
+            headers=tuple(headers.items()),
+        )
+
+
+async def load_rendition(db: AsyncSession, post_id: int, encoding: str) -> Optional[StoredRendition]:
+    """指定の形式の列だけを読む（保存されていない・その形式がない場合は None）"""
+    row = (await db.execute(
+        select(
+            _ENCODING_COLUMNS[encoding], PostRendition.content_hash,
+            Post.view_count, Post.user_id, Post.category_id,
+        )
+        .join(Post, Post.id == PostRendition.post_id)
+        .where(PostRendition.post_id == post_id)
+    )).first()
+    if row is None or row[0] is None:
+        return None
+    body, content_hash, view_count, user_id, category_id = row
+    return StoredRendition(post_id, body, encoding, content_hash, view_count or 0, user_id, category_id)
+
+
+class RenditionRefresher:
+    """保存されていないレスポンスを応答後に作成する"""
+
+    def __init__(self, interval: float):
+        # 作り直しを予約した記事（interval 秒の間は再度予約しない）
+        self._recent: "TTLCache[bool]" = TTLCache(10000, interval)
+
+    def reserve(self, post_id: int) -> bool:
+        """作り直す場合は True（直近に予約済みなら False）"""
+        if post_id in self._recent:
+            return False
+        self._recent.set(post_id, True)
+        return True
+
+    async def refresh(self, post_id: int) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                post = await db.scalar(
+                    select(Post).options(*Post.eager_options()).where(Post.id == post_id)
+                )
+                if post is None:
+                    return
+                await save_rendition(db, post)
+                await db.commit()
+        except Exception:
+            logger.exception("記事 %s のレスポンスの作成に失敗しました", post_id)
+
+
+rendition_refresher = RenditionRefresher(POST_RENDITION_REFRESH_INTERVAL)
+
+
+# =============================================
+# 一括作成
+# =============================================
+
+async def rebuild_renditions(
+    db: AsyncSession,
+    missing_only: bool = True,
+    post_ids: Optional[Iterable[int]] = None,
+    user_id: Optional[int] = None,
+) -> int:
+    """保存済みレスポンスを作成し、作成した件数を返す（missing_only なら未作成の記事のみ）"""
+    query = select(Post.id).order_by(Post.id)
+    if missing_only:
+        query = query.where(~Post.id.in_(select(PostRendition.post_id)))
+    if post_ids is not None:
+        query = query.where(Post.id.in_(list(post_ids)))
+    if user_id is not None:
+        query = query.where(Post.user_id == user_id)
+    post_ids = (await db.scalars(query)).all()
+    for start in range(0, len(post_ids), POST_RENDITION_BATCH_SIZE):
+        posts = (await db.scalars(
+            select(Post).options(*Post.eager_options())
+            .where(Post.id.in_(post_ids[start:start + POST_RENDITION_BATCH_SIZE]))
+        )).all()
+        for post in posts:
+            await save_rendition(db, post)
+        await db.commit()
+    return len(post_ids)
+
+
+@job_queue.handler("render_posts", concurrency=1)
+async def render_posts(payload: Dict) -> None:
+    """削除した保存済みレスポンスを作り直すジョブ（post_ids または user_id の記事）"""
+    async with AsyncSessionLocal() as db:
+        await rebuild_renditions(db, post_ids=payload.get("post_ids"), user_id=payload.get("user_id"))
+
+
+async def _rebuild(missing_only: bool) -> int:
+    from database import async_engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            return await rebuild_renditions(db, missing_only)
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="記事詳細の保存済みレスポンスを作成する")
+    parser.add_argument("--all", action="store_true", help="作成済みの記事も作り直す")
+    args = parser.parse_args()
+    count = asyncio.run(_rebuild(not args.all))
+    print(f"{count} 件の記事のレスポンスを作成しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import itertools
+import json
+import os
+import threading
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from cache import CachedBody, TTLCache
+from database import replica_router
+from metrics import Counter
+
+# =============================================
+# 記事一覧・詳細のレスポンスキャッシュ
+# =============================================
+#
+# 正規化したクエリパラメータをキーに、シリアライズ済みのレスポンスを保持する。
+# 各エントリは依存する「タグ」（記事ID、一覧の絞り込み条件、埋め込まれた著者など）の
+# 世代番号を保存時に記録しておき、取得時に世代が進んでいれば無効として扱う。
+# 書き込み時は影響するタグの世代を進めるだけなので、無関係なエントリは残る。
+#
+# 世代番号は記録前に取得するため、DB を読んでいる間に書き込みがあった場合でも
+# 古い内容が有効なエントリとして残ることはない。
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+RESPONSE_CACHE_REDIS_URL = os.getenv("RESPONSE_CACHE_REDIS_URL")
+# 1回の書き込みで進めるタグがこれを超える場合（大量の記事の一括変更など）は全体を破棄する
+RESPONSE_CACHE_MAX_INVALIDATION = int(os.getenv("RESPONSE_CACHE_MAX_INVALIDATION", "5000"))
+
+response_cache_requests_total = Counter(
+    "response_cache_requests_total", "レスポンスキャッシュの参照数", ["cache", "result"]
+)
+response_cache_invalidations_total = Counter(
+    "response_cache_invalidations_total", "世代を進めたキャッシュタグの数"
+)
+
+Tags = Tuple[str, ...]
+Generations = Tuple[int, ...]
+# 保存するエントリ: (本文, 依存タグ, 保存時点の各タグの世代)
+Entry = Tuple[CachedBody, Tags, Generations]
+
+
+class ResponseCacheBackend:
+    """レスポンスキャッシュの保存先（別の実装に差し替え可能）"""
+
+    # 全ワーカーで共有するか（共有しない場合は他のワーカーでの書き込みを各ワーカーで無効化する）
+    shared = False
+
+    async def get(self, key: str) -> Optional[Entry]:
+        raise NotImplementedError
+
+    async def set(self, key: str, entry: Entry, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def generations(self, tags: Sequence[str]) -> Generations:
+        """タグごとの現在の世代番号"""
+        raise NotImplementedError
+
+    async def bump(self, tags: Iterable[str]) -> None:
+        """タグの世代を進め、それに依存するエントリを無効にする"""
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+
+class MemoryBackend(ResponseCacheBackend):
+    """プロセス内の LRU に保存する（既定）"""
+
+    def __init__(self, maxsize: int):
+        self._entries: "TTLCache[Entry]" = TTLCache(maxsize, RESPONSE_CACHE_TTL)
+        # 世代表も件数で上限を設ける。追い出されたタグは新しい番号で作り直されるため、
+        # 古いエントリが誤って有効になることはない（取りこぼしはキャッシュミスになるだけ）
+        self._generations: "TTLCache[int]" = TTLCache(maxsize * 20, float("inf"))
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[Entry]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, entry: Entry, ttl: float) -> None:
+        self._entries.set(key, entry, ttl=ttl)
+
+    async def generations(self, tags: Sequence[str]) -> Generations:
+        result = []
+        with self._lock:
+            for tag in tags:
+                generation = self._generations.get(tag)
+                if generation is None:
+                    generation = next(self._counter)
+                    self._generations.set(tag, generation)
+                result.append(generation)
+        return tuple(result)
+
+    async def bump(self, tags: Iterable[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._generations.set(tag, next(self._counter))
+
+    async def clear(self) -> None:
+        self._entries.clear()
+
+
+class RedisBackend(ResponseCacheBackend):
+    """Redis に保存する（複数プロセスでキャッシュと無効化を共有する場合）
+
+    redis パッケージは任意依存のため、このバックエンドを使う場合のみ必要。
+    """
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "response-cache:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[Entry]:
+        raw = await self._redis.get(self._prefix + "entry:" + key)
+        if raw is None:
+            return None
+        header, _, body = raw.partition(b"\n")
+        meta = json.loads(header)
+        value = CachedBody(body=body, etag=meta["etag"], headers=tuple(map(tuple, meta["headers"])))
+        return value, tuple(meta["tags"]), tuple(meta["generations"])
+
+    async def set(self, key: str, entry: Entry, ttl: float) -> None:
+        value, tags, generations = entry
+        header = json.dumps({
+            "etag": value.etag, "headers": value.headers, "tags": tags, "generations": generations,
+        })
+        await self._redis.set(
+            self._prefix + "entry:" + key, header.encode() + b"\n" + value.body, ex=max(1, int(ttl))
+        )
+
+    async def generations(self, tags: Sequence[str]) -> Generations:
+        if not tags:
+            return ()
+        keys = [self._prefix + "gen:" + tag for tag in tags]
+        values = await self._redis.mget(keys)
+        result = []
+        for key, value in zip(keys, values):
+            if value is None:
+                # 未登録のタグは全体の通し番号から新しい世代を割り当てる
+                value = await self._redis.incr(self._prefix + "gen-counter")
+                await self._redis.set(key, value, nx=True)
+                value = await self._redis.get(key)
+            result.append(int(value))
+        return tuple(result)
+
+    async def bump(self, tags: Iterable[str]) -> None:
+        tags = list(tags)
+        if not tags:
+            return
+        pipe = self._redis.pipeline()
+        for tag in tags:
+            pipe.incr(self._prefix + "gen-counter")
+        values = await pipe.execute()
+        await self._redis.mset({self._prefix + "gen:" + tag: value for tag, value in zip(tags, values)})
+
+    async def clear(self) -> None:
+        async for key in self._redis.scan_iter(self._prefix + "entry:*"):
+            await self._redis.delete(key)
+
+
+class ResponseCache:
+    """タグの世代で無効化するレスポンスキャッシュ"""
+
+    def __init__(self, backend: ResponseCacheBackend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+
+    @property
+    def shared(self) -> bool:
+        return self.backend.shared
+
+    async def get(self, name: str, key: str) -> Optional[CachedBody]:
+        """有効なエントリがあれば返す（ヒット・ミスを記録）"""
+        entry = await self.backend.get(key)
+        if entry is not None:
+            value, tags, generations = entry
+            if await self.backend.generations(tags) == generations:
+                response_cache_requests_total.inc(cache=name, result="hit")
+                return value
+        response_cache_requests_total.inc(cache=name, result="miss")
+        return None
+
+    async def snapshot(self, tags: Sequence[str]) -> Generations:
+        """DB を読む前の世代番号（set に渡す）"""
+        return await self.backend.generations(tags)
+
+    async def set(
+        self, key: str, value: CachedBody, tags: Sequence[str], generations: Generations
+    ) -> None:
+        """エントリを保存する。generations は tags の先頭から snapshot で取得したもの
+
+        本文を作ってから分かるタグ（埋め込まれた著者など）は、保存直前の世代を使う。
+        """
+        tags = tuple(tags)
+        if len(generations) < len(tags):
+            generations = generations + await self.backend.generations(tags[len(generations):])
+        await self.backend.set(key, (value, tags, generations), self.ttl)
+
+    async def invalidate(self, tags: Iterable[str]) -> None:
+        # 書き込み直後はレプリカの遅延で古い内容をキャッシュしないよう、プライマリから読ませる
+        replica_router.note_write()
+        tags = set(tags)
+        response_cache_invalidations_total.inc(len(tags))
+        await self.backend.bump(tags)
+
+    async def invalidate_posts(self, post_ids: Sequence[int], states: Iterable["PostState"]) -> None:
+        """記事の変更前後の状態から、影響する詳細と一覧を破棄"""
+        list_tags = affected_list_tags(states, limit=RESPONSE_CACHE_MAX_INVALIDATION)
+        if list_tags is None or len(post_ids) + len(list_tags) > RESPONSE_CACHE_MAX_INVALIDATION:
+            await self.clear()
+            return
+        await self.invalidate([post_cache_tag(post_id) for post_id in post_ids] + list_tags)
+
+    async def clear(self) -> None:
+        replica_router.note_write()
+        await self.backend.clear()
+
+
+# =============================================
+# キーとタグ
+# =============================================
+
+def list_key(**params) -> str:
+    """一覧のキャッシュキー（パラメータ名順に並べた正規形）"""
+    return "posts:list?" + "&".join(
+        f"{name}={'' if value is None else value}" for name, value in sorted(params.items())
+    )
+
+
+def detail_key(post_id: int, fields: Optional[str] = None, encoding: Optional[str] = None) -> str:
+    """詳細のキャッシュキー（fields は正規化した部分取得の項目、encoding は本文の圧縮形式）"""
+    if fields:
+        return f"posts:detail:{post_id}?fields={fields}"
+    if encoding:
+        return f"posts:detail:{post_id}?encoding={encoding}"
+    return f"posts:detail:{post_id}"
+
+
+def list_cache_tag(status: Optional[str], category_id: Optional[int], tag_id: Optional[int]) -> str:
+    """一覧の絞り込み条件を表すタグ（条件なしは *）"""
+    return "list:{}:{}:{}".format(
+        status or "*", category_id or "*", tag_id or "*"
+    )
+
+
+def all_lists_cache_tag() -> str:
+    """すべての一覧が依存するタグ（変更前の状態が分からない書き込みで一覧をまとめて破棄する）"""
+    return "list"
+
+
+def post_cache_tag(post_id: int) -> str:
+    return f"post:{post_id}"
+
+
+def user_cache_tag(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def category_cache_tag(category_id: int) -> str:
+    return f"category:{category_id}"
+
+
+def tag_cache_tag(tag_id: int) -> str:
+    return f"tag:{tag_id}"
+
+
+def entity_tags(author_ids: Iterable[int], category_ids: Iterable[int], tag_ids: Iterable[int]) -> List[str]:
+    """レスポンスに埋め込まれた著者・カテゴリ・タグのタグ"""
+    return (
+        [user_cache_tag(i) for i in sorted(set(author_ids))]
+        + [category_cache_tag(i) for i in sorted(set(category_ids) - {None})]
+        + [tag_cache_tag(i) for i in sorted(set(tag_ids))]
+    )
+
+
+# 記事の状態 (status, category_id, tag_ids)
+PostState = Tuple[Optional[str], Optional[int], Iterable[int]]
+
+
+def affected_list_tags(states: Iterable[PostState], limit: Optional[int] = None) -> Optional[List[str]]:
+    """記事の変更前後の状態から、影響する一覧のタグを列挙（limit を超える場合は None）"""
+    statuses, categories, tags = {None}, {None}, {None}
+    for status, category_id, tag_ids in states:
+        statuses.add(status)
+        categories.add(category_id)
+        tags.update(tag_ids)
+    if limit is not None and len(statuses) * len(categories) * len(tags) > limit:
+        return None
+    return [
+        list_cache_tag(status, category_id, tag_id)
+        for status in statuses
+        for category_id in categories
+        for tag_id in tags
+    ]
+
+
+def _create_backend() -> ResponseCacheBackend:
+    if RESPONSE_CACHE_REDIS_URL:
+        return RedisBackend(RESPONSE_CACHE_REDIS_URL)
+    return MemoryBackend(RESPONSE_CACHE_SIZE)
+
+
+response_cache = ResponseCache(_create_backend(), RESPONSE_CACHE_TTL)
+
+
+def configure_backend(backend: ResponseCacheBackend) -> None:
+    """保存先を差し替える"""
+    response_cache.backend = backend
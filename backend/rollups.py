@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Project, Task, ProjectTaskSummary, ProjectTaskDueCount
+
+# =============================================
+# プロジェクトのタスク集計
+# =============================================
+#
+# ダッシュボードの集計（ステータス別・優先度別の件数、期限切れ件数、工数の合計）を
+# 毎回 GROUP BY せず、タスクの書き込みと同じトランザクションで集計表を差分更新する。
+#
+# - project_task_summaries: プロジェクトごとに1行。件数と工数を加減算で更新する。
+# - project_task_due_counts: プロジェクト・期限日ごとの未完了タスク数。
+#   期限切れかどうかは日付が変わるだけで変化するため、件数ではなく期限日ごとに持ち、
+#   表示時に「今日より前」の行だけを合計する。
+#
+# 集計表が壊れた場合は `python rollups.py [プロジェクトID ...]` で作り直す。
+
+TASK_STATUSES = ('todo', 'in_progress', 'review', 'done', 'blocked')
+TASK_PRIORITIES = ('low', 'medium', 'high', 'urgent')
+# 期限切れに数えないステータス
+CLOSED_STATUSES = ('done',)
+
+# 全プロジェクトを作り直すときに1トランザクションで扱うプロジェクト数
+REBUILD_BATCH_SIZE = 500
+
+# 集計に影響するタスクの属性
+TaskState = namedtuple(
+    "TaskState", ["project_id", "status", "priority", "due_date", "estimated_hours", "actual_hours"]
+)
+
+
+def _hours(value) -> Decimal:
+    return Decimal(str(value)) if value is not None else Decimal(0)
+
+
+def task_state(task: Task) -> TaskState:
+    return TaskState(
+        task.project_id,
+        task.status,
+        task.priority,
+        task.due_date,
+        _hours(task.estimated_hours),
+        _hours(task.actual_hours),
+    )
+
+
+def _is_open_with_due_date(state: TaskState) -> bool:
+    return state.due_date is not None and state.status not in CLOSED_STATUSES
+
+
+async def create_project_summary(db: AsyncSession, project_id: int) -> None:
+    """新しいプロジェクトの空の集計行を作成"""
+    await db.execute(insert(ProjectTaskSummary).values(project_id=project_id))
+
+
+async def apply_task_change(
+    db: AsyncSession, old: Optional[TaskState], new: Optional[TaskState]
+) -> None:
+    """タスクの変更前後の状態から集計を差分更新する（作成時は old、削除時は new が None）
+
+    タスクの書き込みと同じトランザクションで呼ぶ。コミットは呼び出し側で行う。
+    """
+    summary_deltas: Dict[int, Dict[str, Decimal]] = {}
+    due_deltas: Dict[Tuple[int, date], int] = {}
+    for state, sign in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        deltas = summary_deltas.setdefault(state.project_id, {})
+        for column, value in (
+            ("task_count", 1),
+            (f"{state.status}_count", 1),
+            (f"{state.priority}_count", 1),
+            ("estimated_hours", state.estimated_hours),
+            ("actual_hours", state.actual_hours),
+        ):
+            deltas[column] = deltas.get(column, 0) + sign * value
+        if _is_open_with_due_date(state):
+            key = (state.project_id, state.due_date)
+            due_deltas[key] = due_deltas.get(key, 0) + sign
+
+    # 集計行はロックの順序を揃えるためプロジェクトID順に更新する
+    for project_id in sorted(summary_deltas):
+        values = {
+            column: getattr(ProjectTaskSummary, column) + delta
+            for column, delta in summary_deltas[project_id].items()
+            if delta
+        }
+        if not values:
+            continue
+        result = await db.execute(
+            update(ProjectTaskSummary)
+            .where(ProjectTaskSummary.project_id == project_id)
+            .values(values)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            # 集計行がない（集計表の導入前からあるプロジェクトなど）場合は、
+            # この書き込みを含めてタスク表から作り直す
+            await rebuild_projects(db, [project_id])
+            due_deltas = {key: count for key, count in due_deltas.items() if key[0] != project_id}
+
+    due_rows = [
+        {"project_id": project_id, "due_date": due_date, "open_count": count}
+        for (project_id, due_date), count in sorted(due_deltas.items())
+        if count
+    ]
+    if due_rows:
+        await db.execute(_upsert_due_counts(db, due_rows))
+        if any(row["open_count"] < 0 for row in due_rows):
+            await db.execute(
+                delete(ProjectTaskDueCount).where(
+                    ProjectTaskDueCount.project_id.in_({row["project_id"] for row in due_rows}),
+                    ProjectTaskDueCount.open_count <= 0,
+                )
+            )
+
+
+def _upsert_due_counts(db: AsyncSession, rows: List[Dict]):
+    """期限日ごとの件数に加算する INSERT（行があれば加算、なければ作成）"""
+    if db.bind.dialect.name == "mysql":
+        stmt = mysql.insert(ProjectTaskDueCount).values(rows)
+        return stmt.on_duplicate_key_update(
+            open_count=ProjectTaskDueCount.open_count + stmt.inserted.open_count
+        )
+    stmt = sqlite.insert(ProjectTaskDueCount).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[ProjectTaskDueCount.project_id, ProjectTaskDueCount.due_date],
+        set_={"open_count": ProjectTaskDueCount.open_count + stmt.excluded.open_count},
+    )
+
+
+async def get_project_summary(
+    db: AsyncSession, project_id: int, today: date
+) -> Tuple[ProjectTaskSummary, int]:
+    """集計行と、today 時点の期限切れ件数を取得"""
+    summary = await db.get(ProjectTaskSummary, project_id)
+    if summary is None:
+        await rebuild_projects(db, [project_id])
+        await db.commit()
+        summary = await db.get(ProjectTaskSummary, project_id)
+    overdue_count = await db.scalar(
+        select(func.coalesce(func.sum(ProjectTaskDueCount.open_count), 0)).where(
+            ProjectTaskDueCount.project_id == project_id,
+            ProjectTaskDueCount.due_date < today,
+        )
+    )
+    return summary, int(overdue_count)
+
+
+# =============================================
+# 集計の作り直し
+# =============================================
+
+async def rebuild_projects(db: AsyncSession, project_ids: Sequence[int]) -> None:
+    """指定したプロジェクトの集計をタスク表から作り直す（コミットは呼び出し側で行う）
+
+    先に集計行を削除してロックを取るため、同時に実行中のタスクの書き込みは
+    この処理のコミットを待ってから差分を加える。
+    """
+    project_ids = list(project_ids)
+    if not project_ids:
+        return
+    await db.execute(delete(ProjectTaskSummary).where(ProjectTaskSummary.project_id.in_(project_ids)))
+    await db.execute(delete(ProjectTaskDueCount).where(ProjectTaskDueCount.project_id.in_(project_ids)))
+
+    count_columns = [func.count(Task.id).label("task_count")]
+    count_columns += [
+        func.sum(case((Task.status == value, 1), else_=0)).label(f"{value}_count")
+        for value in TASK_STATUSES
+    ]
+    count_columns += [
+        func.sum(case((Task.priority == value, 1), else_=0)).label(f"{value}_count")
+        for value in TASK_PRIORITIES
+    ]
+    result = await db.execute(
+        select(
+            Task.project_id,
+            *count_columns,
+            func.coalesce(func.sum(Task.estimated_hours), 0).label("estimated_hours"),
+            func.coalesce(func.sum(Task.actual_hours), 0).label("actual_hours"),
+        )
+        .where(Task.project_id.in_(project_ids))
+        .group_by(Task.project_id)
+    )
+    summaries = {row.project_id: dict(row._mapping) for row in result}
+    empty = {column.name: 0 for column in count_columns}
+    empty.update(estimated_hours=0, actual_hours=0)
+    existing = (await db.scalars(select(Project.id).where(Project.id.in_(project_ids)))).all()
+    if existing:
+        await db.execute(
+            insert(ProjectTaskSummary),
+            [summaries.get(project_id, dict(empty, project_id=project_id)) for project_id in existing],
+        )
+
+    result = await db.execute(
+        select(Task.project_id, Task.due_date, func.count(Task.id).label("open_count"))
+        .where(
+            Task.project_id.in_(project_ids),
+            Task.due_date.is_not(None),
+            Task.status.not_in(CLOSED_STATUSES),
+        )
+        .group_by(Task.project_id, Task.due_date)
+    )
+    due_rows = [dict(row._mapping) for row in result]
+    if due_rows:
+        await db.execute(insert(ProjectTaskDueCount), due_rows)
+
+
+async def rebuild_all(db: AsyncSession) -> int:
+    """全プロジェクトの集計を REBUILD_BATCH_SIZE 件ずつ作り直し、件数を返す"""
+    project_ids = (await db.scalars(select(Project.id).order_by(Project.id))).all()
+    for start in range(0, len(project_ids), REBUILD_BATCH_SIZE):
+        await rebuild_projects(db, project_ids[start:start + REBUILD_BATCH_SIZE])
+        await db.commit()
+    # 削除済みプロジェクトの集計行が残っていれば消す
+    await db.execute(delete(ProjectTaskSummary).where(ProjectTaskSummary.project_id.not_in(select(Project.id))))
+    await db.execute(delete(ProjectTaskDueCount).where(ProjectTaskDueCount.project_id.not_in(select(Project.id))))
+    await db.commit()
+    return len(project_ids)
+
+
+async def _rebuild(project_ids: List[int]) -> int:
+    from database import AsyncSessionLocal, async_engine
+
+    try:
+        async with AsyncSessionLocal() as db:
+            if not project_ids:
+                return await rebuild_all(db)
+            await rebuild_projects(db, project_ids)
+            await db.commit()
+            return len(project_ids)
+    finally:
+        await async_engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="プロジェクトのタスク集計をタスク表から作り直す")
+    parser.add_argument("project_ids", nargs="*", type=int, help="対象のプロジェクトID（省略時はすべて）")
+    args = parser.parse_args()
+    count = asyncio.run(_rebuild(args.project_ids))
+    print(f"{count} 件のプロジェクトの集計を作り直しました")
+
+
+if __name__ == "__main__":
+    main()
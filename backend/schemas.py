@@ -1,6 +1,6 @@
-from pydantic import BaseModel, EmailStr
-from datetime import datetime
-from typing import Optional, List
+from pydantic import BaseModel, EmailStr, Field, field_validator
+from datetime import date, datetime
+from typing import Any, Dict, Literal, Optional, List
 
 # =============================================
 # 既存のスキーマ（認証関連）
@@ -59,6 +59,11 @@ class CategoryResponse(CategoryBase):
     class Config:
         from_attributes = True
 
+# 記事数付き（カテゴリ一覧用）
+class CategoryWithCountResponse(CategoryResponse):
+    post_count: int
+    published_count: int
+
 
 # タグ
 class TagBase(BaseModel):
@@ -75,6 +80,21 @@ class TagResponse(TagBase):
     class Config:
         from_attributes = True
 
+# 記事数付き（タグ一覧用）
+class TagWithCountResponse(TagResponse):
+    post_count: int
+    published_count: int
+
+# タグクラウドの1件
+class TagCloudItem(BaseModel):
+    id: int
+    name: str
+    slug: str
+    # 公開記事数
+    count: int
+    # 表示の大きさ（1〜TAG_CLOUD_WEIGHTS）
+    weight: int
+
 
 # 記事
 class PostBase(BaseModel):
@@ -88,7 +108,8 @@ class PostBase(BaseModel):
     tag_ids: Optional[List[int]] = []
 
 class PostCreate(PostBase):
-    pass
+    # 公開予約（未来の日時なら status は scheduled になり、その時刻にジョブが公開する）
+    publish_at: Optional[datetime] = None
 
 class PostUpdate(BaseModel):
     title: Optional[str] = None
@@ -99,6 +120,7 @@ class PostUpdate(BaseModel):
     status: Optional[str] = None
     category_id: Optional[int] = None
     tag_ids: Optional[List[int]] = None
+    publish_at: Optional[datetime] = None
 
 class PostResponse(BaseModel):
     id: int
@@ -138,4 +160,233 @@ class PostListResponse(BaseModel):
     tags: List[TagResponse]
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# 記事一覧の正規化レスポンス（format=normalized）
+# 著者・カテゴリ・タグは各記事には ID だけを持たせ、included にまとめて1回ずつ入れる
+class PostNormalizedItem(BaseModel):
+    id: int
+    title: str
+    slug: str
+    excerpt: Optional[str]
+    featured_image: Optional[str]
+    status: str
+    published_at: Optional[datetime]
+    view_count: int
+    created_at: datetime
+    author_id: int
+    category_id: Optional[int]
+    tag_ids: List[int]
+
+class PostIncluded(BaseModel):
+    # キーはそれぞれの ID
+    users: Dict[int, UserResponse]
+    categories: Dict[int, CategoryResponse]
+    tags: Dict[int, TagResponse]
+
+class PostListNormalizedResponse(BaseModel):
+    data: List[PostNormalizedItem]
+    included: PostIncluded
+
+# 記事の一括インポート（NDJSON の1行）
+class PostImport(PostCreate):
+    # 移行元の日時を引き継ぐ場合に指定（省略時は取り込んだ時刻）
+    published_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class BulkImportError(BaseModel):
+    line: int
+    slug: Optional[str] = None
+    error: str
+
+class BulkImportResult(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BulkImportError]
+    # エラーが多すぎて一部を省略した場合 True
+    errors_truncated: bool = False
+
+
+# 記事タグの一括変更
+class PostTagBatchRequest(BaseModel):
+    post_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    add_tag_ids: List[int] = []
+    remove_tag_ids: List[int] = []
+
+class PostTagBatchResult(BaseModel):
+    updated: List[int]
+    not_found: List[int]
+    forbidden: List[int]
+    added: int
+    removed: int
+
+
+# 読み取りリクエストの一括実行
+class BatchSubRequest(BaseModel):
+    # 応答との対応付けに使う任意の識別子
+    id: Optional[str] = None
+    method: Literal['GET'] = 'GET'
+    # クエリ文字列を含めてよい（例: /api/posts?limit=10）
+    path: str
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest] = Field(..., min_length=1)
+
+class BatchSubResponse(BaseModel):
+    id: Optional[str]
+    status: int
+    headers: Dict[str, str]
+    body: Any
+
+class BatchResponse(BaseModel):
+    responses: List[BatchSubResponse]
+
+
+# =============================================
+# プロジェクト関連のスキーマ
+# =============================================
+
+ProjectStatus = Literal['planning', 'active', 'on_hold', 'completed', 'cancelled']
+ProjectRole = Literal['owner', 'admin', 'member', 'viewer']
+TaskStatus = Literal['todo', 'in_progress', 'review', 'done', 'blocked']
+Priority = Literal['low', 'medium', 'high', 'urgent']
+
+# プロジェクト
+class ProjectBase(BaseModel):
+    name: str
+    description: Optional[str] = None
+    status: ProjectStatus = 'planning'
+    priority: Priority = 'medium'
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    budget: Optional[float] = None
+    progress: int = Field(0, ge=0, le=100)
+
+class ProjectCreate(ProjectBase):
+    pass
+
+class ProjectUpdate(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[ProjectStatus] = None
+    priority: Optional[Priority] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    budget: Optional[float] = None
+    progress: Optional[int] = Field(None, ge=0, le=100)
+
+class ProjectResponse(ProjectBase):
+    id: int
+    user_id: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# プロジェクトメンバー
+class ProjectMemberCreate(BaseModel):
+    user_id: int
+    role: ProjectRole = 'member'
+
+class ProjectMemberResponse(BaseModel):
+    project_id: int
+    user_id: int
+    role: str
+    joined_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# タスク
+class TaskBase(BaseModel):
+    title: str
+    description: Optional[str] = None
+    status: TaskStatus = 'todo'
+    priority: Priority = 'medium'
+    assigned_to: Optional[int] = None
+    due_date: Optional[date] = None
+    estimated_hours: Optional[float] = Field(None, ge=0, le=999.99)
+    actual_hours: Optional[float] = Field(None, ge=0, le=999.99)
+
+class TaskCreate(TaskBase):
+    pass
+
+class TaskUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    status: Optional[TaskStatus] = None
+    priority: Optional[Priority] = None
+    assigned_to: Optional[int] = None
+    due_date: Optional[date] = None
+    estimated_hours: Optional[float] = Field(None, ge=0, le=999.99)
+    actual_hours: Optional[float] = Field(None, ge=0, le=999.99)
+
+    # 省略はできるが、NOT NULL の列（集計の列名にも使う）に null は指定できない
+    @field_validator('title', 'status', 'priority')
+    @classmethod
+    def _reject_null(cls, value):
+        if value is None:
+            raise ValueError('null は指定できません')
+        return value
+
+class TaskResponse(TaskBase):
+    id: int
+    project_id: int
+    user_id: int
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+# ダッシュボードの集計
+class ProjectSummaryResponse(BaseModel):
+    project_id: int
+    task_count: int
+    open_count: int
+    overdue_count: int
+    by_status: Dict[str, int]
+    by_priority: Dict[str, int]
+    estimated_hours: float
+    actual_hours: float
+    updated_at: Optional[datetime]
+
+
+# =============================================
+# バックグラウンドジョブ（管理用）
+# =============================================
+
+class JobKindStats(BaseModel):
+    kind: str
+    # 実行予定時刻を過ぎて待っている数と、そのうち最も古いものの遅れ（秒）
+    queued: int = 0
+    oldest_due_seconds: Optional[float] = None
+    # 実行予定時刻がまだ先の数と、その最も早い時刻（UTC）
+    scheduled: int = 0
+    next_run_at: Optional[datetime] = None
+    running: int = 0
+    failed: int = 0
+    # 応答したワーカープロセスでの値
+    running_here: int = 0
+    processed_here: int = 0
+    avg_wait_seconds: Optional[float] = None
+    avg_duration_seconds: Optional[float] = None
+
+class JobFailure(BaseModel):
+    id: int
+    kind: str
+    payload: Optional[str]
+    attempts: int
+    last_error: Optional[str]
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class JobQueueStats(BaseModel):
+    kinds: List[JobKindStats]
+    recent_failures: List[JobFailure]
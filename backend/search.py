@@ -0,0 +1,197 @@
+import asyncio
+import math
+import re
+import unicodedata
+from collections import Counter as TermCounter
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Select, select
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Post
+
+# =============================================
+# 記事の全文検索
+# =============================================
+#
+# MySQL では posts の FULLTEXT インデックス（ngram パーサー）を MATCH ... AGAINST で使う。
+# それ以外（SQLite でのローカル検証など）では、プロセス内の転置インデックスで同じ検索を行う。
+# 転置インデックスは初回検索時に DB から作成し、以降は記事の書き込みに合わせて更新する。
+# 複数プロセスで動かす場合、他のプロセスでの書き込みは反映されない（検証用の代替実装のため）。
+
+# フィールドごとの重み（タイトルの一致を本文より高く評価する）
+FIELD_WEIGHTS = {"title": 3.0, "excerpt": 2.0, "content": 1.0}
+
+# MySQL の ngram_token_size の既定値と同じ
+NGRAM_SIZE = 2
+
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_ASCII_WORD = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """英数字は単語ごと、日本語などはそれ以外の文字の連続を ngram に分割する"""
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens: List[str] = []
+    run: List[str] = []
+
+    def flush_run():
+        if len(run) < NGRAM_SIZE:
+            tokens.extend(run)
+        else:
+            tokens.extend("".join(run[i:i + NGRAM_SIZE]) for i in range(len(run) - NGRAM_SIZE + 1))
+        run.clear()
+
+    pos = 0
+    while pos < len(text):
+        word = _ASCII_WORD.match(text, pos)
+        if word:
+            flush_run()
+            tokens.append(word.group())
+            pos = word.end()
+            continue
+        char = text[pos]
+        if char.isalnum():
+            run.append(char)
+        else:
+            flush_run()
+        pos += 1
+    flush_run()
+    return tokens
+
+
+class InvertedIndex:
+    """記事のタイトル・概要・本文の転置インデックス（BM25 で順位付け）"""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Set[str]] = {}
+        self._doc_lengths: Dict[int, float] = {}
+        self._total_length = 0.0
+        self.built = False
+        self._lock: Optional[asyncio.Lock] = None
+
+    def upsert(self, post_id: int, title: str, excerpt: Optional[str], content: str) -> None:
+        """記事を追加（既にあれば置き換え）"""
+        self.remove(post_id)
+        weighted: Dict[str, float] = {}
+        length = 0.0
+        for field, text in (("title", title), ("excerpt", excerpt), ("content", content)):
+            weight = FIELD_WEIGHTS[field]
+            for term, count in TermCounter(tokenize(text)).items():
+                weighted[term] = weighted.get(term, 0.0) + weight * count
+                length += weight * count
+        for term, tf in weighted.items():
+            self._postings.setdefault(term, {})[post_id] = tf
+        self._doc_terms[post_id] = set(weighted)
+        self._doc_lengths[post_id] = length
+        self._total_length += length
+
+    def reset(self) -> None:
+        """中身を捨て、次回の検索で DB から作り直させる"""
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self.built = False
+
+    def remove(self, post_id: int) -> None:
+        terms = self._doc_terms.pop(post_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(post_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(post_id, 0.0)
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """一致した記事を (記事ID, スコア) のスコア降順で返す"""
+        terms = set(tokenize(query))
+        if not terms or not self._doc_terms:
+            return []
+        doc_count = len(self._doc_terms)
+        average_length = self._total_length / doc_count or 1.0
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for post_id, tf in postings.items():
+                norm = 1 - BM25_B + BM25_B * self._doc_lengths[post_id] / average_length
+                scores[post_id] = scores.get(post_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+    async def ensure_built(self, db: AsyncSession) -> None:
+        """初回のみ DB の全記事からインデックスを作成"""
+        if self.built:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.built:
+                return
+            result = await db.stream(select(Post.id, Post.title, Post.excerpt, Post.content))
+            async for post_id, title, excerpt, content in result:
+                self.upsert(post_id, title, excerpt, content)
+            self.built = True
+
+
+search_index = InvertedIndex()
+
+
+def uses_fulltext(db: AsyncSession) -> bool:
+    """MySQL の FULLTEXT インデックスを使えるか"""
+    return db.bind.dialect.name == "mysql"
+
+
+def fulltext_score(query: str):
+    """MATCH ... AGAINST による関連度（0 は不一致）"""
+    return match(Post.title, Post.excerpt, Post.content, against=query).in_natural_language_mode()
+
+
+def index_post(post: Post) -> None:
+    """記事の書き込みを転置インデックスに反映（未作成なら何もしない）"""
+    if search_index.built:
+        search_index.upsert(post.id, post.title, post.excerpt, post.content)
+
+
+def unindex_post(post_id: int) -> None:
+    if search_index.built:
+        search_index.remove(post_id)
+
+
+async def search_post_ids(
+    db: AsyncSession,
+    query: str,
+    apply_filters: Callable[[Select], Select],
+    limit: int,
+    offset: int,
+) -> List[int]:
+    """検索語に一致し、apply_filters の条件を満たす記事IDを関連度順に1ページ分返す"""
+    if uses_fulltext(db):
+        score = fulltext_score(query)
+        stmt = apply_filters(select(Post.id).where(score > 0))
+        stmt = stmt.order_by(score.desc(), Post.id.desc()).offset(offset).limit(limit)
+        return list((await db.scalars(stmt)).all())
+
+    await search_index.ensure_built(db)
+    ranked = [post_id for post_id, _ in search_index.search(query)]
+    if not ranked:
+        return []
+
+    # 条件での絞り込みは DB で行い、順位は転置インデックスのものを使う
+    matched: Set[int] = set()
+    for start in range(0, len(ranked), 1000):
+        stmt = apply_filters(select(Post.id).where(Post.id.in_(ranked[start:start + 1000])))
+        matched.update((await db.scalars(stmt)).all())
+    return [post_id for post_id in ranked if post_id in matched][offset:offset + limit]
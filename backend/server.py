@@ -0,0 +1,156 @@
+import asyncio
+import importlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# 本番用の起動（gunicorn + uvicorn ワーカー）
+# =============================================
+#
+# `gunicorn -c gunicorn.conf.py` で起動する（設定は gunicorn.conf.py）。
+#
+# - アプリはマスタープロセスで1回だけ読み込み（preload）、ワーカーは fork して共有する。
+#   ライブラリの import、SQLAlchemy のマッパー設定、Pydantic のスキーマ構築、ルートの登録、
+#   OpenAPI のスキーマ作成はマスターで済ませ、ワーカーの起動と再起動では行わない。
+#   その内訳（起動時間レポート）をログとメトリクス（startup_phase_seconds）に出す。
+# - 各ワーカーは接続を受け付ける前に（lifespan の startup で）コネクションプールに
+#   SERVER_WARMUP_CONNECTIONS 本の接続を張り、カテゴリ・タグの一覧とタグのインデックスを
+#   読み込む。失敗してもログを出して起動を続ける（最初のリクエストで通常どおり読み込む）。
+#
+# `python server.py` はサーバーを起動せずに起動時間レポートだけを出す。
+# 既定の uvicorn での起動（開発用）では、どちらも行わない。
+
+# ワーカーの起動時にエンジンごとに張っておく接続の数（0 で無効。既定は DB_POOL_SIZE）
+SERVER_WARMUP_CONNECTIONS = int(os.getenv("SERVER_WARMUP_CONNECTIONS", os.getenv("DB_POOL_SIZE", "10")))
+
+startup_phase_seconds = Gauge(
+    "startup_phase_seconds", "アプリの読み込みにかかった時間（秒。マスタープロセスで計測）", ["phase"]
+)
+worker_warmup_seconds = Gauge(
+    "worker_warmup_seconds", "ワーカーの起動時の準備にかかった時間（秒）", ["step"]
+)
+
+# 読み込みの段階と、その段階で import するモジュール（前の段階で import 済みのものは除いて計測する）
+STARTUP_PHASES = (
+    ("libraries", ("fastapi", "starlette", "pydantic", "sqlalchemy.ext.asyncio", "jose", "passlib.context")),
+    ("database", ("database",)),
+    ("models", ("models",)),
+    ("schemas", ("schemas",)),
+    ("routes", ("main",)),
+)
+
+_phases: List[Tuple[str, float]] = []
+
+
+@contextmanager
+def _phase(name: str) -> Iterator[None]:
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        _phases.append((name, elapsed))
+        startup_phase_seconds.set(elapsed, phase=name)
+
+
+def load_app():
+    """アプリを段階ごとに時間を計って読み込み、起動時間レポートを出す"""
+    for name, modules in STARTUP_PHASES:
+        with _phase(name):
+            for module in modules:
+                importlib.import_module(module)
+            if name == "models":
+                # マッパーの設定は最初のクエリまで遅延されるため、ここで済ませる
+                from sqlalchemy.orm import configure_mappers
+                configure_mappers()
+    import main
+
+    with _phase("openapi"):
+        main.app.openapi()
+    main.app.add_event_handler("startup", warm_up)
+    _report()
+    return main.app
+
+
+def _report() -> None:
+    total = sum(elapsed for _, elapsed in _phases)
+    lines = [f"  {name:<10} {elapsed:8.3f}s  {elapsed / total * 100 if total else 0:5.1f}%" for name, elapsed in _phases]
+    logger.info("起動時間の内訳:\n%s\n  %-10s %8.3fs", "\n".join(lines), "total", total)
+
+
+def reset_after_fork() -> None:
+    """fork したワーカーで、マスターから引き継いだプールの接続を使わないようにする"""
+    from database import async_engine, engine, replica_router
+
+    engine.dispose(close=False)
+    for target in [async_engine] + replica_router.engines:
+        target.sync_engine.dispose(close=False)
+
+
+# =============================================
+# ワーカーの起動時の準備
+# =============================================
+
+async def _warm_pool(target, size: int) -> None:
+    """接続を size 本同時に張ってプールに戻す"""
+    from sqlalchemy import text
+
+    async def check_out():
+        conn = await target.connect()
+        await conn.execute(text("SELECT 1"))
+        return conn
+
+    results = await asyncio.gather(*(check_out() for _ in range(size)), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    for conn in results:
+        if not isinstance(conn, BaseException):
+            await conn.close()
+    if errors:
+        raise errors[0]
+
+
+async def _warm_pools() -> None:
+    from database import async_engine, replica_router
+
+    if SERVER_WARMUP_CONNECTIONS <= 0:
+        return
+    await asyncio.gather(*(
+        _warm_pool(target, SERVER_WARMUP_CONNECTIONS) for target in [async_engine] + replica_router.engines
+    ))
+
+
+async def _prime_caches() -> None:
+    from database import AsyncSessionLocal
+    from tag_index import tag_index
+    from taxonomy_cache import category_cache, tag_cache
+
+    async with AsyncSessionLocal() as db:
+        await category_cache.get(db)
+        await tag_cache.get(db)
+        await tag_index.ensure_fresh(db)
+
+
+async def warm_up() -> None:
+    """接続を受け付ける前に、コネクションプールとキャッシュを準備する"""
+    for step, run in (("pool", _warm_pools), ("caches", _prime_caches)):
+        started_at = time.perf_counter()
+        try:
+            await run()
+        except Exception:
+            logger.exception("起動時の準備（%s）に失敗しました", step)
+            continue
+        elapsed = time.perf_counter() - started_at
+        worker_warmup_seconds.set(elapsed, step=step)
+        logger.info("起動時の準備（%s）: %.3fs (pid %s)", step, elapsed, os.getpid())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    load_app()
@@ -0,0 +1,432 @@
+import asyncio
+import heapq
+import os
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Post, PostTag
+from response_cache import PostState
+
+# =============================================
+# タグ・ステータス・カテゴリのビットマップインデックス
+# =============================================
+#
+# 複数タグでの絞り込み（tag_ids= と match=all|any、exclude_tag_ids=）を post_tags の
+# 自己結合や GROUP BY HAVING で行わず、プロセス内に持つ記事IDのビットマップの
+# 積・和・差で求める。ステータスとカテゴリも同じビットマップで持ち、絞り込んだ結果から
+# 1ページ分の記事IDを選んでから、主キーで1回だけ DB から読む。
+#
+# ビットマップは Roaring Bitmap と同じく記事IDの上位16ビットごとのチャンクに分け、
+# 要素が少ないチャンクは下位16ビットのソート済み配列、多いチャンクは 65536 ビットの
+# 整数で持つ（どちらのチャンクも最大 8KB）。
+#
+# インデックスは初回の絞り込み時に DB から作成し、以降は記事の書き込みに合わせて更新する。
+# 他のプロセスでの書き込みは変更通知を受けて作り直す（main.py の _apply_remote_change）ほか、
+# 取りこぼしに備えて TAG_INDEX_MAX_AGE 秒ごとに作り直す。
+
+# インデックスを DB から作り直す間隔（秒）
+TAG_INDEX_MAX_AGE = float(os.getenv("TAG_INDEX_MAX_AGE", "60"))
+
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+CHUNK_BYTES = (1 << CHUNK_BITS) // 8
+# これより要素の多いチャンクはビット列で持つ（配列とビット列の大きさが釣り合う件数）
+ARRAY_MAX = 4096
+
+# 1バイトの値 -> 立っているビットの位置
+_BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+Container = Union[array, int]
+
+
+def _to_bits(container: Container) -> int:
+    if isinstance(container, int):
+        return container
+    buffer = bytearray(CHUNK_BYTES)
+    for value in container:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def _iter_bits(bits: int, reverse: bool = False) -> Iterator[int]:
+    data = bits.to_bytes(CHUNK_BYTES, "little")
+    positions = range(CHUNK_BYTES - 1, -1, -1) if reverse else range(CHUNK_BYTES)
+    for position in positions:
+        byte = data[position]
+        if byte:
+            offsets = _BYTE_BITS[byte]
+            for bit in (reversed(offsets) if reverse else offsets):
+                yield position << 3 | bit
+
+
+def _normalize(container: Container) -> Optional[Container]:
+    """要素数に合う表現に変換（空なら None）"""
+    if isinstance(container, int):
+        count = bin(container).count("1")
+        if count == 0:
+            return None
+        if count <= ARRAY_MAX:
+            return array("H", _iter_bits(container))
+        return container
+    if not container:
+        return None
+    if len(container) > ARRAY_MAX:
+        return _to_bits(container)
+    return container
+
+
+def _and(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int) and isinstance(b, int):
+        return _normalize(a & b)
+    if isinstance(a, int):
+        a, b = b, a
+    if isinstance(b, int):
+        data = b.to_bytes(CHUNK_BYTES, "little")
+        return _normalize(array("H", (value for value in a if data[value >> 3] >> (value & 7) & 1)))
+    return _normalize(array("H", sorted(set(a).intersection(b))))
+
+
+def _or(a: Container, b: Container) -> Container:
+    if isinstance(a, int) or isinstance(b, int) or len(a) + len(b) > ARRAY_MAX:
+        return _normalize(_to_bits(a) | _to_bits(b))
+    return array("H", sorted(set(a).union(b)))
+
+
+def _sub(a: Container, b: Container) -> Optional[Container]:
+    if isinstance(a, int):
+        return _normalize(a & ~_to_bits(b))
+    if isinstance(b, int):
+        data = b.to_bytes(CHUNK_BYTES, "little")
+        return _normalize(array("H", (value for value in a if not data[value >> 3] >> (value & 7) & 1)))
+    return _normalize(array("H", sorted(set(a).difference(b))))
+
+
+class PostIdBitmap:
+    """記事IDの集合（チャンクごとに配列かビット列で持つ圧縮ビットマップ）"""
+
+    __slots__ = ("_chunks",)
+
+    def __init__(self, chunks: Optional[Dict[int, Container]] = None):
+        self._chunks: Dict[int, Container] = chunks or {}
+
+    @classmethod
+    def from_ids(cls, post_ids: Iterable[int]) -> "PostIdBitmap":
+        grouped: Dict[int, List[int]] = {}
+        for post_id in post_ids:
+            grouped.setdefault(post_id >> CHUNK_BITS, []).append(post_id & CHUNK_MASK)
+        return cls({
+            key: _normalize(array("H", sorted(set(values))))
+            for key, values in grouped.items()
+        })
+
+    def add(self, post_id: int) -> None:
+        key, value = post_id >> CHUNK_BITS, post_id & CHUNK_MASK
+        container = self._chunks.get(key)
+        if container is None:
+            self._chunks[key] = array("H", [value])
+        elif isinstance(container, int):
+            self._chunks[key] = container | 1 << value
+        else:
+            index = bisect_left(container, value)
+            if index == len(container) or container[index] != value:
+                container.insert(index, value)
+                if len(container) > ARRAY_MAX:
+                    self._chunks[key] = _to_bits(container)
+
+    def discard(self, post_id: int) -> None:
+        key, value = post_id >> CHUNK_BITS, post_id & CHUNK_MASK
+        container = self._chunks.get(key)
+        if container is None:
+            return
+        if isinstance(container, int):
+            container = _normalize(container & ~(1 << value))
+        else:
+            index = bisect_left(container, value)
+            if index < len(container) and container[index] == value:
+                container.pop(index)
+            container = _normalize(container)
+        if container is None:
+            del self._chunks[key]
+        else:
+            self._chunks[key] = container
+
+    def __contains__(self, post_id: int) -> bool:
+        container = self._chunks.get(post_id >> CHUNK_BITS)
+        if container is None:
+            return False
+        value = post_id & CHUNK_MASK
+        if isinstance(container, int):
+            return bool(container >> value & 1)
+        index = bisect_left(container, value)
+        return index < len(container) and container[index] == value
+
+    def __len__(self) -> int:
+        return sum(
+            bin(container).count("1") if isinstance(container, int) else len(container)
+            for container in self._chunks.values()
+        )
+
+    def __iter__(self) -> Iterator[int]:
+        return self._iterate(reverse=False)
+
+    def __reversed__(self) -> Iterator[int]:
+        return self._iterate(reverse=True)
+
+    def _iterate(self, reverse: bool) -> Iterator[int]:
+        for key in sorted(self._chunks, reverse=reverse):
+            container = self._chunks[key]
+            base = key << CHUNK_BITS
+            if isinstance(container, int):
+                values = _iter_bits(container, reverse)
+            else:
+                values = reversed(container) if reverse else iter(container)
+            for value in values:
+                yield base | value
+
+    def __and__(self, other: "PostIdBitmap") -> "PostIdBitmap":
+        chunks = {}
+        for key in self._chunks.keys() & other._chunks.keys():
+            container = _and(self._chunks[key], other._chunks[key])
+            if container is not None:
+                chunks[key] = container
+        return PostIdBitmap(chunks)
+
+    def __or__(self, other: "PostIdBitmap") -> "PostIdBitmap":
+        chunks = dict(self._chunks)
+        for key, container in other._chunks.items():
+            chunks[key] = _or(chunks[key], container) if key in chunks else container
+        return PostIdBitmap(chunks)
+
+    def __sub__(self, other: "PostIdBitmap") -> "PostIdBitmap":
+        chunks = {}
+        for key, container in self._chunks.items():
+            if key in other._chunks:
+                container = _sub(container, other._chunks[key])
+            if container is not None:
+                chunks[key] = container
+        return PostIdBitmap(chunks)
+
+
+EMPTY = PostIdBitmap()
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _sort_value(created_at: datetime) -> float:
+    # タイムゾーンなしの日時をそのまま比較できる数値にする
+    return (created_at.replace(tzinfo=None) - _EPOCH).total_seconds()
+
+
+class _IndexData:
+    """作成した時点のインデックスの中身（作り直すときは丸ごと差し替える）"""
+
+    def __init__(self):
+        self.all_posts = PostIdBitmap()
+        self.tags: Dict[int, PostIdBitmap] = {}
+        self.categories: Dict[int, PostIdBitmap] = {}
+        self.statuses: Dict[str, PostIdBitmap] = {}
+        # 記事IDを添字にした created_at（並び順のキー）
+        self.created = array("d")
+        # created_at が記事IDの順に並んでいるか（並んでいれば ID の降順に読むだけで済む）
+        self.ordered_by_id = True
+        self.max_post_id = 0
+
+    def set_created(self, post_id: int, created_at: datetime) -> None:
+        if post_id >= len(self.created):
+            self.created.extend([0.0] * (post_id + 1 - len(self.created)))
+        value = _sort_value(created_at)
+        if self.created[post_id] == value:
+            return
+        self.created[post_id] = value
+        if post_id > self.max_post_id:
+            if self.max_post_id and value < self.created[self.max_post_id]:
+                self.ordered_by_id = False
+            self.max_post_id = post_id
+        elif post_id < self.max_post_id:
+            self.ordered_by_id = False
+
+    def apply(self, post_id: int, old: Optional[PostState], new: Optional[PostState]) -> None:
+        for state, present in ((old, False), (new, True)):
+            if state is None:
+                continue
+            status, category_id, tag_ids = state
+            bitmaps = [self.statuses.setdefault(status, PostIdBitmap())]
+            if category_id is not None:
+                bitmaps.append(self.categories.setdefault(category_id, PostIdBitmap()))
+            bitmaps += [self.tags.setdefault(tag_id, PostIdBitmap()) for tag_id in set(tag_ids)]
+            for bitmap in bitmaps:
+                if present:
+                    bitmap.add(post_id)
+                else:
+                    bitmap.discard(post_id)
+        if new is None:
+            self.all_posts.discard(post_id)
+        else:
+            self.all_posts.add(post_id)
+
+
+class TagIndex:
+    """記事の絞り込み用のビットマップインデックス"""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._data: Optional[_IndexData] = None
+        self._built_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        # 作成中に行われた書き込み（作成後に適用し直す）
+        self._pending: Optional[List[Tuple]] = None
+
+    @property
+    def built(self) -> bool:
+        return self._data is not None
+
+    def update(
+        self,
+        post_id: int,
+        old: Optional[PostState],
+        new: Optional[PostState],
+        created_at: Optional[datetime] = None,
+    ) -> None:
+        """記事の書き込みを反映（作成時は old、削除時は new が None。作成時は created_at も渡す）"""
+        if self._pending is not None:
+            self._pending.append((post_id, old, new, created_at))
+        if self._data is None:
+            return
+        if created_at is not None:
+            self._data.set_created(post_id, created_at)
+        elif new is not None and post_id not in self._data.all_posts:
+            # 他のプロセスで作成されてまだ取り込んでいない記事は、次回の作り直しで反映する
+            self._built_at = 0.0
+            return
+        self._data.apply(post_id, old, new)
+
+    def reset(self) -> None:
+        """中身を捨て、次回の絞り込みで DB から作り直させる"""
+        self._data = None
+
+    def expire(self) -> None:
+        """次回の絞り込みで DB から作り直させる（作り直す間は今の中身を使う）"""
+        self._built_at = 0.0
+
+    async def ensure_fresh(self, db: AsyncSession) -> None:
+        """未作成か古くなっていれば DB から作り直す（作り直す間は古いものを使い続ける）"""
+        if self._data is not None and time.monotonic() - self._built_at < self.max_age:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked() and self._data is not None:
+            return
+        async with self._lock:
+            if self._data is not None and time.monotonic() - self._built_at < self.max_age:
+                return
+            self._pending = []
+            try:
+                data = await _load(db)
+                for post_id, old, new, created_at in self._pending:
+                    if created_at is not None:
+                        data.set_created(post_id, created_at)
+                    data.apply(post_id, old, new)
+            finally:
+                self._pending = None
+            self._data = data
+            self._built_at = time.monotonic()
+
+    def filter(
+        self,
+        tag_ids: List[int],
+        match_all: bool,
+        exclude_tag_ids: List[int],
+        status: Optional[str],
+        category_id: Optional[int],
+    ) -> PostIdBitmap:
+        """条件に一致する記事IDの集合（小さい集合から順に積を取る）
+
+        結果はインデックスのチャンクを共有するため、書き込みの反映を挟まずに
+        （await せずに）読み終えること。
+        """
+        data = self._data
+        required: List[PostIdBitmap] = []
+        if tag_ids:
+            tags = [data.tags.get(tag_id, EMPTY) for tag_id in tag_ids]
+            if match_all:
+                required += tags
+            else:
+                union = PostIdBitmap()
+                for bitmap in tags:
+                    union = union | bitmap
+                required.append(union)
+        if status:
+            required.append(data.statuses.get(status, EMPTY))
+        if category_id:
+            required.append(data.categories.get(category_id, EMPTY))
+        if not required:
+            required.append(data.all_posts)
+
+        required.sort(key=len)
+        result = required[0]
+        for bitmap in required[1:]:
+            result = result & bitmap
+        for tag_id in exclude_tag_ids:
+            result = result - data.tags.get(tag_id, EMPTY)
+        return result
+
+    def page(
+        self,
+        post_ids: PostIdBitmap,
+        limit: int,
+        offset: int = 0,
+        after: Optional[Tuple[datetime, int]] = None,
+    ) -> List[int]:
+        """(created_at, id) の降順で1ページ分の記事IDを選ぶ（after はカーソルの位置）"""
+        created = self._data.created
+        wanted = offset + limit
+        if after is not None:
+            cursor_key = (_sort_value(after[0]), after[1])
+            candidates = (post_id for post_id in reversed(post_ids) if (created[post_id], post_id) < cursor_key)
+        else:
+            candidates = reversed(post_ids)
+
+        if self._data.ordered_by_id:
+            selected = []
+            for post_id in candidates:
+                selected.append(post_id)
+                if len(selected) >= wanted:
+                    break
+        else:
+            selected = heapq.nlargest(wanted, candidates, key=lambda post_id: (created[post_id], post_id))
+        return selected[offset:]
+
+
+async def _load(db: AsyncSession) -> _IndexData:
+    data = _IndexData()
+    tag_ids: Dict[int, List[int]] = {}
+    result = await db.stream(select(PostTag.post_id, PostTag.tag_id))
+    async for post_id, tag_id in result:
+        tag_ids.setdefault(tag_id, []).append(post_id)
+    data.tags = {tag_id: PostIdBitmap.from_ids(post_ids) for tag_id, post_ids in tag_ids.items()}
+
+    all_posts: List[int] = []
+    statuses: Dict[str, List[int]] = {}
+    categories: Dict[int, List[int]] = {}
+    result = await db.stream(
+        select(Post.id, Post.status, Post.category_id, Post.created_at).order_by(Post.id)
+    )
+    async for post_id, status, category_id, created_at in result:
+        all_posts.append(post_id)
+        statuses.setdefault(status, []).append(post_id)
+        if category_id is not None:
+            categories.setdefault(category_id, []).append(post_id)
+        data.set_created(post_id, created_at)
+    data.all_posts = PostIdBitmap.from_ids(all_posts)
+    data.statuses = {status: PostIdBitmap.from_ids(ids) for status, ids in statuses.items()}
+    data.categories = {category_id: PostIdBitmap.from_ids(ids) for category_id, ids in categories.items()}
+    return data
+
+
+tag_index = TagIndex(TAG_INDEX_MAX_AGE)
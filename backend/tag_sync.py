@@ -0,0 +1,73 @@
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import PostTag
+
+# =============================================
+# 記事タグの同期
+# =============================================
+#
+# 記事のタグを付け替えるときは、現在のタグと指定されたタグの差分だけを
+# 複数行 INSERT と IN 句つきの DELETE でまとめて反映する。コミットは呼び出し側で1回行う。
+
+# 1文で扱う記事数の上限（IN 句やプレースホルダーが大きくなりすぎないようにする）
+BATCH_SIZE = 1000
+
+
+async def sync_post_tags(
+    db: AsyncSession, post_id: int, current: Iterable[int], requested: Iterable[int]
+) -> Tuple[Set[int], Set[int]]:
+    """記事のタグを requested に揃え、(追加したタグ, 削除したタグ) を返す"""
+    current, requested = set(current), set(requested)
+    added, removed = requested - current, current - requested
+    if removed:
+        await db.execute(
+            delete(PostTag).where(PostTag.post_id == post_id, PostTag.tag_id.in_(removed))
+        )
+    if added:
+        await db.execute(insert(PostTag), [{"post_id": post_id, "tag_id": tag_id} for tag_id in added])
+    return added, removed
+
+
+async def get_tag_ids_by_post(db: AsyncSession, post_ids: List[int]) -> Dict[int, Set[int]]:
+    """記事IDごとのタグIDをまとめて取得"""
+    tag_ids: Dict[int, Set[int]] = {post_id: set() for post_id in post_ids}
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        rows = await db.execute(
+            select(PostTag.post_id, PostTag.tag_id)
+            .where(PostTag.post_id.in_(post_ids[start:start + BATCH_SIZE]))
+        )
+        for post_id, tag_id in rows:
+            tag_ids[post_id].add(tag_id)
+    return tag_ids
+
+
+async def batch_update_tags(
+    db: AsyncSession, current: Dict[int, Set[int]], add: Set[int], remove: Set[int]
+) -> Tuple[int, int]:
+    """複数記事にタグを追加・削除し、(追加件数, 削除件数) を返す
+
+    current は対象記事ごとの現在のタグ。実際に変化する組み合わせだけを書き込む。
+    """
+    add = add - remove
+    to_insert = [
+        {"post_id": post_id, "tag_id": tag_id}
+        for post_id, tags in current.items()
+        for tag_id in sorted(add - tags)
+    ]
+    to_delete = [
+        (post_id, tag_id)
+        for post_id, tags in current.items()
+        for tag_id in sorted(remove & tags)
+    ]
+    for start in range(0, len(to_delete), BATCH_SIZE):
+        await db.execute(
+            delete(PostTag).where(
+                tuple_(PostTag.post_id, PostTag.tag_id).in_(to_delete[start:start + BATCH_SIZE])
+            )
+        )
+    for start in range(0, len(to_insert), BATCH_SIZE):
+        await db.execute(insert(PostTag), to_insert[start:start + BATCH_SIZE])
+    return len(to_insert), len(to_delete)
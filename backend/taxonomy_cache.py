@@ -0,0 +1,77 @@
+import asyncio
+import os
+import time
+from typing import List, Optional, Type
+
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from cache import CachedBody
+from instrumentation import measure_serialization
+from models import Category, Tag
+from schemas import CategoryWithCountResponse, TagWithCountResponse
+
+# =============================================
+# カテゴリ・タグ一覧のキャッシュ
+# =============================================
+#
+# カテゴリとタグは1日に数回しか変わらないのに、ほぼすべてのページ表示で取得される。
+# 一覧（記事数付き）をシリアライズ済みの JSON として保持し、作成時と記事数の変化時に
+# バージョンを進めて破棄する。
+# 他のプロセスでの変更は変更通知を受けて破棄する（main.py の _apply_remote_change）。
+# 通知を取りこぼした場合も TAXONOMY_CACHE_TTL 秒以内に反映される。
+
+TAXONOMY_CACHE_TTL = float(os.getenv("TAXONOMY_CACHE_TTL", "60"))
+
+
+class TaxonomyCache:
+    """テーブル全体の一覧レスポンスをバージョン付きで保持する"""
+
+    def __init__(self, model, schema: Type[BaseModel], ttl: float):
+        self.model = model
+        self.adapter = TypeAdapter(List[schema])
+        self.ttl = ttl
+        self.version = 0
+        self._snapshot: Optional[CachedBody] = None
+        self._snapshot_version = -1
+        self._expires_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _fresh(self) -> Optional[CachedBody]:
+        if self._snapshot_version == self.version and time.monotonic() < self._expires_at:
+            return self._snapshot
+        return None
+
+    async def get(self, db: AsyncSession) -> CachedBody:
+        """シリアライズ済みの一覧を返す（古ければ DB から読み直す）"""
+        snapshot = self._fresh()
+        if snapshot is not None:
+            return snapshot
+
+        # 同時に期限切れを検知したリクエストでも、読み直しは1回だけにする
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            snapshot = self._fresh()
+            if snapshot is not None:
+                return snapshot
+            version = self.version
+            rows = (await db.scalars(select(self.model).order_by(self.model.id))).all()
+            with measure_serialization():
+                body = self.adapter.dump_json(self.adapter.validate_python(rows, from_attributes=True))
+            snapshot = CachedBody.from_body(body)
+            # 読み込み中に無効化された場合は、次のリクエストで読み直させる
+            if version == self.version:
+                self._snapshot = snapshot
+                self._snapshot_version = version
+                self._expires_at = time.monotonic() + self.ttl
+            return snapshot
+
+    def invalidate(self) -> None:
+        """次のリクエストで DB から読み直させる"""
+        self.version += 1
+
+
+category_cache = TaxonomyCache(Category, CategoryWithCountResponse, TAXONOMY_CACHE_TTL)
+tag_cache = TaxonomyCache(Tag, TagWithCountResponse, TAXONOMY_CACHE_TTL)
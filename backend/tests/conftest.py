@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+# アプリのモジュールは import 時に DATABASE_URL を読むため、先に SQLite の一時ファイルを指定する
+_db_dir = tempfile.mkdtemp(prefix="dashboard-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import database
+import models  # noqa: F401  テーブル定義を Base に登録する
+import main
+from response_cache import response_cache
+
+database.Base.metadata.create_all(database.engine)
+
+
+class StatementCounter:
+    """非同期エンジンで実行された SQL を記録する"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def selects(self) -> int:
+        return sum(1 for statement in self.statements if statement.lstrip().upper().startswith("SELECT"))
+
+
+@pytest.fixture
+def count_statements():
+    """ブロック内で実行された SQL を数える（呼ぶ前にレスポンスキャッシュを空にする）"""
+    engine = database.async_engine.sync_engine
+
+    class Counting:
+        def __enter__(self):
+            asyncio.run(response_cache.clear())
+            self.counter = StatementCounter()
+            event.listen(engine, "before_cursor_execute", self.counter)
+            return self.counter
+
+        def __exit__(self, *exc):
+            event.remove(engine, "before_cursor_execute", self.counter)
+
+    return Counting
+
+
+@pytest.fixture(scope="session")
+def client():
+    # lifespan（閲覧数・変更通知・ジョブのバックグラウンド処理）は起動しない。
+    # バックグラウンドの SQL が数に混ざらないようにするため
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/api/auth/register", json={"username": "tester", "email": "tester@example.com", "password": "pw"})
+    response = client.post("/api/auth/login", json={"email": "tester@example.com", "password": "pw"})
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
@@ -0,0 +1,89 @@
+"""記事のエンドポイントの SQL の数が件数・タグ数によって増えないこと（N+1 がないこと）"""
+import pytest
+
+from renditions import rendition_refresher
+
+TAG_COUNT = 10
+POST_COUNT = 40
+
+
+@pytest.fixture(autouse=True)
+def _no_rendition_refresh():
+    # 閲覧数のずれによる保存済みレスポンスの作り直し（応答後の処理）を数に含めない
+    rendition_refresher._recent.clear()
+    yield
+
+
+@pytest.fixture(scope="module")
+def dataset(client, auth_headers):
+    category = client.post("/api/categories", json={"name": "queries", "slug": "queries"}, headers=auth_headers)
+    tag_ids = []
+    for i in range(TAG_COUNT):
+        tag = client.post("/api/tags", json={"name": f"q{i}", "slug": f"q{i}"}, headers=auth_headers)
+        tag_ids.append(tag.json()["id"])
+    post_ids = []
+    for i in range(POST_COUNT):
+        response = client.post("/api/posts", json={
+            "title": f"post {i}", "slug": f"queries-{i}", "content": "本文",
+            "status": "published", "category_id": category.json()["id"],
+            "tag_ids": tag_ids[:1 + i % TAG_COUNT],
+        }, headers=auth_headers)
+        assert response.status_code == 201
+        post_ids.append(response.json()["id"])
+    return {"tag_ids": tag_ids, "post_ids": post_ids}
+
+
+def _selects(count_statements, request):
+    with count_statements() as counter:
+        response = request()
+    assert response.status_code < 300, response.text
+    assert counter.selects > 0
+    return counter.selects
+
+
+def test_list_query_count_does_not_grow_with_page_size(client, dataset, count_statements):
+    small = _selects(count_statements, lambda: client.get("/api/posts?limit=5"))
+    large = _selects(count_statements, lambda: client.get("/api/posts?limit=30"))
+    assert len(client.get("/api/posts?limit=30").json()) == 30
+    assert small == large
+
+
+def test_list_by_tag_query_count_does_not_grow_with_page_size(client, dataset, count_statements):
+    tag_id = dataset["tag_ids"][0]
+    small = _selects(count_statements, lambda: client.get(f"/api/posts?limit=5&tag_id={tag_id}"))
+    large = _selects(count_statements, lambda: client.get(f"/api/posts?limit=30&tag_id={tag_id}"))
+    assert small == large
+
+
+@pytest.mark.parametrize("fields", [None, "id,title,tags"])
+def test_detail_query_count_does_not_grow_with_tags(client, dataset, count_statements, fields):
+    one_tag, all_tags = dataset["post_ids"][0], dataset["post_ids"][TAG_COUNT - 1]
+    suffix = f"?fields={fields}" if fields else ""
+    few = _selects(count_statements, lambda: client.get(f"/api/posts/{one_tag}{suffix}"))
+    many = _selects(count_statements, lambda: client.get(f"/api/posts/{all_tags}{suffix}"))
+    assert len(client.get(f"/api/posts/{all_tags}").json()["tags"]) == TAG_COUNT
+    assert few == many
+
+
+def test_create_query_count_does_not_grow_with_tags(client, auth_headers, dataset, count_statements):
+    def create(slug, tag_ids):
+        return lambda: client.post("/api/posts", json={
+            "title": slug, "slug": slug, "content": "本文", "status": "published", "tag_ids": tag_ids,
+        }, headers=auth_headers)
+
+    few = _selects(count_statements, create("create-few", dataset["tag_ids"][:1]))
+    many = _selects(count_statements, create("create-many", dataset["tag_ids"]))
+    assert few == many
+
+
+def test_update_query_count_does_not_grow_with_tags(client, auth_headers, dataset, count_statements):
+    post_id = dataset["post_ids"][0]
+
+    def update(title, tag_ids):
+        return lambda: client.put(
+            f"/api/posts/{post_id}", json={"title": title, "tag_ids": tag_ids}, headers=auth_headers
+        )
+
+    few = _selects(count_statements, update("few", dataset["tag_ids"][:2]))
+    many = _selects(count_statements, update("many", dataset["tag_ids"]))
+    assert few == many
@@ -0,0 +1,43 @@
+"""タスクの更新の入力検証（集計を壊す値は 422 で断る）"""
+import pytest
+
+
+@pytest.fixture(scope="module")
+def task(client, auth_headers):
+    project = client.post("/api/projects", json={"name": "tasks"}, headers=auth_headers)
+    assert project.status_code == 201, project.text
+    response = client.post(
+        f"/api/projects/{project.json()['id']}/tasks",
+        json={"title": "task", "status": "todo", "priority": "high"},
+        headers=auth_headers,
+    )
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def _summary(client, auth_headers, project_id):
+    response = client.get(f"/api/projects/{project_id}/summary", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.parametrize("field", ["status", "priority", "title"])
+def test_update_task_rejects_null(client, auth_headers, task, field):
+    before = _summary(client, auth_headers, task["project_id"])
+    response = client.put(f"/api/tasks/{task['id']}", json={field: None}, headers=auth_headers)
+    assert response.status_code == 422, response.text
+    assert client.get(f"/api/tasks/{task['id']}", headers=auth_headers).json()[field] == task[field]
+    assert _summary(client, auth_headers, task["project_id"]) == before
+
+
+@pytest.mark.parametrize("field", ["estimated_hours", "actual_hours"])
+def test_update_task_rejects_hours_out_of_range(client, auth_headers, task, field):
+    response = client.put(f"/api/tasks/{task['id']}", json={field: 1000}, headers=auth_headers)
+    assert response.status_code == 422, response.text
+
+
+def test_update_task_allows_omitted_fields(client, auth_headers, task):
+    response = client.put(f"/api/tasks/{task['id']}", json={"description": "更新"}, headers=auth_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["status"] == task["status"]
+    assert response.json()["priority"] == task["priority"]
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import case, update
+
+from database import AsyncSessionLocal
+from metrics import Counter
+from models import Post
+
+logger = logging.getLogger(__name__)
+
+# =============================================
+# 閲覧数のバッファリング
+# =============================================
+#
+# 記事詳細の閲覧ごとに UPDATE + COMMIT すると、人気記事の行がロックの奪い合いになる。
+# ここではプロセス内のメモリに閲覧数を貯めておき、一定間隔または一定件数ごとに
+# 1回の UPDATE ... CASE でまとめて加算する。
+#
+# 失われうる閲覧数の上限:
+#   フラッシュは未反映の合計が VIEW_COUNT_FLUSH_THRESHOLD 件に達した時点、または
+#   VIEW_COUNT_FLUSH_INTERVAL 秒ごとに行われる。書き込み中にも次の分が貯まるため、
+#   DB への書き込みが成功している間は、プロセスがクラッシュした場合に失われるのは
+#   おおよそ「2 × VIEW_COUNT_FLUSH_THRESHOLD 件」かつ「直近およそ 2 × VIEW_COUNT_FLUSH_INTERVAL 秒分」。
+#   DB への書き込みに失敗した分はメモリに戻し、次回のフラッシュで再試行する。
+#   失敗が続く間はメモリ上の未反映分が増えるため、VIEW_COUNT_MAX_PENDING 件を上限にし、
+#   それを超えた閲覧は記録せずに捨てる（view_count_dropped_total）。そのためクラッシュ時に
+#   失われるのは、最悪で「未反映分 + 書き込み中の分」の 2 × VIEW_COUNT_MAX_PENDING 件。
+#   正常終了（shutdown イベント）時は、実行中のフラッシュを待ってから残りをすべて書き込む。
+
+VIEW_COUNT_FLUSH_INTERVAL = float(os.getenv("VIEW_COUNT_FLUSH_INTERVAL", "5"))
+VIEW_COUNT_FLUSH_THRESHOLD = int(os.getenv("VIEW_COUNT_FLUSH_THRESHOLD", "1000"))
+VIEW_COUNT_MAX_PENDING = int(os.getenv("VIEW_COUNT_MAX_PENDING", str(VIEW_COUNT_FLUSH_THRESHOLD * 10)))
+
+view_count_dropped_total = Counter(
+    "view_count_dropped_total", "未反映の閲覧数が上限に達していたため捨てた閲覧の数"
+)
+
+
+class ViewCountBuffer:
+    """記事ごとの閲覧数をメモリに集計し、まとめて DB に反映する"""
+
+    def __init__(self, flush_interval: float, flush_threshold: int, max_pending: int):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending
+        self._counts: Dict[int, int] = {}
+        self._total = 0
+        self._lock = threading.Lock()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def hit(self, post_id: int) -> None:
+        """閲覧を1件記録（DB へは書き込まない）"""
+        with self._lock:
+            if self._total >= self.max_pending:
+                view_count_dropped_total.inc()
+                return
+            self._counts[post_id] = self._counts.get(post_id, 0) + 1
+            self._total += 1
+            should_flush = self._total >= self.flush_threshold
+        if should_flush and self._wakeup is not None:
+            self._wakeup.set()
+
+    def pending(self, post_id: int) -> int:
+        """まだ DB に反映されていない閲覧数"""
+        with self._lock:
+            return self._counts.get(post_id, 0)
+
+    async def flush(self) -> int:
+        """貯まっている閲覧数を1回の UPDATE で反映し、反映した件数を返す"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._total = 0
+        if not counts:
+            return 0
+
+        stmt = (
+            update(Post)
+            .where(Post.id.in_(list(counts)))
+            .values(view_count=Post.view_count + case(counts, value=Post.id, else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception:
+            # 失敗した分は戻して次回に再試行する
+            with self._lock:
+                for post_id, count in counts.items():
+                    self._counts[post_id] = self._counts.get(post_id, 0) + count
+                    self._total += count
+            raise
+        return sum(counts.values())
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("閲覧数の書き込みに失敗しました")
+
+    def start(self) -> None:
+        """定期フラッシュのタスクを開始"""
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """定期フラッシュを止め、残りをすべて書き込む"""
+        if self._task is not None:
+            # 書き込み中のフラッシュは取り消さずに終わるのを待つ（取り消すと取り出した分が失われる）
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+view_counter = ViewCountBuffer(VIEW_COUNT_FLUSH_INTERVAL, VIEW_COUNT_FLUSH_THRESHOLD, VIEW_COUNT_MAX_PENDING)
@@ -26,6 +26,9 @@ CREATE TABLE IF NOT EXISTS categories (
     name VARCHAR(100) NOT NULL UNIQUE,
     slug VARCHAR(100) NOT NULL UNIQUE,
     description TEXT,
+    -- 記事数（記事の書き込みごとに更新。ずれた場合は post_counters.py で修正）
+    post_count INT NOT NULL DEFAULT 0,
+    published_count INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     INDEX idx_slug (slug)
@@ -36,8 +39,13 @@ CREATE TABLE IF NOT EXISTS tags (
     id INT AUTO_INCREMENT PRIMARY KEY,
     name VARCHAR(50) NOT NULL UNIQUE,
     slug VARCHAR(50) NOT NULL UNIQUE,
+    -- 記事数（記事の書き込みごとに更新。ずれた場合は post_counters.py で修正）
+    post_count INT NOT NULL DEFAULT 0,
+    published_count INT NOT NULL DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    INDEX idx_slug (slug)
+    INDEX idx_slug (slug),
+    -- タグクラウド用（公開記事の多い順）
+    INDEX idx_published_count (published_count)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 記事テーブル
@@ -50,7 +58,7 @@ CREATE TABLE IF NOT EXISTS posts (
     content TEXT NOT NULL,
     excerpt TEXT,
     featured_image VARCHAR(255),
-    status ENUM('draft', 'published', 'archived') DEFAULT 'draft',
+    status ENUM('draft', 'published', 'archived', 'scheduled') DEFAULT 'draft',
     published_at TIMESTAMP NULL,
     view_count INT DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -61,7 +69,26 @@ CREATE TABLE IF NOT EXISTS posts (
     INDEX idx_category_id (category_id),
     INDEX idx_slug (slug),
     INDEX idx_status (status),
-    INDEX idx_published_at (published_at)
+    INDEX idx_published_at (published_at),
+    -- 一覧のキーセットページング用（ORDER BY created_at DESC, id DESC）
+    INDEX idx_created_at_id (created_at, id),
+    INDEX idx_status_created_at_id (status, created_at, id),
+    INDEX idx_category_created_at_id (category_id, created_at, id),
+    -- 公開予約の記事を公開日時の順に取得する（status = 'scheduled'）
+    INDEX idx_status_published_at (status, published_at),
+    -- 全文検索用（日本語を分かち書きなしで検索できるよう ngram パーサーを使用）
+    FULLTEXT INDEX ft_title_excerpt_content (title, excerpt, content) WITH PARSER ngram
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 記事詳細のレスポンス（記事の書き込み時に JSON と gzip・brotli の圧縮済みの本文を保存）
+CREATE TABLE IF NOT EXISTS post_renditions (
+    post_id INT PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    body MEDIUMBLOB NOT NULL,
+    gzip_body MEDIUMBLOB NOT NULL,
+    br_body MEDIUMBLOB,
+    rendered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (post_id) REFERENCES posts(id) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 記事とタグの中間テーブル
@@ -136,4 +163,69 @@ CREATE TABLE IF NOT EXISTS tasks (
     INDEX idx_assigned_to (assigned_to),
     INDEX idx_status (status),
     INDEX idx_due_date (due_date)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- プロジェクトのタスク集計テーブル（タスクの書き込みごとに差分更新）
+CREATE TABLE IF NOT EXISTS project_task_summaries (
+    project_id INT PRIMARY KEY,
+    task_count INT NOT NULL DEFAULT 0,
+    todo_count INT NOT NULL DEFAULT 0,
+    in_progress_count INT NOT NULL DEFAULT 0,
+    review_count INT NOT NULL DEFAULT 0,
+    done_count INT NOT NULL DEFAULT 0,
+    blocked_count INT NOT NULL DEFAULT 0,
+    low_count INT NOT NULL DEFAULT 0,
+    medium_count INT NOT NULL DEFAULT 0,
+    high_count INT NOT NULL DEFAULT 0,
+    urgent_count INT NOT NULL DEFAULT 0,
+    estimated_hours DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    actual_hours DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- プロジェクト・期限日ごとの未完了タスク数（期限切れ件数の集計用）
+CREATE TABLE IF NOT EXISTS project_task_due_counts (
+    project_id INT NOT NULL,
+    due_date DATE NOT NULL,
+    open_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (project_id, due_date),
+    FOREIGN KEY (project_id) REFERENCES projects(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =============================================
+-- 変更通知
+-- =============================================
+
+-- 変更通知のアウトボックス（書き込みと同じトランザクションで追加し、/api/events で配信）
+CREATE TABLE IF NOT EXISTS change_events (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    entity VARCHAR(20) NOT NULL,
+    entity_id INT,
+    op VARCHAR(10) NOT NULL,
+    audience TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- =============================================
+-- バックグラウンドジョブ
+-- =============================================
+
+-- バックグラウンドジョブ（日時はすべて UTC。backend/jobs.py が取得・実行する）
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    payload TEXT,
+    status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 5,
+    run_at DATETIME NOT NULL,
+    dedupe_key VARCHAR(100) UNIQUE,
+    locked_by VARCHAR(64),
+    locked_until DATETIME NULL,
+    last_error TEXT,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_status_run_at (status, run_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
\ No newline at end of file
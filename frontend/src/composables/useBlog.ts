@@ -196,6 +196,57 @@ class BlogManager {
     }
   }
 
+  // 記事一覧・カテゴリ・タグを1回のリクエストでまとめて取得（一覧画面の初期表示用）
+  async fetchInitialData(params?: {
+    status?: string;
+    category_id?: number;
+    tag_id?: number;
+    limit?: number;
+    offset?: number;
+  }): Promise<void> {
+    this.loading.value = true;
+    this.error.value = "";
+
+    const query = new URLSearchParams();
+    Object.entries(params || {}).forEach(([key, value]) => {
+      if (value !== undefined && value !== "") {
+        query.append(key, String(value));
+      }
+    });
+    const postsPath = query.toString()
+      ? `${API_ENDPOINTS.BLOG.POSTS}?${query}`
+      : API_ENDPOINTS.BLOG.POSTS;
+
+    try {
+      const response = await axios.post<{
+        responses: { id: string; status: number; body: any }[];
+      }>(`${API_BASE_URL}${API_ENDPOINTS.BATCH}`, {
+        requests: [
+          { id: "posts", path: postsPath },
+          { id: "categories", path: API_ENDPOINTS.BLOG.CATEGORIES },
+          { id: "tags", path: API_ENDPOINTS.BLOG.TAGS },
+        ],
+      });
+      for (const item of response.data.responses) {
+        if (item.status !== 200) {
+          if (item.id === "posts") {
+            this.error.value =
+              item.body?.detail || "記事の取得に失敗しました";
+          }
+          continue;
+        }
+        if (item.id === "posts") this.posts.value = item.body;
+        if (item.id === "categories") this.categories.value = item.body;
+        if (item.id === "tags") this.tags.value = item.body;
+      }
+    } catch (err: any) {
+      this.error.value =
+        err.response?.data?.detail || "記事の取得に失敗しました";
+    } finally {
+      this.loading.value = false;
+    }
+  }
+
   // Private methods
   private getToken(): string | null {
     return localStorage.getItem(STORAGE_KEYS.ACCESS_TOKEN);
@@ -232,5 +283,6 @@ export function useBlog() {
     deletePost: (id: number) => blogManager!.deletePost(id),
     fetchCategories: () => blogManager!.fetchCategories(),
     fetchTags: () => blogManager!.fetchTags(),
+    fetchInitialData: (params?: any) => blogManager!.fetchInitialData(params),
   };
 }
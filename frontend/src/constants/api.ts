@@ -18,6 +18,8 @@ export const API_ENDPOINTS = {
     CATEGORIES: "/api/categories",
     TAGS: "/api/tags",
   },
+  // 読み取りリクエストの一括実行
+  BATCH: "/api/batch",
   // プロジェクト関連（今後）
   PROJECTS: {
     LIST: "/api/projects",